@@ -17,6 +17,10 @@ class Config:
     QUERY_TRANSFORM_PROMPT_FILE = os.getenv("QUERY_TRANSFORM_PROMPT_FILE", "query_transform.txt")
     SYSTEM_PROMPT = os.getenv("SYSTEM_PROMPT")
     
+    # Адаптивная трансформация запроса: без LLM для первого и самодостаточных вопросов
+    QUERY_TRANSFORM_ADAPTIVE = os.getenv("QUERY_TRANSFORM_ADAPTIVE", "true").lower() == "true"
+    QUERY_TRANSFORM_CACHE_SIZE = int(os.getenv("QUERY_TRANSFORM_CACHE_SIZE", "1000"))  # Переписанных запросов
+    
     # Embeddings Configuration
     EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", "openai")  # openai/huggingface
     HUGGINGFACE_EMBEDDING_MODEL = os.getenv("HUGGINGFACE_EMBEDDING_MODEL", "intfloat/multilingual-e5-base")
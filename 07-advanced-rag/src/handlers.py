@@ -122,6 +122,14 @@ async def cmd_index_status(message: Message):
             f"• Cross-encoder: {stats.get('cross_encoder_model', 'N/A').split('/')[-1]}\n"
         )
     
+    query_stats = stats.get('query_transform')
+    if query_stats:
+        status_text += (
+            f"• Трансформация запроса: LLM {query_stats['rewritten']}, "
+            f"без LLM {query_stats['bypassed']}, из кеша {query_stats['cached']} "
+            f"(сэкономлено ~{query_stats['saved_ms'] / 1000:.1f} с)\n"
+        )
+    
     # Информация об embeddings
     status_text += f"\n🧬 *Embeddings: {stats['embedding_provider']}*\n"
     if stats['embedding_provider'] == 'openai':
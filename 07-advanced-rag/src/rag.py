@@ -1,7 +1,11 @@
+import hashlib
 import logging
+import re
+import time
+from collections import OrderedDict
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough
+from langchain_core.runnables import RunnableLambda, RunnablePassthrough
 from langchain_openai import ChatOpenAI
 from langchain_community.retrievers import BM25Retriever
 from langchain_classic.retrievers import EnsembleRetriever
@@ -21,6 +25,43 @@ _retrieval_query_transform_prompt = None
 _llm_query_transform = None
 _llm = None
 
+# Адаптивная трансформация запроса: кеш переписанных запросов по хешу истории
+# и статистика (сколько LLM вызовов сэкономлено)
+_query_rewrite_cache = OrderedDict()
+query_rewrite_stats = {"rewritten": 0, "bypassed": 0, "cached": 0, "avg_rewrite_ms": 0.0, "saved_ms": 0.0}
+
+# Эвристика "вопрос понятен без истории диалога". Одна и та же в 07-advanced-rag/src/rag.py
+# (нужна ли LLM трансформация запроса) и 10-guard/src/semantic_cache.py (можно ли кешировать
+# ответ): модули курса - отдельные проекты и не импортируют друг друга, поэтому копии
+# держим одинаковыми и меняем вместе.
+
+# Слова-отсылки к предыдущим сообщениям ("а его можно закрыть?", "а для этого вклада?")
+_CONTEXT_WORDS = frozenset("""
+он она оно они его ее её их ему ей им ими него нее неё них нему ней ним
+это этот эта эти этого этой этому этим этих этом
+тот та те того той тому тем тех том такой такая такое такие таких
+там туда тогда выше ранее предыдущий предыдущая предыдущее последний последняя
+еще ещё тоже также второй первый
+""".split())
+# Первые слова продолжения диалога ("а если...", "и сколько...")
+_CONTINUATION_WORDS = frozenset({"а", "и", "но", "тогда"})
+# Вопросы короче ("а ставка?", "сколько стоит?") почти всегда опираются на историю
+_MIN_SELF_CONTAINED_WORDS = 3
+
+_WORD_RE = re.compile(r"[0-9a-zа-яё]+")
+
+def is_history_independent(text: str) -> bool:
+    """
+    Вопрос понятен без предыдущих сообщений
+
+    Нет, если в нем меньше _MIN_SELF_CONTAINED_WORDS слов, он начинается как продолжение
+    диалога ("а если...", "и сколько...") или содержит местоимения и отсылки ("его", "этот", "там", "еще").
+    """
+    words = _WORD_RE.findall(text.lower())
+    if len(words) < _MIN_SELF_CONTAINED_WORDS or words[0] in _CONTINUATION_WORDS:
+        return False
+    return not any(word in _CONTEXT_WORDS for word in words)
+
 def create_semantic_retriever():
     """Создание semantic retriever из vector store"""
     if vector_store is None:
@@ -254,6 +295,84 @@ def get_retrieval_query_transformation_chain():
         | StrOutputParser()
     )
 
+def needs_query_rewrite(messages) -> bool:
+    """
+    Нужна ли LLM трансформация запроса перед retrieval
+    
+    Не нужна, если:
+    - в диалоге одно сообщение пользователя (нечего учитывать из истории)
+    - последний вопрос самодостаточный: без местоимений и отсылок ("его", "этот", "еще")
+      и не продолжение ("а если...", "и сколько...")
+    """
+    if sum(1 for msg in messages if msg.type == "human") <= 1:
+        return False
+    return not is_history_independent(messages[-1].content)
+
+def _history_key(messages) -> str:
+    """Хеш истории диалога - ключ кеша переписанных запросов"""
+    digest = hashlib.sha256()
+    for msg in messages:
+        digest.update(f"{msg.type}\x00{msg.content}\x00".encode("utf-8"))
+    return digest.hexdigest()
+
+def _record_saved(reason: str, query: str):
+    """Учет сэкономленного вызова LLM (оценка - среднее время прошлых трансформаций)"""
+    query_rewrite_stats[reason] += 1
+    query_rewrite_stats["saved_ms"] += query_rewrite_stats["avg_rewrite_ms"]
+    logger.info(
+        f"Query transform skipped ({reason}), saved ~{query_rewrite_stats['avg_rewrite_ms']:.0f} ms: {query[:100]}"
+    )
+
+def _record_rewrite(key: str, query: str, started: float):
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    count = query_rewrite_stats["rewritten"] = query_rewrite_stats["rewritten"] + 1
+    query_rewrite_stats["avg_rewrite_ms"] += (elapsed_ms - query_rewrite_stats["avg_rewrite_ms"]) / count
+    _query_rewrite_cache[key] = query
+    while len(_query_rewrite_cache) > config.QUERY_TRANSFORM_CACHE_SIZE:
+        _query_rewrite_cache.popitem(last=False)
+    logger.info(f"Query transformed in {elapsed_ms:.0f} ms: {query[:100]}")
+
+def _cached_rewrite(messages):
+    """Запрос без вызова LLM (как есть или из кеша) и ключ кеша; None - нужна трансформация"""
+    if not config.QUERY_TRANSFORM_ADAPTIVE:
+        return None, _history_key(messages)
+    if not needs_query_rewrite(messages):
+        query = messages[-1].content
+        _record_saved("bypassed", query)
+        return query, None
+    key = _history_key(messages)
+    if key in _query_rewrite_cache:
+        _query_rewrite_cache.move_to_end(key)
+        query = _query_rewrite_cache[key]
+        _record_saved("cached", query)
+        return query, key
+    return None, key
+
+def _rewrite_query(inputs: dict) -> str:
+    query, key = _cached_rewrite(inputs["messages"])
+    if query is not None:
+        return query
+    started = time.perf_counter()
+    query = get_retrieval_query_transformation_chain().invoke(inputs)
+    _record_rewrite(key, query, started)
+    return query
+
+async def _arewrite_query(inputs: dict) -> str:
+    query, key = _cached_rewrite(inputs["messages"])
+    if query is not None:
+        return query
+    started = time.perf_counter()
+    query = await get_retrieval_query_transformation_chain().ainvoke(inputs)
+    _record_rewrite(key, query, started)
+    return query
+
+def get_adaptive_query_chain():
+    """
+    Адаптивная трансформация запроса: LLM вызывается только когда без истории
+    вопрос непонятен, результат кешируется по хешу истории
+    """
+    return RunnableLambda(_rewrite_query, afunc=_arewrite_query)
+
 def get_rag_chain():
     """Финальная RAG-цепочка возвращающая answer и documents в LCEL стиле"""
     if retriever is None:
@@ -267,7 +386,7 @@ def get_rag_chain():
         # LCEL цепочка с reranking: ensemble_docs → rerank → documents → answer
         return (
             RunnablePassthrough.assign(
-                ensemble_docs=get_retrieval_query_transformation_chain() | retriever
+                ensemble_docs=get_adaptive_query_chain() | retriever
             )
             # Шаг reranking: переранжируем документы cross-encoder
             | RunnablePassthrough.assign(
@@ -290,10 +409,10 @@ def get_rag_chain():
     
     # Для semantic и hybrid режимов - стандартная цепочка без reranking
     # LCEL цепочка в стиле из референсного ноутбука
-    # Шаг 1: Получаем documents через query transformation
+    # Шаг 1: Получаем documents через query transformation (только когда она нужна)
     return (
         RunnablePassthrough.assign(
-            documents=get_retrieval_query_transformation_chain() | retriever
+            documents=get_adaptive_query_chain() | retriever
         )
         # Шаг 2: Генерируем ответ на основе documents
         | RunnablePassthrough.assign(
@@ -360,5 +479,8 @@ def get_vector_store_stats():
         stats["cross_encoder_model"] = config.CROSS_ENCODER_MODEL
         stats["reranker_top_k"] = config.RERANKER_TOP_K
     
+    # Трансформация запроса: сколько вызовов LLM пропущено
+    stats["query_transform"] = dict(query_rewrite_stats)
+    
     return stats
 
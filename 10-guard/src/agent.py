@@ -10,6 +10,8 @@ ReAct = Reasoning + Acting - паттерн где агент:
 """
 import json
 import logging
+import re
+from collections import OrderedDict
 
 from langchain_openai import ChatOpenAI
 from langchain.agents import create_agent
@@ -17,14 +19,44 @@ from langchain.agents.middleware import HumanInTheLoopMiddleware
 from langchain.agents.middleware import PIIMiddleware
 from langchain.agents.middleware import ModelCallLimitMiddleware, ToolCallLimitMiddleware
 from langgraph.checkpoint.memory import MemorySaver
-from langchain_core.messages import ToolMessage
-from langchain_mcp_adapters.client import MultiServerMCPClient
+from langchain_core.messages import AIMessage, HumanMessage, RemoveMessage, ToolMessage
+from langgraph.types import Command
+
+from checkpointer import BoundedSqliteSaver
+from history import HistoryMiddleware
+from mcp_pool import MCPSessionPool
+from tool_execution import ToolStepTimeoutMiddleware
 
 from config import config
 from tools import rag_search
+import rag
+import semantic_cache
 
 logger = logging.getLogger(__name__)
 
+# Телефоны для PIIMiddleware и маскирования потокового текста
+PHONE_NUMBER_PATTERN = r"(?:([+]?[78])[-.\s]?)(?:[(](\d{1,3})[)][-.\s]?)?(\d{1,4})[-.\s]?(\d{1,4})[-.\s]?(\d{1,9})"
+# Номера карт в потоковом тексте (финальный ответ маскирует PIIMiddleware)
+_CARD_NUMBER_RE = re.compile(r"\b(?:\d[ -]?){12,18}\d\b")
+_PHONE_NUMBER_RE = re.compile(PHONE_NUMBER_PATTERN)
+
+
+def _create_checkpointer():
+    """
+    sqlite: активные чаты в памяти, все - в файле (переживает перезапуск, память ограничена)
+    memory: MemorySaver, история только в памяти процесса
+    """
+    if config.CHECKPOINT_BACKEND == "sqlite":
+        logger.info(f"Conversation history: {config.CHECKPOINT_DB_PATH}")
+        return BoundedSqliteSaver(
+            config.CHECKPOINT_DB_PATH,
+            keep_versions=config.CHECKPOINT_KEEP_VERSIONS,
+            idle_seconds=config.CHECKPOINT_IDLE_SECONDS,
+            flush_interval=config.CHECKPOINT_FLUSH_INTERVAL,
+            retention_days=config.CHECKPOINT_RETENTION_DAYS,
+        )
+    return MemorySaver()
+
 
 async def create_bank_agent():
     """
@@ -36,7 +68,7 @@ async def create_bank_agent():
     3. currency_converter - конвертация валют (MCP)
     
     Returns:
-        Скомпилированный агент LangChain 1.0 с MemorySaver для сохранения истории диалогов
+        Скомпилированный агент LangChain 1.0 с checkpointer для сохранения истории диалогов
     """
     logger.info("Creating bank agent using create_agent()...")
     
@@ -52,40 +84,37 @@ async def create_bank_agent():
     # Базовый инструмент - поиск в PDF документах
     tools = [rag_search]
     
-    # Подключаем MCP инструменты (search_products, currency_converter)
-    if config.MCP_ENABLED:
-        try:
-            logger.info(f"Connecting to MCP server '{config.MCP_SERVER_NAME}' at {config.MCP_SERVER_URL}...")
-            
-            # Создаем MCP клиент для подключения к MCP серверу
-            mcp_client = MultiServerMCPClient({
-                config.MCP_SERVER_NAME: {
-                    "transport": config.MCP_SERVER_TRANSPORT,
-                    "url": config.MCP_SERVER_URL
-                }
-            })
-            
-            # Получаем инструменты от MCP сервера
-            mcp_tools = await mcp_client.get_tools()
-            
-            if mcp_tools:
-                tools.extend(mcp_tools)
-                logger.info(f"✓ Connected to MCP server, loaded {len(mcp_tools)} tools:")
-                for tool in mcp_tools:
-                    logger.info(f"  - {tool.name}: {tool.description}")
-            else:
-                logger.warning("⚠️  MCP server connected but no tools returned")
-                
-        except Exception as e:
-            logger.warning(f"⚠️  Failed to connect to MCP server: {e}")
-            logger.warning("   Agent will work without MCP tools (search_products, currency_converter)")
+    # MCP инструменты (search_products, currency_converter) - из пула постоянных сессий
+    # Если сервер появится позже, пул зарегистрирует инструменты и агент будет пересобран
+    if mcp_pool is not None:
+        tools.extend(mcp_pool.tools)
+        if not mcp_pool.tools:
+            logger.warning("   Agent will work without MCP tools until the server is available")
             logger.warning("   To enable MCP tools, start the server: make run-mcp-bank")
     else:
         logger.info("ℹ️  MCP is disabled (MCP_ENABLED=false), agent will use only rag_search")
     
-    # MemorySaver - сохраняет историю диалога в памяти (для многошагового диалога)
+    # Checkpointer - сохраняет историю диалога (для многошагового диалога)
     # Каждый chat_id получает свою независимую историю
-    checkpointer = MemorySaver()
+    # Создается один раз: при пересборке агента (новые MCP инструменты) история сохраняется
+    global checkpointer, history_middleware
+    if checkpointer is None:
+        checkpointer = _create_checkpointer()
+    
+    # 📉 Ограничение истории: старые ходы суммаризируются в фоне, старые результаты
+    # rag_search заменяются заглушкой - промпт не растет с каждым сообщением
+    if config.HISTORY_SUMMARY_ENABLED and history_middleware is None:
+        history_middleware = HistoryMiddleware(
+            token_budget=config.HISTORY_TOKEN_BUDGET,
+            max_tokens=config.HISTORY_MAX_TOKENS,
+            keep_turns=config.HISTORY_KEEP_TURNS,
+            model=config.HISTORY_SUMMARY_MODEL,
+        )
+    middleware = [history_middleware] if history_middleware is not None else []
+    
+    # ⚡ Несколько tool_calls одного шага выполняются одновременно (ToolNode, asyncio.gather);
+    # общий таймаут шага отменяет зависший вызов, время каждого вызова - в логе
+    middleware.append(ToolStepTimeoutMiddleware(step_timeout=config.TOOL_STEP_TIMEOUT))
     
     # create_agent() - API LangChain 1.0
     # Автоматически создает ReAct loop (цикл рассуждения и действий)
@@ -96,6 +125,7 @@ async def create_bank_agent():
         system_prompt=system_prompt,
         checkpointer=checkpointer,
         middleware=[
+            *middleware,
             # 🔒 Model Call Limit
             ModelCallLimitMiddleware(
                 run_limit=2,
@@ -116,7 +146,7 @@ async def create_bank_agent():
             ),
             PIIMiddleware(
                 "phone_number",
-                detector=r"(?:([+]?[78])[-.\s]?)(?:[(](\d{1,3})[)][-.\s]?)?(\d{1,4})[-.\s]?(\d{1,4})[-.\s]?(\d{1,9})",
+                detector=PHONE_NUMBER_PATTERN,
                 strategy="mask",
                 apply_to_input=False,
                 apply_to_output=True
@@ -142,6 +172,23 @@ async def create_bank_agent():
 
 # Глобальный экземпляр агента (создается один раз при старте бота)
 bank_agent = None
+checkpointer = None
+history_middleware = None
+# Постоянные сессии MCP сервера (None если MCP_ENABLED=false)
+mcp_pool = None
+
+# Ответы из FAQ и семантического кеша, еще не записанные в историю агента
+# Ключ: chat_id, Значение: [HumanMessage, AIMessage, ...] - добавляются к следующему запросу агента
+# LRU по чатам: клиент, который спросил FAQ и ушел, не держит память процесса вечно
+_cached_exchanges: OrderedDict[int, list] = OrderedDict()
+_MAX_CACHED_EXCHANGE_CHATS = 10000
+# Сколько последних пар вопрос-ответ чата хранится до следующего запроса агента
+_MAX_CACHED_EXCHANGES_PER_CHAT = 5
+
+# Сообщения turn, остановленного interrupt (HITL) - продолжаются в agent_resume
+_interrupted_turns: dict[int, dict] = {}
+
+EMPTY_ANSWER = "Извините, не смог сформировать ответ. Попробуйте переформулировать вопрос."
 
 
 async def initialize_agent():
@@ -151,12 +198,54 @@ async def initialize_agent():
     Паттерн singleton - создаем агента только один раз и переиспользуем
     Асинхронная функция так как подключение к MCP серверу асинхронное
     """
-    global bank_agent
+    global bank_agent, mcp_pool
     if bank_agent is None:
+        if config.MCP_ENABLED and mcp_pool is None:
+            logger.info(f"Connecting to MCP server '{config.MCP_SERVER_NAME}' at {config.MCP_SERVER_URL}...")
+            mcp_pool = MCPSessionPool(
+                config.MCP_SERVER_NAME,
+                {"transport": config.MCP_SERVER_TRANSPORT, "url": config.MCP_SERVER_URL},
+                size=config.MCP_POOL_SIZE,
+                health_interval=config.MCP_HEALTH_INTERVAL,
+                max_reconnect_delay=config.MCP_RECONNECT_MAX_DELAY,
+                on_tools_changed=_rebuild_agent,
+            )
+            await mcp_pool.start(wait=config.MCP_CONNECT_TIMEOUT)
         bank_agent = await create_bank_agent()
     return bank_agent
 
 
+async def _rebuild_agent(tools):
+    """Набор MCP инструментов изменился (сервер подключился или обновился) - пересобираем агента"""
+    global bank_agent
+    if bank_agent is None:
+        # Первая загрузка при старте - агент еще создается в initialize_agent
+        return
+    logger.info(f"MCP tools changed ({len(tools)} tools), rebuilding agent...")
+    # Запросы, которые уже выполняются, доработают на прежнем графе; история общая (checkpointer)
+    bank_agent = await create_bank_agent()
+
+
+async def close_agent():
+    """Закрытие MCP сессий и запись несохраненной истории диалогов при остановке бота"""
+    if mcp_pool is not None:
+        await mcp_pool.close()
+    if isinstance(checkpointer, BoundedSqliteSaver):
+        checkpointer.close()
+
+
+def get_mcp_stats():
+    """Состояние MCP сессий и время вызовов инструментов (None если MCP выключен)"""
+    return mcp_pool.stats() if mcp_pool is not None else None
+
+
+def get_checkpointer_stats():
+    """Статистика хранилища истории (None для MemorySaver)"""
+    if isinstance(checkpointer, BoundedSqliteSaver):
+        return checkpointer.stats()
+    return None
+
+
 def _log_agent_step(msg):
     """
     Логирует один шаг работы агента для отладки
@@ -179,8 +268,11 @@ def _log_agent_step(msg):
             logger.info(f"    🔧 Tool: {tc['name']}")
             logger.info(f"    Args: {tc['args']}")
     elif hasattr(msg, 'name') and msg.name:
-        # ToolMessage - результат работы инструмента
-        logger.info(f"    📦 Tool: {msg.name}")
+        # ToolMessage - результат работы инструмента (и время вызова из ToolStepTimeoutMiddleware)
+        wall_time_ms = msg.response_metadata.get("wall_time_ms")
+        timing = f" ({wall_time_ms:.0f} ms)" if wall_time_ms is not None else ""
+        status = " ❌" if getattr(msg, "status", None) == "error" else ""
+        logger.info(f"    📦 Tool: {msg.name}{timing}{status}")
         logger.info(f"    Result: {str(msg.content)[:200]}...")
     elif hasattr(msg, 'content'):
         # Обычное сообщение (вопрос пользователя или финальный ответ)
@@ -193,11 +285,24 @@ def _log_agent_step(msg):
                 logger.warning("    ⚠️ AIMessage with empty content and no tool_calls!")
 
 
-def _extract_documents_from_current_request(messages):
+def _log_parallel_tools(messages):
+    """Шаг с несколькими вызовами: время шага (самый долгий вызов) против суммы вызовов"""
+    wall_times = [
+        msg.response_metadata["wall_time_ms"] for msg in messages
+        if isinstance(msg, ToolMessage) and "wall_time_ms" in msg.response_metadata
+    ]
+    if len(wall_times) > 1:
+        logger.info(
+            f"  ⚡ {len(wall_times)} tools in parallel: step {max(wall_times):.0f} ms "
+            f"(sequential would take {sum(wall_times):.0f} ms)"
+        )
+
+
+def _extract_documents_from_current_request(turn_messages):
     """
-    Извлекает documents из всех ToolMessage с rag_search после последнего HumanMessage
+    Извлекает documents из всех ToolMessage с rag_search текущего turn
     
-    ВАЖНО: Берем только текущий turn (после последнего вопроса пользователя),
+    ВАЖНО: Берем только текущий turn (сообщения, полученные в stream после вопроса),
     НЕ всю историю диалога! Это нужно для:
     1. Показа источников только для текущего ответа (SHOW_SOURCES)
     2. Правильной оценки контекста в RAGAS evaluation
@@ -205,35 +310,93 @@ def _extract_documents_from_current_request(messages):
     Агент может вызвать rag_search несколько раз за один turn - собираем все.
     
     Args:
-        messages: список сообщений из final_state агента
+        turn_messages: сообщения текущего turn (из _collect_turn_messages)
     
     Returns:
         list[dict]: список documents с ключами "source", "page_content" и опционально "page"
     """
     documents = []
-    
-    # Находим индекс последнего HumanMessage (начало текущего turn)
-    last_human_idx = -1
-    for i in range(len(messages) - 1, -1, -1):
-        if messages[i].type == "human":
-            last_human_idx = i
-            break
-    
-    # Собираем все ToolMessage с rag_search после последнего HumanMessage
-    if last_human_idx != -1:
-        for msg in messages[last_human_idx:]:
-            if isinstance(msg, ToolMessage) and msg.name == "rag_search":
-                try:
-                    data = json.loads(msg.content)
-                    sources = data.get("sources", [])
-                    documents.extend(sources)
-                except json.JSONDecodeError:
-                    logger.warning("Failed to parse rag_search result as JSON")
+    for msg in turn_messages:
+        if isinstance(msg, ToolMessage) and msg.name == "rag_search":
+            # Полные документы - в artifact (в content для LLM - сжатые фрагменты)
+            if isinstance(msg.artifact, dict) and "sources" in msg.artifact:
+                documents.extend(msg.artifact["sources"])
+                continue
+            try:
+                data = json.loads(msg.content)
+                sources = data.get("sources", [])
+                documents.extend(sources)
+            except json.JSONDecodeError:
+                logger.warning("Failed to parse rag_search result as JSON")
     
     return documents
 
 
-async def _run_agent_stream(inputs, agent_config, chat_id: int):
+def _context_tokens_saved(turn_messages):
+    """Токены, сэкономленные сжатием результатов rag_search в текущем turn"""
+    saved = 0
+    for msg in turn_messages:
+        if isinstance(msg, ToolMessage) and isinstance(msg.artifact, dict):
+            saved += msg.artifact.get("tokens_full", 0) - msg.artifact.get("tokens_compact", 0)
+    return saved
+
+
+def _tools_used_in_current_request(turn_messages):
+    """Имена инструментов, вызванных в текущем turn"""
+    return {msg.name for msg in turn_messages if isinstance(msg, ToolMessage)}
+
+
+def _collect_turn_messages(turn: dict, node_name: str, messages: list):
+    """
+    Накопление сообщений текущего turn из обновлений stream (вместо чтения всего состояния)
+    
+    Новые сообщения добавляются по id, сообщения с уже известным id заменяются
+    (PIIMiddleware возвращает замаскированный ответ модели с тем же id).
+    Middleware может вернуть весь список сообщений состояния (PIIMiddleware.after_model):
+    из такого обновления берутся только сообщения после последнего вопроса клиента -
+    сам вопрос и прошлые ходы в turn не попадают.
+    Обновления before_agent пропускаются - это перезапись прошлой истории (HistoryMiddleware).
+    """
+    if node_name.endswith(".before_agent"):
+        return
+    human_positions = [i for i, msg in enumerate(messages) if isinstance(msg, HumanMessage)]
+    if human_positions:
+        messages = messages[human_positions[-1] + 1:]
+    for msg in messages:
+        if isinstance(msg, RemoveMessage):
+            continue
+        turn[msg.id or id(msg)] = msg
+
+
+def _final_answer_message(turn_messages):
+    """Последний ответ модели в turn (после него могут идти только служебные сообщения)"""
+    for msg in reversed(turn_messages):
+        if isinstance(msg, AIMessage):
+            return msg
+    return None
+
+
+def _remember_exchange(chat_id: int, question: str, answer: str):
+    """Ответ без вызова агента - в историю чата он попадет со следующим запросом агента"""
+    exchange = _cached_exchanges.pop(chat_id, [])
+    exchange.extend([HumanMessage(content=question), AIMessage(content=answer)])
+    _cached_exchanges[chat_id] = exchange[-2 * _MAX_CACHED_EXCHANGES_PER_CHAT:]
+    while len(_cached_exchanges) > _MAX_CACHED_EXCHANGE_CHATS:
+        _cached_exchanges.popitem(last=False)
+
+
+def _mask_stream_text(text: str) -> str:
+    """
+    Маскирование PII в промежуточном тексте
+
+    PIIMiddleware обрабатывает сообщение модели целиком (after_model),
+    а токены уходят клиенту раньше - маскируем их теми же шаблонами.
+    """
+    text = _CARD_NUMBER_RE.sub("[номер карты скрыт]", text)
+    return _PHONE_NUMBER_RE.sub("[телефон скрыт]", text)
+
+
+async def _run_agent_stream(inputs, agent_config, chat_id: int, on_token=None):
     """
     Общая функция для обработки agent stream (для agent_answer и agent_resume)
     
@@ -244,6 +407,7 @@ async def _run_agent_stream(inputs, agent_config, chat_id: int):
         inputs: dict с messages или Command объект для resume
         agent_config: конфигурация агента с thread_id
         chat_id: ID чата для логирования
+        on_token: async callback(text) - текст ответа модели по мере генерации (потоковый режим)
     
     Returns:
         dict: {
@@ -256,12 +420,34 @@ async def _run_agent_stream(inputs, agent_config, chat_id: int):
         raise ValueError("Agent not initialized")
     
     interrupts = []
-    final_state = None
+    # Сообщения текущего turn (id -> message); после подтверждения операции продолжаем
+    # turn, начатый до interrupt - источники rag_search из него тоже относятся к ответу
+    turn = _interrupted_turns.pop(chat_id, {}) if isinstance(inputs, Command) else {}
     
     # Обработка stream с проверкой на interrupts
     # astream() возвращает каждый шаг агента асинхронно
     # ВАЖНО: используем astream() т.к. MCP инструменты асинхронные
-    async for step in bank_agent.astream(inputs, config=agent_config):
+    # Потоковый режим: кроме обновлений узлов ("updates") получаем токены модели ("messages")
+    stream_kwargs = {"stream_mode": ["updates", "messages"]} if on_token else {}
+    streamed_id, streamed_text = None, ""
+    
+    async for item in bank_agent.astream(inputs, config=agent_config, **stream_kwargs):
+        if on_token:
+            mode, step = item
+            if mode == "messages":
+                chunk, metadata = step
+                if metadata.get("langgraph_node") != "model" or not isinstance(chunk.content, str):
+                    continue
+                # Новое сообщение модели (после вызова инструмента) - начинаем текст заново
+                if chunk.id != streamed_id:
+                    streamed_id, streamed_text = chunk.id, ""
+                streamed_text += chunk.content
+                if chunk.content:
+                    await on_token(_mask_stream_text(streamed_text))
+                continue
+        else:
+            step = item
+        
         # Проверяем на interrupt через специальный __interrupt__ ключ
         if "__interrupt__" in step:
             interrupt_data = step["__interrupt__"]
@@ -269,53 +455,68 @@ async def _run_agent_stream(inputs, agent_config, chat_id: int):
                 interrupts.append(interrupt_data[0])
                 logger.info(f"⚠️  INTERRUPT detected: {interrupt_data[0].id}")
         
-        # Обычное обновление состояния (логируем шаги)
+        # Обычное обновление состояния (логируем шаги, накапливаем сообщения turn)
         for node_name, update in step.items():
-            if node_name != "__interrupt__" and isinstance(update, dict) and "messages" in update:
-                final_state = update
-                _log_agent_step(update["messages"][-1])
+            if node_name != "__interrupt__" and isinstance(update, dict) and update.get("messages"):
+                _collect_turn_messages(turn, node_name, update["messages"])
+                if node_name == "tools":
+                    # Все результаты шага: инструменты могли выполняться параллельно
+                    for msg in update["messages"]:
+                        _log_agent_step(msg)
+                    _log_parallel_tools(update["messages"])
+                else:
+                    _log_agent_step(update["messages"][-1])
+    
+    turn_messages = list(turn.values())
     
     # Если есть interrupt - возвращаем его (агент остановлен)
     if interrupts:
         logger.info(f"🛑 Agent stopped with interrupt for chat {chat_id}")
+        _interrupted_turns[chat_id] = turn
         return {
             "answer": None,
             "documents": [],
             "interrupt": interrupts[0]
         }
     
-    # Получаем полное состояние агента после завершения
-    # ВАЖНО: final_state из stream содержит только последнее обновление,
-    # но нам нужны ВСЕ сообщения для извлечения documents
-    full_state = bank_agent.get_state(agent_config)
-    all_messages = full_state.values["messages"]
-    
-    # Обычный ответ (без interrupt)
-    last_message = all_messages[-1]
-    answer = last_message.content
+    # Обычный ответ (без interrupt) - последний ответ модели в turn
+    # Полное состояние (get_state) не читаем: все сообщения turn уже пришли в stream
+    last_message = _final_answer_message(turn_messages)
+    answer = last_message.content if last_message is not None else None
     
     # Fallback для редких случаев когда LLM возвращает пустой ответ
     if not answer:
         logger.error(f"Empty answer from agent for chat {chat_id}")
         logger.debug(f"Last message type: {type(last_message).__name__}")
         logger.debug(f"Last message: {last_message}")
-        answer = "Извините, не смог сформировать ответ. Попробуйте переформулировать вопрос."
+        answer = EMPTY_ANSWER
     
     # Извлекаем documents только из текущего turn (для отображения источников)
-    logger.info(f"Extracting documents from full state with {len(all_messages)} messages")
-    documents = _extract_documents_from_current_request(all_messages)
+    documents = _extract_documents_from_current_request(turn_messages)
+    
+    tokens_saved = _context_tokens_saved(turn_messages)
     
     logger.info(f"✅ Agent completed for chat {chat_id}")
     logger.info(f"📚 Documents extracted: {len(documents)} documents")
+    if tokens_saved:
+        logger.info(f"🗜️  Context compression saved {tokens_saved} tokens in this turn")
     
     return {
         "answer": answer,
         "documents": documents,
-        "interrupt": None
+        "interrupt": None,
+        "tools": _tools_used_in_current_request(turn_messages),
+        "context_tokens_saved": tokens_saved
     }
 
 
-async def agent_answer(messages, chat_id: int):
+async def _thread_is_empty(agent_config) -> bool:
+    """В истории чата нет сообщений - ответ не может опираться на прошлый диалог клиента"""
+    checkpoint = await checkpointer.aget_tuple(agent_config)
+    return checkpoint is None or not checkpoint.checkpoint["channel_values"].get("messages")
+
+
+async def agent_answer(messages, chat_id: int, on_token=None, use_cache: bool = True, fast_path: bool = True):
     """
     Получить ответ от ReAct агента с поддержкой Human-in-the-Loop
     
@@ -326,11 +527,20 @@ async def agent_answer(messages, chat_id: int):
     4. Если инструмент критичный (open_credit_card) - создается interrupt
     5. Формирует финальный ответ на основе контекста
     
-    История диалога сохраняется в MemorySaver по chat_id.
+    История диалога сохраняется в checkpointer по chat_id.
+    
+    Быстрый путь FAQ: вопрос, совпадающий с вопросом из Q&A JSON (в том числе с опечатками),
+    получает ответ из справки. Семантический кеш: вопрос без отсылок к истории, близкий к уже отвеченному,
+    получает сохраненный ответ без вызова агента. Такой обмен репликами добавляется
+    в историю агента вместе со следующим вопросом. Кеш общий для всех чатов, поэтому
+    в него попадают только ответы, полученные в чате без истории.
     
     Args:
         messages: Список LangChain messages (без SystemMessage, он уже в агенте)
         chat_id: ID чата для сохранения состояния диалога
+        on_token: async callback(text) для потоковой доставки ответа (см. streaming.py)
+        use_cache: использовать семантический кеш ответов (False - в evaluation: оценивается агент)
+        fast_path: отвечать на вопросы из FAQ готовым ответом справки (False - в evaluation)
     
     Returns:
         dict: {
@@ -339,16 +549,57 @@ async def agent_answer(messages, chat_id: int):
             "interrupt": object | None - interrupt объект если требуется подтверждение
         }
     """
-    inputs = {"messages": messages}
+    question = messages[-1].content if messages else ""
+    
+    # Вопрос из FAQ - готовый ответ из справки, без embeddings и LLM
+    if fast_path and config.FAQ_FAST_PATH_ENABLED and question:
+        faq = rag.faq_answer(question)
+        if faq is not None:
+            logger.info(f"📖 Answer for chat {chat_id} served from FAQ ({faq['match']} match)")
+            _remember_exchange(chat_id, question, faq["answer"])
+            return {"answer": faq["answer"], "documents": faq["documents"], "interrupt": None}
+    
+    cacheable = use_cache and config.SEMANTIC_CACHE_ENABLED and semantic_cache.is_history_independent(question)
+    question_vector = None
+    if cacheable:
+        cached, question_vector = await semantic_cache.answer_cache.alookup(question, rag.vector_store.embeddings)
+        if cached is not None:
+            logger.info(f"💾 Answer for chat {chat_id} served from semantic cache")
+            _remember_exchange(chat_id, question, cached["answer"])
+            return {"answer": cached["answer"], "documents": cached["documents"], "interrupt": None}
+    
+    pending = _cached_exchanges.pop(chat_id, [])
+    inputs = {"messages": pending + messages}
     # thread_id определяет отдельную историю диалога для каждого чата
     agent_config = {"configurable": {"thread_id": str(chat_id)}}
+    # Ответ в чате с историей мог использовать данные клиента из прошлых сообщений -
+    # такой ответ нельзя отдавать другим клиентам из общего кеша
+    if cacheable and (pending or not await _thread_is_empty(agent_config)):
+        cacheable = False
     
     logger.info(f"🤖 Agent starting for chat {chat_id}...")
     
-    return await _run_agent_stream(inputs, agent_config, chat_id)
+    result = await _run_agent_stream(inputs, agent_config, chat_id, on_token)
+    
+    # В кеш - только ответы по документам: другие инструменты (курсы валют, продукты,
+    # расчеты) дают данные, которые меняются или зависят от параметров клиента
+    if (
+        cacheable
+        and result["interrupt"] is None
+        and result["documents"]
+        and result["tools"] == {"rag_search"}
+        and result["answer"] != EMPTY_ANSWER
+    ):
+        await semantic_cache.answer_cache.astore(
+            question,
+            {"answer": result["answer"], "documents": result["documents"]},
+            rag.vector_store.embeddings,
+            question_vector,
+        )
+    return result
 
 
-async def agent_resume(chat_id: int, decision: str, message: str = None):
+async def agent_resume(chat_id: int, decision: str, message: str = None, on_token=None):
     """
     Возобновить выполнение агента после Human-in-the-Loop interrupt
     
@@ -359,11 +610,11 @@ async def agent_resume(chat_id: int, decision: str, message: str = None):
         chat_id: ID чата для восстановления контекста диалога
         decision: "approve" или "reject" - решение пользователя
         message: Сообщение при reject (причина отклонения), опционально
+        on_token: async callback(text) для потоковой доставки ответа
     
     Returns:
         dict: аналогично agent_answer - {answer, documents, interrupt}
     """
-    from langgraph.types import Command
     
     # thread_id для восстановления контекста диалога
     agent_config = {"configurable": {"thread_id": str(chat_id)}}
@@ -382,4 +633,4 @@ async def agent_resume(chat_id: int, decision: str, message: str = None):
         })
     
     # Продолжаем выполнение агента с решением пользователя
-    return await _run_agent_stream(command, agent_config, chat_id)
+    return await _run_agent_stream(command, agent_config, chat_id, on_token)
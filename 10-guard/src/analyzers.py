@@ -0,0 +1,190 @@
+"""
+Анализаторы текста для лексического (BM25) индекса
+
+Русская морфология размазывает один термин по многим формам ("кредит", "кредита",
+"кредитом"): без нормализации это разные postings, BM25 не находит документ,
+если форма в вопросе отличается от формы в тексте, а словарь раздувается.
+
+RussianAnalyzer:
+- приведение к нижнему регистру и замена ё -> е
+- разбиение на слова (буквы и цифры), пунктуация отбрасывается
+- удаление стоп-слов (предлоги, союзы, местоимения)
+- стемминг (опционально): встроенный стеммер Портера для русского (алгоритм Snowball,
+  BM25_STEMMER=porter) или лемматизация pymorphy3 (BM25_STEMMER=pymorphy)
+
+По умолчанию стемминга нет: на вопросах справки, отсутствующих в корпусе дословно,
+регистр, ё/е и стоп-слова дают основной прирост hit@k, а стемминг снижает MRR
+(make bench-bm25).
+
+Результат стемминга кешируется по словам: словарь корпуса намного меньше числа токенов.
+Имя анализатора (name) сохраняется в BM25 индексе - смена настроек вызывает его пересборку.
+"""
+import re
+from functools import lru_cache
+
+from config import config
+
+# Стоп-слова русского языка (на основе списка Snowball), уже со свернутой ё
+RUSSIAN_STOPWORDS = frozenset("""
+а без более бы был была были было быть в вам вас весь во вот все всего всех вы где да даже для до
+его ее ей ему если есть еще же за здесь и из или им их к как ко когда кто ли либо между меня мне
+может мы на над надо наш не него нее нет ни них но ну о об однако он она они оно от очень по под
+при с со так также такой там те тем то того тоже той только том ты у уже хотя чего чей чем что
+чтобы чье чья эта эти это этого этой этом этот я
+""".split())
+
+_WORD_RE = re.compile(r"[0-9a-zа-я]+")
+
+
+def normalize_question(text: str) -> str:
+    """
+    Нормализация вопроса для ключей кешей и FAQ индекса: регистр, ё/е, пробелы
+    (в том числе неразрывные); пунктуация отбрасывается
+
+    Одна функция для кеша оценок reranker, семантического кеша ответов и FAQ индекса:
+    один и тот же вопрос дает во всех них один ключ.
+    """
+    return " ".join(_WORD_RE.findall(text.lower().replace("ё", "е")))
+
+
+class RussianPorterStemmer:
+    """
+    Стеммер Портера для русского языка (алгоритм Snowball)
+
+    Отсекает окончания в области RV (после первой гласной):
+    деепричастия, возвратные частицы, прилагательные/причастия, глаголы, существительные,
+    затем словообразовательный суффикс -ость и превосходную степень.
+
+    Алгоритм применяется как есть, без ручных исключений. Часть основ не совпадает
+    ("кредит" -> "кред", но "кредита" -> "кредит"; "закрыть" -> "закр", "закрытие" -> "закрыт") -
+    влияние стемминга на поиск показывает make bench-bm25.
+    """
+
+    _PERFECTIVE_GERUND = re.compile(r"((ив|ивши|ившись|ыв|ывши|ывшись)|((?<=[ая])(в|вши|вшись)))$")
+    _REFLEXIVE = re.compile(r"(с[яь])$")
+    _ADJECTIVE = re.compile(
+        r"(ее|ие|ые|ое|ими|ыми|ей|ий|ый|ой|ем|им|ым|ом|его|ого|ему|ому|их|ых|ую|юю|ая|яя|ою|ею)$"
+    )
+    _PARTICIPLE = re.compile(r"((ивш|ывш|ующ)|((?<=[ая])(ем|нн|вш|ющ|щ)))$")
+    _VERB = re.compile(
+        r"((ила|ыла|ена|ейте|уйте|ите|или|ыли|ей|уй|ил|ыл|им|ым|ен|ило|ыло|ено|ят|ует|уют|ит|ыт|ены|ить|ыть|ишь|ую|ю)"
+        r"|((?<=[ая])(ла|на|ете|йте|ли|й|л|ем|н|ло|но|ет|ют|ны|ть|ешь|нно)))$"
+    )
+    _NOUN = re.compile(
+        r"(а|ев|ов|ие|ье|е|иями|ями|ами|еи|ии|и|ией|ей|ой|ий|й|иям|ям|ием|ем|ам|ом|о|у|ах|иях|ях|ы|ь|ию|ью|ю|ия|ья|я)$"
+    )
+    _RV = re.compile(r"^(.*?[аеиоуыэюя])(.*)$")
+    _DERIVATIONAL = re.compile(r".*[^аеиоуыэюя]+[аеиоуыэюя].*ость?$")
+    _DER = re.compile(r"ость?$")
+    _SUPERLATIVE = re.compile(r"(ейше|ейш)$")
+    _I = re.compile(r"и$")
+    _SOFT_SIGN = re.compile(r"ь$")
+    _NN = re.compile(r"нн$")
+
+    def stem(self, word: str) -> str:
+        match = self._RV.match(word)
+        if not match:
+            return word
+        prefix, rv = match.groups()
+
+        temp = self._PERFECTIVE_GERUND.sub("", rv, 1)
+        if temp == rv:
+            rv = self._REFLEXIVE.sub("", rv, 1)
+            temp = self._ADJECTIVE.sub("", rv, 1)
+            if temp != rv:
+                rv = self._PARTICIPLE.sub("", temp, 1)
+            else:
+                temp = self._VERB.sub("", rv, 1)
+                rv = self._NOUN.sub("", rv, 1) if temp == rv else temp
+        else:
+            rv = temp
+
+        rv = self._I.sub("", rv, 1)
+        if self._DERIVATIONAL.match(rv):
+            rv = self._DER.sub("", rv, 1)
+        temp = self._SOFT_SIGN.sub("", rv, 1)
+        if temp == rv:
+            rv = self._SUPERLATIVE.sub("", rv, 1)
+            rv = self._NN.sub("н", rv, 1)
+        else:
+            rv = temp
+        return prefix + rv
+
+
+class PymorphyLemmatizer:
+    """Лемматизация через pymorphy3 (точнее стемминга, но медленнее и требует зависимость)"""
+
+    def __init__(self):
+        try:
+            import pymorphy3
+        except ImportError as e:
+            raise ImportError("BM25_STEMMER=pymorphy requires pymorphy3: uv add pymorphy3") from e
+        self._morph = pymorphy3.MorphAnalyzer()
+
+    def stem(self, word: str) -> str:
+        return self._morph.parse(word)[0].normal_form.replace("ё", "е")
+
+
+class WhitespaceAnalyzer:
+    """Разбиение по пробелам без нормализации (поведение BM25Retriever по умолчанию)"""
+
+    name = "whitespace"
+
+    def __call__(self, text: str) -> list:
+        return text.split()
+
+
+class RussianAnalyzer:
+    """
+    Анализатор для русского текста: регистр, ё/е, стоп-слова, стемминг
+
+    Args:
+        stemmer: "none", "porter" (встроенный Snowball) или "pymorphy" (лемматизация)
+        stopwords: удалять стоп-слова
+        cache_size: размер кеша стемминга (слово -> основа)
+    """
+
+    def __init__(self, stemmer: str = "none", stopwords: bool = True, cache_size: int = 200_000):
+        if stemmer == "porter":
+            stem = RussianPorterStemmer().stem
+        elif stemmer == "pymorphy":
+            stem = PymorphyLemmatizer().stem
+        elif stemmer == "none":
+            stem = None
+        else:
+            raise ValueError(f"Unknown BM25 stemmer: {stemmer}. Use 'porter', 'pymorphy' or 'none'")
+        self.stemmer = stemmer
+        self.stopwords = RUSSIAN_STOPWORDS if stopwords else frozenset()
+        self._stem = lru_cache(maxsize=cache_size)(stem) if stem else None
+        self.name = f"russian:{stemmer}:{'stop' if stopwords else 'nostop'}"
+
+    def __call__(self, text: str) -> list:
+        words = _WORD_RE.findall(text.lower().replace("ё", "е"))
+        words = [word for word in words if word not in self.stopwords]
+        if self._stem is None:
+            return words
+        return [self._stem(word) for word in words]
+
+
+def create_analyzer(name: str = None, stemmer: str = None, stopwords: bool = None):
+    """Анализатор из параметров (по умолчанию - BM25_ANALYZER, BM25_STEMMER, BM25_STOPWORDS)"""
+    name = (name or config.BM25_ANALYZER).lower()
+    if name == "whitespace":
+        return WhitespaceAnalyzer()
+    if name == "russian":
+        return RussianAnalyzer(
+            stemmer=(stemmer or config.BM25_STEMMER).lower(),
+            stopwords=config.BM25_STOPWORDS if stopwords is None else stopwords,
+        )
+    raise ValueError(f"Unknown BM25 analyzer: {name}. Use 'russian' or 'whitespace'")
+
+
+_analyzer = None
+
+
+def get_analyzer():
+    """Общий анализатор из конфига (кеш стемминга переиспользуется между пересборками)"""
+    global _analyzer
+    if _analyzer is None:
+        _analyzer = create_analyzer()
+    return _analyzer
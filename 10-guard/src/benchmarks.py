@@ -0,0 +1,342 @@
+"""
+Бенчмарки компонентов retrieval (без Telegram и LLM)
+
+Использование:
+    uv run python src/benchmarks.py bm25      # анализаторы BM25: словарь, скорость запросов, hit@k/MRR
+    uv run python src/benchmarks.py reranker  # runtime cross-encoder: латентность и nDCG
+"""
+import json
+import logging
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+from langchain_core.documents import Document
+
+from config import config
+import indexer
+from analyzers import create_analyzer
+from reranker import RerankerEngine
+from sparse_index import BM25Index
+
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger(__name__)
+
+# Анализаторы для сравнения: (название в отчете, параметры create_analyzer)
+BM25_VARIANTS = [
+    ("whitespace (до)", {"name": "whitespace"}),
+    ("russian, без стемминга", {"name": "russian", "stemmer": "none"}),
+    ("russian + porter", {"name": "russian", "stemmer": "porter"}),
+    ("russian + pymorphy", {"name": "russian", "stemmer": "pymorphy"}),
+]
+
+# Датасет evaluation (dataset_synthesizer.py): вопросы по PDF сформулированы LLM,
+# а не скопированы из корпуса
+RAGAS_DATASET_PATH = Path("datasets/10-rag-qa-dataset.json")
+
+# Варианты reranker: (название в отчете, параметры RerankerEngine)
+# Первая строка - прежний путь: CrossEncoder fp32 с полной длиной пары
+RERANKER_VARIANTS = [
+    ("torch fp32, 512 токенов (до)", {"backend": "torch", "max_length": 512}),
+    ("torch fp32", {"backend": "torch"}),
+    ("onnx", {"backend": "onnx"}),
+    ("onnx int8", {"backend": "onnx_int8"}),
+]
+
+
+def load_corpus_chunks() -> list:
+    """Чанки корпуса в том же порядке и с теми же id, что в индексе (embeddings не нужны)"""
+    units = indexer.collect_source_units(indexer.get_source_files())
+    chunks = []
+    for _, unit_chunks in indexer.iter_unit_chunks(units):
+        chunks.extend(unit_chunks)
+    return chunks
+
+
+def load_benchmark_queries(queries_path: str = None) -> list:
+    """
+    Запросы для бенчмарка: [(текст, метаданные ожидаемого документа или None)]
+
+    По умолчанию - вопросы из Q&A JSON: для них известен правильный документ (по url).
+    """
+    if queries_path:
+        return [(query, None) for query in json.loads(Path(queries_path).read_text(encoding="utf-8"))]
+    json_file = Path(config.DATA_DIR) / "sberbank_help_documents.json"
+    items = json.loads(json_file.read_text(encoding="utf-8"))
+    return [(item["question"], {"url": item["url"]}) for item in items if item.get("question") and item.get("url")]
+
+
+def load_dataset_queries(dataset_path: Path = RAGAS_DATASET_PATH) -> list:
+    """
+    Синтезированные вопросы по PDF из датасета evaluation: [(текст, {"source", "page"})]
+
+    Вопросы из Q&A JSON в датасете пропускаются - они дословно есть в корпусе
+    (для них - load_benchmark_queries и hold_out_questions).
+    """
+    if not dataset_path.exists():
+        return []
+    items = json.loads(dataset_path.read_text(encoding="utf-8"))
+    return [
+        (item["question"], {"source": Path(item["metadata"]["source"]).name, "page": item["metadata"]["page"]})
+        for item in items
+        if item.get("metadata", {}).get("type") == "synthesized"
+    ]
+
+
+def hold_out_questions(chunks: list) -> list:
+    """
+    Корпус без текста вопросов Q&A пар (остаются категория и ответ)
+
+    Вопрос из JSON дословно входит в свой чанк, поэтому на полном корпусе любой
+    анализатор находит его почти всегда и hit@k не различает анализаторы.
+    Без вопроса документ находится только по словам ответа - как и вопрос клиента,
+    сформулированный иначе, чем в справке.
+    """
+    held_out = []
+    for chunk in chunks:
+        question = chunk.metadata.get("question")
+        if question:
+            chunk = Document(
+                page_content=chunk.page_content.replace(f"Вопрос: {question}\n\n", "", 1),
+                metadata=chunk.metadata,
+            )
+        held_out.append(chunk)
+    return held_out
+
+
+def is_relevant(doc, expected: dict) -> bool:
+    """Документ совпадает с ожидаемым по всем полям (url или имя PDF и страница)"""
+    for key, value in expected.items():
+        actual = doc.metadata.get(key)
+        if key == "source" and actual:
+            actual = Path(actual).name
+        if actual != value:
+            return False
+    return True
+
+
+def _retrieval_quality(index: BM25Index, queries: list, k: int):
+    """hit@k и MRR@k по запросам с известным документом (None, если таких нет)"""
+    judged = [(query, expected) for query, expected in queries if expected]
+    if not judged:
+        return None, None
+    hits = reciprocal_ranks = 0.0
+    for query, expected in judged:
+        found = [doc for doc, _ in index.search(query, k)]
+        rank = next((i for i, doc in enumerate(found) if is_relevant(doc, expected)), None)
+        if rank is not None:
+            hits += 1
+            reciprocal_ranks += 1 / (rank + 1)
+    return hits / len(judged), reciprocal_ranks / len(judged)
+
+
+def benchmark_bm25(chunks: list, queries: list, k: int = None, repeats: int = 3,
+                   paraphrased_queries: list = None) -> list:
+    """
+    Сравнение анализаторов BM25 на одном корпусе
+
+    Размер словаря и скорость измеряются на полном корпусе, качество - на запросах,
+    которых нет в корпусе дословно: вопросы Q&A JSON ищутся по корпусу без текста
+    вопросов (hold_out_questions), синтезированные вопросы датасета - по полному корпусу.
+    Варианты без установленных зависимостей пропускаются.
+
+    Returns:
+        list[dict]: по строке на анализатор - размер словаря, число postings,
+            время построения, латентность запроса (mean/p95), hit@k и MRR@k
+    """
+    k = k or config.BM25_RETRIEVER_K
+    held_out = hold_out_questions(chunks)
+    results = []
+    for label, params in BM25_VARIANTS:
+        try:
+            analyzer = create_analyzer(**params)
+        except ImportError as e:
+            print(f"skip {label}: {e}")
+            continue
+        started = time.perf_counter()
+        index = BM25Index.build(chunks, analyzer)
+        build_ms = (time.perf_counter() - started) * 1000
+
+        latencies = []
+        for query, _ in queries:
+            for _ in range(repeats):
+                started = time.perf_counter()
+                index.search(query, k)
+                latencies.append((time.perf_counter() - started) * 1000)
+
+        hit_at_k, mrr = _retrieval_quality(BM25Index.build(held_out, analyzer), queries, k)
+        paraphrased_hit, _ = _retrieval_quality(index, paraphrased_queries or [], k)
+
+        results.append({
+            "analyzer": label,
+            "name": analyzer.name,
+            "terms": len(index.terms),
+            "postings": len(index.doc_ids),
+            "build_ms": build_ms,
+            "query_ms_mean": float(np.mean(latencies)) if latencies else 0.0,
+            "query_ms_p95": float(np.percentile(latencies, 95)) if latencies else 0.0,
+            "hit_at_k": hit_at_k,
+            "mrr": mrr,
+            "paraphrased_hit_at_k": paraphrased_hit,
+        })
+    return results
+
+
+def print_bm25_report(results: list, n_chunks: int, n_queries: int, n_paraphrased: int, k: int):
+    print(f"\nBM25 analyzers: {n_chunks} chunks, {n_queries} held-out FAQ queries, "
+          f"{n_paraphrased} dataset queries, k={k}\n")
+    print(
+        f"{'analyzer':<26}{'terms':>8}{'postings':>10}{'build ms':>10}{'mean ms':>9}{'p95 ms':>8}"
+        f"{'hit@k':>8}{'MRR':>7}{'dataset':>9}"
+    )
+
+    def fmt(value, width):
+        return f"{value:>{width}.3f}" if value is not None else f"{'-':>{width}}"
+
+    for row in results:
+        print(
+            f"{row['analyzer']:<26}{row['terms']:>8}{row['postings']:>10}{row['build_ms']:>10.1f}"
+            f"{row['query_ms_mean']:>9.3f}{row['query_ms_p95']:>8.3f}"
+            f"{fmt(row['hit_at_k'], 8)}{fmt(row['mrr'], 7)}{fmt(row['paraphrased_hit_at_k'], 9)}"
+        )
+
+
+def ndcg_at_k(relevances: list, n_relevant: int, k: int) -> float:
+    """nDCG@k для бинарной релевантности (relevances - в порядке выдачи)"""
+    dcg = sum(rel / math.log2(i + 2) for i, rel in enumerate(relevances[:k]))
+    idcg = sum(1 / math.log2(i + 2) for i in range(min(n_relevant, k)))
+    return dcg / idcg if idcg else 0.0
+
+
+def build_rerank_cases(chunks: list, queries: list, n_candidates: int, limit: int) -> list:
+    """
+    Кандидаты для reranking: top-N BM25 по каждому вопросу
+
+    Оставляем только вопросы, для которых правильный документ (по url) есть среди кандидатов -
+    иначе reranker не на что проверять.
+    """
+    index = BM25Index.build(chunks)
+    cases = []
+    for query, expected in queries:
+        if not expected:
+            continue
+        candidates = [doc for doc, _ in index.search(query, n_candidates)]
+        relevances = [int(is_relevant(doc, expected)) for doc in candidates]
+        if any(relevances):
+            cases.append({"query": query, "candidates": candidates, "relevances": relevances})
+        if len(cases) >= limit:
+            break
+    return cases
+
+
+def benchmark_reranker(cases: list, k: int = None, concurrency: int = 8) -> list:
+    """
+    Сравнение runtime cross-encoder на одних и тех же кандидатах
+
+    Для каждого варианта: время загрузки, латентность одного запроса (mean/p95),
+    пропускная способность при concurrency одновременных запросах (общий батч)
+    и nDCG@k по url. Варианты без установленных зависимостей пропускаются.
+    """
+    k = k or config.RERANKER_TOP_K
+    if not cases:
+        return []
+    results = [{
+        "variant": "без reranker (порядок BM25)",
+        "ndcg": float(np.mean([ndcg_at_k(c["relevances"], sum(c["relevances"]), k) for c in cases])),
+    }]
+    for label, params in RERANKER_VARIANTS:
+        try:
+            started = time.perf_counter()
+            engine = RerankerEngine(config.CROSS_ENCODER_MODEL, batch_wait_ms=0, **params)
+            engine.load()
+            load_s = time.perf_counter() - started
+        except Exception as e:
+            print(f"skip {label}: {e}")
+            continue
+        # Прогрев: первые вызовы включают инициализацию runtime
+        engine.predict([(cases[0]["query"], cases[0]["candidates"][0].page_content)] * 4)
+
+        latencies, ndcgs = [], []
+        for case in cases:
+            pairs = [(case["query"], doc.page_content) for doc in case["candidates"]]
+            started = time.perf_counter()
+            scores = engine.predict(pairs)
+            latencies.append((time.perf_counter() - started) * 1000)
+            ranked = [case["relevances"][i] for i in np.argsort(-scores, kind="stable")]
+            ndcgs.append(ndcg_at_k(ranked, sum(case["relevances"]), k))
+
+        # Одновременные запросы через общую очередь движка
+        engine.batch_wait = config.CROSS_ENCODER_BATCH_WAIT_MS / 1000
+        calls_before = engine.model_calls
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(
+                lambda case: engine.score(case["query"], [doc.page_content for doc in case["candidates"]]),
+                cases
+            ))
+        concurrent_s = time.perf_counter() - started
+
+        results.append({
+            "variant": label,
+            "load_s": load_s,
+            "query_ms_mean": float(np.mean(latencies)),
+            "query_ms_p95": float(np.percentile(latencies, 95)),
+            "concurrent_qps": len(cases) / concurrent_s,
+            "concurrent_calls": engine.model_calls - calls_before,
+            "ndcg": float(np.mean(ndcgs)),
+        })
+    return results
+
+
+def print_reranker_report(results: list, n_cases: int, n_candidates: int, k: int, concurrency: int):
+    print(f"\nReranker ({config.CROSS_ENCODER_MODEL}): {n_cases} queries x {n_candidates} candidates, "
+          f"nDCG@{k}, concurrency={concurrency}\n")
+    print(f"{'variant':<30}{'load s':>8}{'mean ms':>9}{'p95 ms':>8}{'qps':>7}{'calls':>7}{'nDCG':>7}")
+    for row in results:
+        if "query_ms_mean" not in row:
+            print(f"{row['variant']:<30}{'-':>8}{'-':>9}{'-':>8}{'-':>7}{'-':>7}{row['ndcg']:>7.3f}")
+            continue
+        print(
+            f"{row['variant']:<30}{row['load_s']:>8.1f}{row['query_ms_mean']:>9.1f}{row['query_ms_p95']:>8.1f}"
+            f"{row['concurrent_qps']:>7.1f}{row['concurrent_calls']:>7}{row['ndcg']:>7.3f}"
+        )
+
+
+def main():
+    """Main CLI function"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Retrieval benchmarks")
+    subparsers = parser.add_subparsers(dest="command")
+    bm25_parser = subparsers.add_parser("bm25", help="Compare BM25 analyzers")
+    bm25_parser.add_argument("--queries", help="JSON file with a list of query strings")
+    bm25_parser.add_argument("--k", type=int, default=config.BM25_RETRIEVER_K, help="Top-k for hit@k")
+    reranker_parser = subparsers.add_parser("reranker", help="Compare cross-encoder runtimes")
+    reranker_parser.add_argument("--candidates", type=int, default=20, help="BM25 candidates per query")
+    reranker_parser.add_argument("--limit", type=int, default=100, help="Max number of queries")
+    reranker_parser.add_argument("--k", type=int, default=config.RERANKER_TOP_K, help="Top-k for nDCG@k")
+    reranker_parser.add_argument("--concurrency", type=int, default=8, help="Simultaneous requests")
+    args = parser.parse_args()
+
+    if args.command == "bm25":
+        chunks = load_corpus_chunks()
+        queries = load_benchmark_queries(args.queries)
+        paraphrased = load_dataset_queries()
+        results = benchmark_bm25(chunks, queries, k=args.k, paraphrased_queries=paraphrased)
+        print_bm25_report(results, len(chunks), len(queries), len(paraphrased), args.k)
+    elif args.command == "reranker":
+        cases = build_rerank_cases(load_corpus_chunks(), load_benchmark_queries(), args.candidates, args.limit)
+        if not cases:
+            print(f"No queries with the expected document among top-{args.candidates} BM25 candidates, "
+                  f"nothing to rerank (check that the dataset has urls)")
+            return
+        results = benchmark_reranker(cases, k=args.k, concurrency=args.concurrency)
+        print_reranker_report(results, len(cases), args.candidates, args.k, args.concurrency)
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
@@ -3,9 +3,10 @@
 
 Последовательность запуска:
 1. Настройка логирования
-2. Индексация документов (PDF + JSON) в векторное хранилище
+2. Загрузка сохраненного индекса с диска (или индексация PDF + JSON, если документы изменились)
 3. Инициализация RAG retriever (semantic/hybrid/hybrid_reranker)
-4. Создание ReAct агента с MemorySaver
+   и фоновый прогрев cross-encoder для hybrid_reranker
+4. Создание ReAct агента с checkpointer (история диалогов)
 5. Запуск Telegram bot polling
 """
 import os
@@ -18,6 +19,7 @@ os.environ.setdefault('TOKENIZERS_PARALLELISM', 'false')
 
 from aiogram import Bot, Dispatcher
 from handlers import router
+from scheduler import scheduler
 from config import config
 import indexer
 import rag
@@ -66,21 +68,27 @@ async def main():
     logger.info("-" * 70)
     
     # Индексация документов при старте
-    # Загружаем PDF и JSON, создаем chunks, генерируем embeddings, сохраняем в FAISS
+    # Если сохраненный индекс актуален (те же документы, модель и сплиттер) - загружаем его с диска,
+    # иначе загружаем PDF и JSON, создаем chunks, генерируем embeddings и сохраняем индекс
     logger.info("📚 Starting indexing...")
-    result = await indexer.reindex_all()
+    result = await indexer.load_or_reindex()
     if result and result[0] is not None:
-        rag.vector_store, rag.chunks = result
+        rag.vector_store, rag.chunks, rag.bm25_index, _ = result
         # Инициализируем retriever (semantic/hybrid/hybrid_reranker в зависимости от конфига)
         rag.initialize_retriever()
         stats = rag.get_vector_store_stats()
         logger.info(f"✅ Indexing completed: {stats['count']} documents indexed")
+        # Cross-encoder грузится и прогревается в фоне, пока стартует агент и polling:
+        # первый клиент после деплоя не ждет загрузки модели
+        if config.RETRIEVAL_MODE == "hybrid_reranker" and config.CROSS_ENCODER_WARMUP:
+            logger.info("🔥 Warming up cross-encoder in background...")
+            rag.start_reranker_warmup()
     else:
         logger.warning("⚠️  Indexing completed with no documents - bot will run but cannot answer questions")
     
     # Инициализация ReAct агента
     # Создается один раз и переиспользуется для всех пользователей
-    # MemorySaver внутри агента обеспечивает отдельную историю для каждого chat_id
+    # Checkpointer внутри агента обеспечивает отдельную историю для каждого chat_id
     # Подключение к MCP серверу происходит здесь (если сервер запущен)
     logger.info("🤖 Initializing ReAct agent...")
     await agent.initialize_agent()
@@ -88,6 +96,9 @@ async def main():
     
     bot = Bot(token=config.TELEGRAM_TOKEN)
     dp = Dispatcher()
+    # Сообщения одного чата - по очереди, разных чатов - параллельно с общим лимитом
+    dp.message.middleware(scheduler)
+    dp.callback_query.middleware(scheduler)
     dp.include_router(router)
     
     logger.info("-" * 70)
@@ -100,6 +111,7 @@ async def main():
     except Exception as e:
         logger.error(f"❌ Bot stopped with error: {e}", exc_info=True)
     finally:
+        await agent.close_agent()
         logger.info("=" * 70)
         logger.info("🛑 Bot shutdown complete")
         logger.info("=" * 70)
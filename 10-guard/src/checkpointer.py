@@ -0,0 +1,409 @@
+"""
+Персистентный checkpointer агента с ограничением памяти
+
+MemorySaver хранит в памяти процесса все checkpoints всех чатов: после каждого шага агента -
+новую версию канала messages (всю историю целиком), навсегда. Память растет с числом чатов
+и сообщений, а при перезапуске бота история теряется.
+
+BoundedSqliteSaver - MemorySaver для активных чатов + SQLite файл для всех:
+- изменения пишутся в SQLite пачками в фоновом потоке (раз в CHECKPOINT_FLUSH_INTERVAL секунд);
+  под блокировкой памяти только копируются ссылки на записи измененных чатов,
+  сжатие и запись в файл идут вне ее - агент не ждет фоновую запись
+- у чата хранятся только последние CHECKPOINT_KEEP_VERSIONS checkpoints, старые версии
+  каналов и pending writes удаляются (история диалога - в последнем checkpoint)
+- чат без активности CHECKPOINT_IDLE_SECONDS выгружается из памяти и лениво
+  загружается из SQLite при следующем сообщении
+- раз в час чаты без активности дольше CHECKPOINT_RETENTION_DAYS удаляются из файла
+
+В файле - строки checkpoints, версий каналов и writes с байтами serde (type + blob),
+как в langgraph-checkpoint-sqlite, а не сериализованные структуры InMemorySaver.
+"""
+import logging
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+
+from langgraph.checkpoint.memory import InMemorySaver
+
+logger = logging.getLogger(__name__)
+
+# Период очистки файла от давно неактивных чатов
+_RETENTION_INTERVAL = 3600
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS checkpoints (
+    thread_id TEXT NOT NULL, checkpoint_ns TEXT NOT NULL, checkpoint_id TEXT NOT NULL,
+    parent_checkpoint_id TEXT, type TEXT, checkpoint BLOB, metadata_type TEXT, metadata BLOB,
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id)
+);
+CREATE TABLE IF NOT EXISTS checkpoint_blobs (
+    thread_id TEXT NOT NULL, checkpoint_ns TEXT NOT NULL, channel TEXT NOT NULL, version TEXT NOT NULL,
+    type TEXT, blob BLOB,
+    PRIMARY KEY (thread_id, checkpoint_ns, channel, version)
+);
+CREATE TABLE IF NOT EXISTS checkpoint_writes (
+    thread_id TEXT NOT NULL, checkpoint_ns TEXT NOT NULL, checkpoint_id TEXT NOT NULL,
+    task_id TEXT NOT NULL, idx INTEGER NOT NULL, channel TEXT, type TEXT, value BLOB, task_path TEXT,
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+);
+CREATE TABLE IF NOT EXISTS thread_activity (
+    thread_id TEXT PRIMARY KEY, updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_thread_activity_updated_at ON thread_activity(updated_at);
+"""
+
+_DATA_TABLES = ("checkpoints", "checkpoint_blobs", "checkpoint_writes", "thread_activity")
+
+
+class _ThreadSnapshot:
+    """Записи одного чата на момент flush (значения неизменяемые - копируются только ссылки)"""
+
+    def __init__(self, storage: dict, writes: dict, blobs: dict):
+        self.storage = storage  # ns -> {checkpoint_id: (checkpoint, metadata, parent_id)}
+        self.writes = writes  # (thread_id, ns, checkpoint_id) -> {(task_id, idx): (task_id, channel, value, task_path)}
+        self.blobs = blobs  # (thread_id, ns, channel, version) -> (type, bytes)
+
+
+class BoundedSqliteSaver(InMemorySaver):
+    """
+    Args:
+        path: путь к SQLite файлу
+        keep_versions: сколько последних checkpoints хранить на чат
+        idle_seconds: через сколько секунд без активности чат выгружается из памяти
+        flush_interval: период пакетной записи в SQLite, секунды
+        retention_days: через сколько дней без активности чат удаляется (0 - хранить всегда)
+    """
+
+    def __init__(
+        self,
+        path: str,
+        keep_versions: int = 3,
+        idle_seconds: float = 1800,
+        flush_interval: float = 2.0,
+        retention_days: float = 30,
+    ):
+        super().__init__()
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.keep_versions = max(1, keep_versions)
+        self.idle_seconds = idle_seconds
+        self.flush_interval = flush_interval
+        self.retention_days = retention_days
+
+        # Блокировка памяти: агент работает в event loop, flush копирует записи в фоновом потоке.
+        # Под ней не выполняются сериализация и запись в файл
+        self._lock = threading.RLock()
+        # Запись в файл - одно соединение фонового потока (и close), чтение чатов - отдельное:
+        # в режиме WAL чтение не ждет транзакцию записи
+        self._write_lock = threading.Lock()
+        self._writer = self._connect()
+        self._writer.executescript(_SCHEMA)
+        self._writer.commit()
+        self._reader = self._connect()
+
+        self._last_access = {}  # thread_id -> monotonic time (чаты в памяти)
+        self._dirty = set()
+        self._deleted = set()  # удалены в памяти, но еще не в файле
+        self.loads = 0
+        self.evictions = 0
+        self.flushes = 0
+        self.pruned_checkpoints = 0
+
+        self._stop = threading.Event()
+        self._worker = threading.Thread(target=self._background, name="checkpoint-flush", daemon=True)
+        self._worker.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    # --- Загрузка и выгрузка чатов ---
+
+    def _touch(self, thread_id: str):
+        """Отметка активности; чат не в памяти - загружаем из SQLite (вызывается под self._lock)"""
+        if thread_id not in self._last_access and thread_id not in self._deleted:
+            self._load_thread(thread_id)
+        self._last_access[thread_id] = time.monotonic()
+
+    def _load_thread(self, thread_id: str):
+        rows = self._reader.execute(
+            "SELECT checkpoint_ns, checkpoint_id, parent_checkpoint_id, type, checkpoint, metadata_type, metadata "
+            "FROM checkpoints WHERE thread_id = ?", (thread_id,)
+        ).fetchall()
+        if not rows:
+            return
+        for ns, checkpoint_id, parent_id, type_, checkpoint, metadata_type, metadata in rows:
+            self.storage[thread_id][ns][checkpoint_id] = ((type_, checkpoint), (metadata_type, metadata), parent_id)
+        for ns, channel, version, type_, blob in self._reader.execute(
+            "SELECT checkpoint_ns, channel, version, type, blob FROM checkpoint_blobs WHERE thread_id = ?",
+            (thread_id,)
+        ):
+            self.blobs[(thread_id, ns, channel, version)] = (type_, blob)
+        for ns, checkpoint_id, task_id, idx, channel, type_, value, task_path in self._reader.execute(
+            "SELECT checkpoint_ns, checkpoint_id, task_id, idx, channel, type, value, task_path "
+            "FROM checkpoint_writes WHERE thread_id = ?", (thread_id,)
+        ):
+            self.writes[(thread_id, ns, checkpoint_id)][(task_id, idx)] = (task_id, channel, (type_, value), task_path)
+        self.loads += 1
+
+    def _thread_keys(self, mapping: dict, thread_ids: set) -> dict:
+        """Ключи writes/blobs по чатам (первый элемент ключа - thread_id)"""
+        grouped = defaultdict(list)
+        for key in mapping:
+            if key[0] in thread_ids:
+                grouped[key[0]].append(key)
+        return grouped
+
+    def _snapshot(self, thread_ids: set) -> dict:
+        """Копии ссылок на записи чатов (под self._lock): байты serde и кортежи не меняются"""
+        write_keys = self._thread_keys(self.writes, thread_ids)
+        blob_keys = self._thread_keys(self.blobs, thread_ids)
+        return {
+            thread_id: _ThreadSnapshot(
+                storage={ns: dict(checkpoints) for ns, checkpoints in self.storage.get(thread_id, {}).items()},
+                writes={key: dict(self.writes[key]) for key in write_keys[thread_id]},
+                blobs={key: self.blobs[key] for key in blob_keys[thread_id]},
+            )
+            for thread_id in thread_ids
+        }
+
+    def _compact(self, snapshot: _ThreadSnapshot):
+        """
+        Последние keep_versions checkpoints и только нужные им версии каналов (вне блокировки)
+
+        Returns:
+            tuple: (удаляемые checkpoints [(ns, id)], ключи writes, ключи blobs) - убираются
+            из снимка, памяти и файла
+        """
+        referenced = set()
+        kept = set()
+        pruned = []
+        for checkpoint_ns, checkpoints in snapshot.storage.items():
+            ids = sorted(checkpoints)
+            for checkpoint_id in ids[:-self.keep_versions]:
+                del checkpoints[checkpoint_id]
+                pruned.append((checkpoint_ns, checkpoint_id))
+            for checkpoint_id in ids[-self.keep_versions:]:
+                kept.add((checkpoint_ns, checkpoint_id))
+                checkpoint = self.serde.loads_typed(checkpoints[checkpoint_id][0])
+                for channel, version in checkpoint["channel_versions"].items():
+                    referenced.add((checkpoint_ns, channel, version))
+        pruned_writes = [key for key in snapshot.writes if key[1:] not in kept]
+        pruned_blobs = [key for key in snapshot.blobs if key[1:] not in referenced]
+        for key in pruned_writes:
+            del snapshot.writes[key]
+        for key in pruned_blobs:
+            del snapshot.blobs[key]
+        return pruned, pruned_writes, pruned_blobs
+
+    def _drop_from_memory(self, thread_id: str, write_keys: list, blob_keys: list):
+        self.storage.pop(thread_id, None)
+        for key in write_keys:
+            self.writes.pop(key, None)
+        for key in blob_keys:
+            self.blobs.pop(key, None)
+        self._last_access.pop(thread_id, None)
+
+    def flush(self):
+        """
+        Пакетная запись измененных чатов в SQLite (одна транзакция)
+
+        1. Под блокировкой памяти - снимок измененных чатов
+        2. Без блокировки - сжатие снимка (десериализация checkpoints) и запись в файл
+        3. Под блокировкой памяти - удаление старых версий, найденных при сжатии
+
+        Старые версии можно удалять после шага 2: новые checkpoints ссылаются либо на новые
+        версии каналов, либо на версии последнего checkpoint снимка, который сохранен.
+        """
+        with self._write_lock:
+            with self._lock:
+                if not self._dirty and not self._deleted:
+                    return
+                dirty, self._dirty = self._dirty, set()
+                deleted, self._deleted = self._deleted, set()
+                snapshots = self._snapshot(dirty)
+
+            pruned = {thread_id: self._compact(snapshot) for thread_id, snapshot in snapshots.items()}
+            try:
+                self._write(snapshots, pruned, deleted)
+            except Exception:
+                # Запись не удалась - повторим на следующем flush
+                with self._lock:
+                    self._dirty |= dirty
+                    self._deleted |= deleted
+                raise
+
+            with self._lock:
+                for thread_id, (checkpoints, write_keys, blob_keys) in pruned.items():
+                    thread_storage = self.storage.get(thread_id, {})
+                    for checkpoint_ns, checkpoint_id in checkpoints:
+                        thread_storage.get(checkpoint_ns, {}).pop(checkpoint_id, None)
+                    for key in write_keys:
+                        self.writes.pop(key, None)
+                    for key in blob_keys:
+                        self.blobs.pop(key, None)
+                    self.pruned_checkpoints += len(checkpoints)
+            self.flushes += 1
+            logger.debug(f"Checkpoints flushed for {len(snapshots)} threads")
+
+    def _write(self, snapshots: dict, pruned: dict, deleted: set):
+        now = time.time()
+        conn = self._writer
+        with conn:
+            for table in _DATA_TABLES:
+                conn.executemany(f"DELETE FROM {table} WHERE thread_id = ?", [(t,) for t in deleted])
+            for thread_id, snapshot in snapshots.items():
+                checkpoints, write_keys, blob_keys = pruned[thread_id]
+                conn.executemany(
+                    "DELETE FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+                    [(thread_id, ns, checkpoint_id) for ns, checkpoint_id in checkpoints]
+                )
+                conn.executemany(
+                    "DELETE FROM checkpoint_writes WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+                    write_keys
+                )
+                conn.executemany(
+                    "DELETE FROM checkpoint_blobs "
+                    "WHERE thread_id = ? AND checkpoint_ns = ? AND channel = ? AND version = ?",
+                    [(t, ns, channel, str(version)) for t, ns, channel, version in blob_keys]
+                )
+                # checkpoint и версия канала с данным ключом не меняются - уже записанные пропускаются
+                conn.executemany(
+                    "INSERT OR IGNORE INTO checkpoints VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    [
+                        (thread_id, ns, checkpoint_id, parent_id, *checkpoint, *metadata)
+                        for ns, checkpoints_ in snapshot.storage.items()
+                        for checkpoint_id, (checkpoint, metadata, parent_id) in checkpoints_.items()
+                    ]
+                )
+                conn.executemany(
+                    "INSERT OR IGNORE INTO checkpoint_blobs VALUES (?, ?, ?, ?, ?, ?)",
+                    [(t, ns, channel, str(version), *value) for (t, ns, channel, version), value in snapshot.blobs.items()]
+                )
+                conn.executemany(
+                    "INSERT OR REPLACE INTO checkpoint_writes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    [
+                        (t, ns, checkpoint_id, task_id, idx, channel, *value, task_path)
+                        for (t, ns, checkpoint_id), task_writes in snapshot.writes.items()
+                        for (task_id, idx), (_, channel, value, task_path) in task_writes.items()
+                    ]
+                )
+            conn.executemany(
+                "INSERT INTO thread_activity (thread_id, updated_at) VALUES (?, ?) "
+                "ON CONFLICT(thread_id) DO UPDATE SET updated_at = excluded.updated_at",
+                [(thread_id, now) for thread_id in snapshots]
+            )
+
+    def evict_idle(self):
+        """Выгрузка из памяти чатов без активности (уже записанных в SQLite)"""
+        with self._lock:
+            now = time.monotonic()
+            idle = {
+                thread_id for thread_id, last in self._last_access.items()
+                if now - last > self.idle_seconds and thread_id not in self._dirty
+            }
+            if not idle:
+                return
+            write_keys = self._thread_keys(self.writes, idle)
+            blob_keys = self._thread_keys(self.blobs, idle)
+            for thread_id in idle:
+                self._drop_from_memory(thread_id, write_keys[thread_id], blob_keys[thread_id])
+            self.evictions += len(idle)
+            logger.info(f"Evicted {len(idle)} idle threads from memory, {len(self._last_access)} remain")
+
+    def prune_stale(self):
+        """Удаление из файла чатов без активности дольше retention_days (кроме чатов в памяти)"""
+        if not self.retention_days:
+            return
+        cutoff = time.time() - self.retention_days * 86400
+        with self._lock:
+            hot = list(self._last_access)
+        with self._write_lock, self._writer as conn:
+            # Чаты в памяти - во временной таблице, а не параметром на каждый чат в NOT IN (...)
+            conn.execute("CREATE TEMP TABLE IF NOT EXISTS hot_threads (thread_id TEXT PRIMARY KEY)")
+            conn.execute("DELETE FROM hot_threads")
+            conn.executemany("INSERT OR IGNORE INTO hot_threads VALUES (?)", [(t,) for t in hot])
+            conn.execute("DROP TABLE IF EXISTS temp.stale_threads")
+            conn.execute(
+                "CREATE TEMP TABLE stale_threads AS SELECT thread_id FROM thread_activity "
+                "WHERE updated_at < ? AND thread_id NOT IN (SELECT thread_id FROM hot_threads)",
+                (cutoff,)
+            )
+            deleted = conn.execute("SELECT COUNT(*) FROM stale_threads").fetchone()[0]
+            for table in _DATA_TABLES:
+                conn.execute(f"DELETE FROM {table} WHERE thread_id IN (SELECT thread_id FROM stale_threads)")
+            conn.execute("DROP TABLE stale_threads")
+        if deleted:
+            logger.info(f"Pruned {deleted} stale threads from {self.path}")
+
+    def _background(self):
+        last_retention = 0.0
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+                self.evict_idle()
+                if time.monotonic() - last_retention > _RETENTION_INTERVAL:
+                    last_retention = time.monotonic()
+                    self.prune_stale()
+            except Exception as e:
+                logger.error(f"Checkpoint maintenance failed: {e}", exc_info=True)
+
+    def close(self):
+        """Остановка фонового потока и запись несохраненных изменений"""
+        self._stop.set()
+        self._worker.join(timeout=self.flush_interval + 5)
+        self.flush()
+        with self._write_lock, self._lock:
+            self._writer.close()
+            self._reader.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            stored = self._reader.execute("SELECT COUNT(*) FROM thread_activity").fetchone()[0]
+            return {
+                "hot_threads": len(self._last_access),
+                "stored_threads": stored,
+                "loads": self.loads,
+                "evictions": self.evictions,
+                "pruned_checkpoints": self.pruned_checkpoints,
+            }
+
+    # --- Интерфейс checkpointer (async версии InMemorySaver вызывают эти методы) ---
+
+    def get_tuple(self, config):
+        with self._lock:
+            self._touch(config["configurable"]["thread_id"])
+            return super().get_tuple(config)
+
+    def list(self, config, *, filter=None, before=None, limit=None):
+        with self._lock:
+            if config:
+                self._touch(config["configurable"]["thread_id"])
+            return iter(list(super().list(config, filter=filter, before=before, limit=limit)))
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        thread_id = config["configurable"]["thread_id"]
+        with self._lock:
+            self._touch(thread_id)
+            result = super().put(config, checkpoint, metadata, new_versions)
+            self._dirty.add(thread_id)
+            return result
+
+    def put_writes(self, config, writes, task_id, task_path=""):
+        thread_id = config["configurable"]["thread_id"]
+        with self._lock:
+            self._touch(thread_id)
+            super().put_writes(config, writes, task_id, task_path)
+            self._dirty.add(thread_id)
+
+    def delete_thread(self, thread_id):
+        # Из файла чат удаляется при следующем flush; до этого он не загружается из файла повторно
+        with self._lock:
+            super().delete_thread(thread_id)
+            self._last_access.pop(thread_id, None)
+            self._dirty.discard(thread_id)
+            self._deleted.add(thread_id)
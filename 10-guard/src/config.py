@@ -15,11 +15,27 @@ class Config:
     AGENT_SYSTEM_PROMPT_FILE = os.getenv("AGENT_SYSTEM_PROMPT_FILE", "agent_system.txt")
     SYSTEM_PROMPT = os.getenv("SYSTEM_PROMPT")
     
+    # Indexing Configuration
+    INDEX_DIR = os.getenv("INDEX_DIR", "index")  # Персистентный индекс (embeddings + чанки)
+    CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "500"))
+    CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "50"))
+    INDEX_WORKERS = int(os.getenv("INDEX_WORKERS", "0"))  # Процессы для разбора PDF (0 = число ядер)
+    # Планировщик векторизации при индексации
+    EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))  # Текстов в одном запросе
+    EMBEDDING_MAX_CONCURRENCY = int(os.getenv("EMBEDDING_MAX_CONCURRENCY", "4"))  # Параллельных запросов
+    EMBEDDING_MAX_RETRIES = int(os.getenv("EMBEDDING_MAX_RETRIES", "6"))  # Повторов батча при 429/5xx
+    INDEX_PROGRESS_INTERVAL = float(os.getenv("INDEX_PROGRESS_INTERVAL", "2.0"))  # Обновление прогресса в /index (сек)
+    
     # Embeddings Configuration
     EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", "openai")  # openai/huggingface
     HUGGINGFACE_EMBEDDING_MODEL = os.getenv("HUGGINGFACE_EMBEDDING_MODEL", "intfloat/multilingual-e5-base")
     HUGGINGFACE_DEVICE = os.getenv("HUGGINGFACE_DEVICE", "cpu")  # cpu/cuda/mps
     
+    # Кеш embeddings (SQLite, LRU): общий для indexer и evaluation
+    EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+    EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "cache/embeddings.sqlite")
+    EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "200000"))
+    
     # Retrieval Configuration
     RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "semantic")  # semantic/hybrid/hybrid_reranker
     SEMANTIC_RETRIEVER_K = int(os.getenv("SEMANTIC_RETRIEVER_K", "10"))
@@ -27,18 +43,86 @@ class Config:
     ENSEMBLE_SEMANTIC_WEIGHT = float(os.getenv("ENSEMBLE_SEMANTIC_WEIGHT", "0.5"))
     ENSEMBLE_BM25_WEIGHT = float(os.getenv("ENSEMBLE_BM25_WEIGHT", "0.5"))
     
+    # BM25 Analyzer
+    BM25_ANALYZER = os.getenv("BM25_ANALYZER", "russian")  # russian/whitespace
+    BM25_STEMMER = os.getenv("BM25_STEMMER", "none")  # none/porter/pymorphy
+    BM25_STOPWORDS = os.getenv("BM25_STOPWORDS", "true").lower() == "true"
+    
+    # Vector Store Backend
+    VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "numpy")  # numpy/memory/hnsw/faiss
+    HNSW_M = int(os.getenv("HNSW_M", "32"))  # Число связей вершины графа HNSW
+    HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "200"))  # Точность построения
+    HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "64"))  # Точность поиска (больше = точнее и медленнее)
+    
     # Cross-Encoder Reranking Configuration
     CROSS_ENCODER_MODEL = os.getenv("CROSS_ENCODER_MODEL", "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1")
     RERANKER_TOP_K = int(os.getenv("RERANKER_TOP_K", "3"))
+    CROSS_ENCODER_BACKEND = os.getenv("CROSS_ENCODER_BACKEND", "torch")  # torch/onnx/onnx_int8
+    CROSS_ENCODER_ONNX_QUANTIZATION = os.getenv("CROSS_ENCODER_ONNX_QUANTIZATION", "avx2")  # arm64/avx2/avx512/avx512_vnni
+    CROSS_ENCODER_ONNX_DIR = os.getenv("CROSS_ENCODER_ONNX_DIR", "cache/cross_encoder")
+    CROSS_ENCODER_MAX_LENGTH = int(os.getenv("CROSS_ENCODER_MAX_LENGTH", "256"))  # Бюджет токенов на пару
+    CROSS_ENCODER_BATCH_SIZE = int(os.getenv("CROSS_ENCODER_BATCH_SIZE", "32"))
+    CROSS_ENCODER_BATCH_WAIT_MS = float(os.getenv("CROSS_ENCODER_BATCH_WAIT_MS", "5"))  # 0 = без общей очереди
+    RERANKER_CACHE_SIZE = int(os.getenv("RERANKER_CACHE_SIZE", "20000"))  # Пар (вопрос, чанк), 0 = выключен
+    RERANKER_CACHE_TTL = int(os.getenv("RERANKER_CACHE_TTL", "3600"))  # Секунды
+    CROSS_ENCODER_WARMUP = os.getenv("CROSS_ENCODER_WARMUP", "true").lower() == "true"  # Прогрев при старте
+    CROSS_ENCODER_READY_TIMEOUT = float(os.getenv("CROSS_ENCODER_READY_TIMEOUT", "2.0"))  # Ожидание прогрева, сек
+    CROSS_ENCODER_RETRY_DELAY = float(os.getenv("CROSS_ENCODER_RETRY_DELAY", "30"))  # Пауза до повторной загрузки, сек
+    
+    # Быстрый путь FAQ: вопрос совпадает с вопросом из Q&A JSON -> готовый ответ без retrieval и LLM
+    FAQ_FAST_PATH_ENABLED = os.getenv("FAQ_FAST_PATH_ENABLED", "true").lower() == "true"
+    FAQ_FUZZY_THRESHOLD = float(os.getenv("FAQ_FUZZY_THRESHOLD", "0.5"))  # Jaccard триграмм для кандидатов с опечатками
+    
+    # Сжатие результатов rag_search в контексте LLM (полные документы - для источников и RAGAS)
+    RAG_CONTEXT_COMPRESSION = os.getenv("RAG_CONTEXT_COMPRESSION", "true").lower() == "true"
+    RAG_CONTEXT_TOKEN_BUDGET = int(os.getenv("RAG_CONTEXT_TOKEN_BUDGET", "1200"))  # Токенов на вызов rag_search
+    
+    # Семантический кеш ответов (повторяющиеся вопросы клиентов)
+    SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "true").lower() == "true"
+    SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))  # Косинусная близость вопросов
+    SEMANTIC_CACHE_TTL = int(os.getenv("SEMANTIC_CACHE_TTL", "86400"))  # Секунды
+    SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "2000"))
+    
+    # Планировщик запросов: по очереди внутри чата, параллельно между чатами
+    MAX_CONCURRENT_REQUESTS = int(os.getenv("MAX_CONCURRENT_REQUESTS", "8"))  # Одновременно в обработке
+    MAX_QUEUED_REQUESTS = int(os.getenv("MAX_QUEUED_REQUESTS", "50"))  # В ожидании, сверх - отказ
+    MAX_QUEUED_PER_CHAT = int(os.getenv("MAX_QUEUED_PER_CHAT", "3"))
+    RETRIEVAL_WORKERS = int(os.getenv("RETRIEVAL_WORKERS", "4"))  # Потоки для CPU retrieval (BM25, reranking)
+    # Вызовы инструментов одного шага агента выполняются параллельно с общим сроком
+    TOOL_STEP_TIMEOUT = float(os.getenv("TOOL_STEP_TIMEOUT", "20"))  # Секунды
     
     # Отображение источников
     SHOW_SOURCES = os.getenv("SHOW_SOURCES", "false").lower() == "true"
     
+    # Потоковая доставка ответа (редактирование сообщения по мере генерации)
+    STREAMING_ENABLED = os.getenv("STREAMING_ENABLED", "true").lower() == "true"
+    STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.0"))  # Минимум между правками, сек
+    
+    # История диалогов агента (checkpointer)
+    CHECKPOINT_BACKEND = os.getenv("CHECKPOINT_BACKEND", "sqlite")  # sqlite | memory
+    CHECKPOINT_DB_PATH = os.getenv("CHECKPOINT_DB_PATH", "cache/checkpoints.sqlite")
+    CHECKPOINT_KEEP_VERSIONS = int(os.getenv("CHECKPOINT_KEEP_VERSIONS", "3"))  # Последних checkpoints на чат
+    CHECKPOINT_IDLE_SECONDS = int(os.getenv("CHECKPOINT_IDLE_SECONDS", "1800"))  # Выгрузка неактивного чата из памяти
+    CHECKPOINT_FLUSH_INTERVAL = float(os.getenv("CHECKPOINT_FLUSH_INTERVAL", "2.0"))  # Пакетная запись в SQLite, сек
+    CHECKPOINT_RETENTION_DAYS = float(os.getenv("CHECKPOINT_RETENTION_DAYS", "30"))  # 0 - хранить всегда
+    
+    # Ограничение истории диалога: фоновая суммаризация старых ходов
+    HISTORY_SUMMARY_ENABLED = os.getenv("HISTORY_SUMMARY_ENABLED", "true").lower() == "true"
+    HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "3000"))  # Больше - суммаризация в фоне
+    HISTORY_MAX_TOKENS = int(os.getenv("HISTORY_MAX_TOKENS", "8000"))  # Больше - старые ходы отбрасываются
+    HISTORY_KEEP_TURNS = int(os.getenv("HISTORY_KEEP_TURNS", "3"))  # Последние ходы остаются дословно
+    HISTORY_SUMMARY_MODEL = os.getenv("HISTORY_SUMMARY_MODEL", MODEL)
+    HISTORY_SUMMARY_PROMPT_FILE = os.getenv("HISTORY_SUMMARY_PROMPT_FILE", "history_summary.txt")
+    
     # MCP Configuration
     MCP_ENABLED = os.getenv("MCP_ENABLED", "true").lower() == "true"
     MCP_SERVER_NAME = os.getenv("MCP_SERVER_NAME", "mcp-bank-agent")
     MCP_SERVER_URL = os.getenv("MCP_SERVER_URL", "http://localhost:8000/mcp")
     MCP_SERVER_TRANSPORT = os.getenv("MCP_SERVER_TRANSPORT", "streamable_http")
+    MCP_POOL_SIZE = int(os.getenv("MCP_POOL_SIZE", "2"))  # Постоянных MCP сессий
+    MCP_HEALTH_INTERVAL = float(os.getenv("MCP_HEALTH_INTERVAL", "30"))  # Проверка соединения (ping), сек
+    MCP_CONNECT_TIMEOUT = float(os.getenv("MCP_CONNECT_TIMEOUT", "10"))  # Ожидание сервера при старте, сек
+    MCP_RECONNECT_MAX_DELAY = float(os.getenv("MCP_RECONNECT_MAX_DELAY", "60"))  # Максимальная пауза переподключения
     
     # LangSmith настройки
     LANGSMITH_API_KEY = os.getenv("LANGSMITH_API_KEY")
@@ -82,6 +166,50 @@ class Config:
                 f"Must be one of: {', '.join(valid_retrieval_modes)}"
             )
         
+        # Валидация VECTOR_BACKEND
+        valid_vector_backends = ["numpy", "memory", "hnsw", "faiss"]
+        if cls.VECTOR_BACKEND not in valid_vector_backends:
+            raise ValueError(
+                f"Invalid VECTOR_BACKEND: {cls.VECTOR_BACKEND}. "
+                f"Must be one of: {', '.join(valid_vector_backends)}"
+            )
+        
+        # Валидация CROSS_ENCODER_BACKEND
+        valid_cross_encoder_backends = ["torch", "onnx", "onnx_int8"]
+        if cls.CROSS_ENCODER_BACKEND not in valid_cross_encoder_backends:
+            raise ValueError(
+                f"Invalid CROSS_ENCODER_BACKEND: {cls.CROSS_ENCODER_BACKEND}. "
+                f"Must be one of: {', '.join(valid_cross_encoder_backends)}"
+            )
+        
+        # Валидация анализатора BM25
+        valid_bm25_analyzers = ["russian", "whitespace"]
+        if cls.BM25_ANALYZER not in valid_bm25_analyzers:
+            raise ValueError(
+                f"Invalid BM25_ANALYZER: {cls.BM25_ANALYZER}. "
+                f"Must be one of: {', '.join(valid_bm25_analyzers)}"
+            )
+        valid_bm25_stemmers = ["porter", "pymorphy", "none"]
+        if cls.BM25_STEMMER not in valid_bm25_stemmers:
+            raise ValueError(
+                f"Invalid BM25_STEMMER: {cls.BM25_STEMMER}. "
+                f"Must be one of: {', '.join(valid_bm25_stemmers)}"
+            )
+        
+        # Валидация порога семантического кеша
+        if not 0 < cls.SEMANTIC_CACHE_THRESHOLD <= 1:
+            raise ValueError(
+                f"Invalid SEMANTIC_CACHE_THRESHOLD: {cls.SEMANTIC_CACHE_THRESHOLD}. Must be in (0, 1]"
+            )
+        
+        # Валидация CHECKPOINT_BACKEND
+        valid_checkpoint_backends = ["sqlite", "memory"]
+        if cls.CHECKPOINT_BACKEND not in valid_checkpoint_backends:
+            raise ValueError(
+                f"Invalid CHECKPOINT_BACKEND: {cls.CHECKPOINT_BACKEND}. "
+                f"Must be one of: {', '.join(valid_checkpoint_backends)}"
+            )
+        
         # Валидация EMBEDDING_PROVIDER
         valid_embedding_providers = ["openai", "huggingface", "ollama"]
         if cls.EMBEDDING_PROVIDER not in valid_embedding_providers:
@@ -0,0 +1,158 @@
+"""
+Сжатие результатов rag_search перед отправкой в LLM
+
+ToolMessage с найденными чанками остается в истории агента и повторно отправляется в LLM
+на каждом следующем шаге ReAct и во всех следующих вопросах диалога. Поэтому в контекст
+модели идет сжатая версия, а полные документы - отдельно (artifact ToolMessage)
+для отображения источников и RAGAS.
+
+Этапы:
+1. Дедупликация: соседние чанки одного PDF пересекаются на CHUNK_OVERLAP символов -
+   пересечение вырезается; повторяющиеся предложения удаляются
+2. Извлечение: если контекст не помещается в бюджет, из PDF чанков остаются предложения
+   с терминами запроса (тот же анализатор, что у BM25); Q&A пары короткие и остаются целиком
+3. Бюджет: документы добавляются по порядку релевантности, пока не исчерпан
+   RAG_CONTEXT_TOKEN_BUDGET токенов
+"""
+import json
+import logging
+import re
+
+from analyzers import get_analyzer
+from config import config
+
+logger = logging.getLogger(__name__)
+
+_SENTENCE_RE = re.compile(r"(?<=[.!?;])\s+|\n+")
+# Минимальная длина пересечения чанков (короче - случайное совпадение)
+_MIN_OVERLAP = 12
+
+# Общая статистика сжатия (для /index_status)
+stats = {"calls": 0, "tokens_full": 0, "tokens_compact": 0}
+
+_encoding = None
+
+
+def count_tokens(text: str) -> int:
+    """Число токенов (tiktoken cl100k_base; без него - оценка по длине текста)"""
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            # Словарь tiktoken скачивается при первом использовании - offline его может не быть
+            logger.warning(f"tiktoken is unavailable, estimating tokens by length: {e}")
+            _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text))
+    return len(text) // 3 + 1
+
+
+def _trim_overlap(previous: str, text: str, max_overlap: int) -> str:
+    """Убирает из text начало/конец, совпадающие с концом/началом previous"""
+    for size in range(min(max_overlap, len(previous), len(text)), _MIN_OVERLAP - 1, -1):
+        if previous.endswith(text[:size]):
+            text = text[size:]
+            break
+    for size in range(min(max_overlap, len(previous), len(text)), _MIN_OVERLAP - 1, -1):
+        if previous.startswith(text[-size:]):
+            text = text[:-size]
+            break
+    return text.strip()
+
+
+def deduplicate(documents: list) -> list:
+    """
+    Тексты документов без пересечений соседних чанков и повторов предложений
+
+    Returns:
+        list[tuple]: (Document, текст) в исходном порядке, пустые тексты отброшены
+    """
+    max_overlap = config.CHUNK_OVERLAP * 2
+    seen_sentences = set()
+    kept = []
+    for doc in documents:
+        text = doc.page_content
+        source = doc.metadata.get("source")
+        # Пересекаются только чанки одного PDF (Q&A пара - отдельный документ)
+        if not doc.metadata.get("question"):
+            for other, _ in kept:
+                if other.metadata.get("source") == source and not other.metadata.get("question"):
+                    text = _trim_overlap(other.page_content, text, max_overlap)
+        sentences = []
+        for sentence in _SENTENCE_RE.split(text):
+            key = " ".join(sentence.split()).lower()
+            if not key or key in seen_sentences:
+                continue
+            seen_sentences.add(key)
+            sentences.append(sentence.strip())
+        if sentences:
+            kept.append((doc, " ".join(sentences) if not doc.metadata.get("question") else text))
+    return kept
+
+
+def extract_relevant(query: str, text: str) -> str:
+    """Предложения с терминами запроса (в исходном порядке); без совпадений - первые два"""
+    analyzer = get_analyzer()
+    query_terms = set(analyzer(query))
+    sentences = [s for s in _SENTENCE_RE.split(text) if s.strip()]
+    relevant = [s for s in sentences if query_terms & set(analyzer(s))]
+    return " ".join(relevant or sentences[:2])
+
+
+def compress_documents(query: str, documents: list, budget: int = None) -> list:
+    """
+    Сжатый контекст для LLM
+
+    Returns:
+        list[dict]: источники в формате rag_search ({"source", "page"?, "page_content"})
+    """
+    budget = budget or config.RAG_CONTEXT_TOKEN_BUDGET
+    deduplicated = deduplicate(documents)
+    needs_extraction = sum(count_tokens(text) for _, text in deduplicated) > budget
+
+    sources = []
+    used = 0
+    for doc, text in deduplicated:
+        if needs_extraction and not doc.metadata.get("question"):
+            text = extract_relevant(query, text)
+        tokens = count_tokens(text)
+        if used + tokens > budget:
+            if sources:
+                break
+            # Первый (самый релевантный) документ обрезаем до бюджета, а не выбрасываем
+            text = text[:budget * 3]
+            tokens = count_tokens(text)
+        used += tokens
+        source = {"source": doc.metadata.get("source", "Unknown"), "page_content": text}
+        if "page" in doc.metadata:
+            source["page"] = doc.metadata["page"]
+        sources.append(source)
+    return sources
+
+
+def record(full_payload: str, compact_payload: str) -> dict:
+    """Учет сэкономленных токенов; возвращает {"tokens_full", "tokens_compact"} для artifact"""
+    tokens = {"tokens_full": count_tokens(full_payload), "tokens_compact": count_tokens(compact_payload)}
+    stats["calls"] += 1
+    stats["tokens_full"] += tokens["tokens_full"]
+    stats["tokens_compact"] += tokens["tokens_compact"]
+    return tokens
+
+
+def dumps(sources: list) -> str:
+    """JSON без лишних пробелов и с кириллицей как есть (меньше токенов)"""
+    return json.dumps({"sources": sources}, ensure_ascii=False, separators=(",", ":"))
+
+
+def get_stats():
+    """Статистика сжатия (None если сжатие выключено)"""
+    if not config.RAG_CONTEXT_COMPRESSION:
+        return None
+    saved = stats["tokens_full"] - stats["tokens_compact"]
+    return {
+        **stats,
+        "tokens_saved": saved,
+        "ratio": stats["tokens_compact"] / stats["tokens_full"] if stats["tokens_full"] else 1.0,
+    }
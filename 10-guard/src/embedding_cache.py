@@ -0,0 +1,278 @@
+"""
+Кеш embeddings с content-addressed ключами
+
+Ключ записи = sha256(провайдер:модель | тип | текст), поэтому одинаковый текст,
+векторизованный одной и той же моделью, никогда не отправляется провайдеру повторно:
+ни чанки при переиндексации, ни ответы и контексты при RAGAS evaluation.
+
+Хранилище документов - локальный SQLite файл (EMBEDDING_CACHE_PATH) с ограничением
+по количеству записей (EMBEDDING_CACHE_MAX_ENTRIES) и вытеснением по LRU.
+
+Вопросы клиентов (embed_query) на диск не пишутся: в них могут быть персональные данные,
+а поток уникальных вопросов вытеснял бы векторы чанков. Для них - небольшой LRU в памяти
+процесса, без SQLite на пути запроса. Вопросы датасета evaluation повторяются от запуска
+к запуску, поэтому RAGAS embeddings сохраняют их в SQLite (persist_queries=True).
+"""
+import asyncio
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+# SQLite ограничивает число параметров в одном запросе
+_SQL_BATCH = 500
+# Размер LRU кеша векторов вопросов (в памяти)
+_QUERY_CACHE_SIZE = 1024
+
+
+class EmbeddingCacheStore:
+    """
+    SQLite хранилище векторов с LRU вытеснением
+
+    Потокобезопасно: embeddings вызываются и из event loop, и из thread pool.
+    """
+
+    def __init__(self, path: str, max_entries: int):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings(last_used)")
+        self._conn.commit()
+        self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_many(self, keys: list) -> dict:
+        """Векторы для найденных ключей: {key: list[float]}, отметка last_used обновляется"""
+        found = {}
+        now = time.time()
+        with self._lock:
+            for i in range(0, len(keys), _SQL_BATCH):
+                batch = keys[i:i + _SQL_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+            if found:
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    [(now, key) for key in found]
+                )
+                self._conn.commit()
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, items: dict):
+        """Сохранение {key: vector} с последующим вытеснением самых старых записей"""
+        if not items:
+            return
+        now = time.time()
+        rows = [
+            (key, np.asarray(vector, dtype=np.float32).tobytes(), now)
+            for key, vector in items.items()
+        ]
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)", rows
+            )
+            self._count += self._conn.total_changes - before
+            overflow = self._count - self.max_entries
+            if overflow > 0:
+                self._conn.execute(
+                    "DELETE FROM embeddings WHERE key IN "
+                    "(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                    (overflow,)
+                )
+                self._count -= overflow
+                self.evictions += overflow
+            self._conn.commit()
+
+    def clear(self):
+        """Удаление всех записей (например, при смене формата)"""
+        with self._lock:
+            self._conn.execute("DELETE FROM embeddings")
+            self._conn.commit()
+            self._count = 0
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": self._count,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "evictions": self.evictions,
+        }
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Обертка над любым LangChain Embeddings с кешированием в EmbeddingCacheStore
+
+    В провайдер уходят только тексты, которых нет в кеше (без повторов внутри батча).
+    Запросы кешируются отдельно от документов: некоторые модели векторизуют их
+    по-разному (префиксы query:/passage: и т.п.). По умолчанию - только в памяти,
+    с persist_queries=True - в EmbeddingCacheStore, как документы.
+    """
+
+    def __init__(self, underlying: Embeddings, namespace: str, store: EmbeddingCacheStore,
+                 query_cache_size: int = _QUERY_CACHE_SIZE, persist_queries: bool = False):
+        self.underlying = underlying
+        self.namespace = namespace
+        self.store = store
+        self.persist_queries = persist_queries
+        self.query_cache_size = query_cache_size
+        self._queries = OrderedDict()  # текст вопроса -> вектор
+        self._queries_lock = threading.Lock()
+        self.query_hits = 0
+        self.query_misses = 0
+        # Тексты документов, взятые из кеша / отправленные провайдеру этим экземпляром
+        # (счетчики store общие для всех пользователей кеша)
+        self.document_hits = 0
+        self.document_misses = 0
+
+    def _key(self, kind: str, text: str) -> str:
+        return hashlib.sha256(f"{self.namespace}|{kind}|{text}".encode("utf-8")).hexdigest()
+
+    def _lookup(self, kind: str, texts: list):
+        """Возвращает (ключи, найденные векторы, уникальные тексты-промахи)"""
+        keys = [self._key(kind, text) for text in texts]
+        found = self.store.get_many(list(dict.fromkeys(keys)))
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+        return keys, found, missing
+
+    def _count_documents(self, keys: list, missing: dict):
+        """Учет успешно векторизованного батча в счетчиках экземпляра"""
+        misses = sum(1 for key in keys if key in missing)
+        self.document_hits += len(keys) - misses
+        self.document_misses += misses
+
+    def embed_documents(self, texts: list) -> list:
+        keys, found, missing = self._lookup("document", texts)
+        if missing:
+            vectors = self.underlying.embed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            self.store.put_many(computed)
+            found.update(computed)
+        self._count_documents(keys, missing)
+        return [found[key] for key in keys]
+
+    def _get_query(self, text: str):
+        with self._queries_lock:
+            vector = self._queries.get(text)
+            if vector is None:
+                self.query_misses += 1
+                return None
+            self._queries.move_to_end(text)
+            self.query_hits += 1
+            return vector
+
+    def _put_query(self, text: str, vector: list):
+        with self._queries_lock:
+            self._queries[text] = vector
+            self._queries.move_to_end(text)
+            while len(self._queries) > self.query_cache_size:
+                self._queries.popitem(last=False)
+
+    def embed_query(self, text: str) -> list:
+        if self.persist_queries:
+            keys, found, missing = self._lookup("query", [text])
+            if missing:
+                found[keys[0]] = self.underlying.embed_query(text)
+                self.store.put_many({keys[0]: found[keys[0]]})
+            return found[keys[0]]
+        vector = self._get_query(text)
+        if vector is None:
+            vector = self.underlying.embed_query(text)
+            self._put_query(text, vector)
+        return vector
+
+    async def aembed_documents(self, texts: list) -> list:
+        # SQLite операции короткие, но блокирующие - выполняем их в потоке
+        keys, found, missing = await asyncio.to_thread(self._lookup, "document", texts)
+        if missing:
+            vectors = await self.underlying.aembed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            await asyncio.to_thread(self.store.put_many, computed)
+            found.update(computed)
+        self._count_documents(keys, missing)
+        return [found[key] for key in keys]
+
+    async def aembed_query(self, text: str) -> list:
+        if self.persist_queries:
+            keys, found, missing = await asyncio.to_thread(self._lookup, "query", [text])
+            if missing:
+                found[keys[0]] = await self.underlying.aembed_query(text)
+                await asyncio.to_thread(self.store.put_many, {keys[0]: found[keys[0]]})
+            return found[keys[0]]
+        vector = self._get_query(text)
+        if vector is None:
+            vector = await self.underlying.aembed_query(text)
+            self._put_query(text, vector)
+        return vector
+
+
+# Общее хранилище для indexer и evaluation (одно соединение на процесс)
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> EmbeddingCacheStore:
+    """Ленивая инициализация общего хранилища кеша"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = EmbeddingCacheStore(config.EMBEDDING_CACHE_PATH, config.EMBEDDING_CACHE_MAX_ENTRIES)
+            logger.info(
+                f"Embedding cache: {config.EMBEDDING_CACHE_PATH} "
+                f"({_store.stats()['entries']}/{config.EMBEDDING_CACHE_MAX_ENTRIES} entries)"
+            )
+    return _store
+
+
+def wrap_embeddings(embeddings: Embeddings, namespace: str, persist_queries: bool = False) -> Embeddings:
+    """
+    Оборачивает embeddings кешем, если он включен (EMBEDDING_CACHE_ENABLED)
+
+    Args:
+        embeddings: исходный объект LangChain Embeddings
+        namespace: провайдер и модель, например "openai:text-embedding-3-large"
+        persist_queries: сохранять векторы запросов в SQLite (только для evaluation)
+    """
+    if not config.EMBEDDING_CACHE_ENABLED:
+        return embeddings
+    return CachedEmbeddings(embeddings, namespace, get_store(), persist_queries=persist_queries)
+
+
+def get_stats():
+    """Статистика кеша (None если кеш выключен или еще не использовался)"""
+    if _store is None:
+        return None
+    return _store.stats()
@@ -0,0 +1,157 @@
+"""
+Планировщик векторизации для переиндексации
+
+Вместо одного вызова embed_documents на весь корпус:
+- тексты отправляются асинхронными батчами (EMBEDDING_BATCH_SIZE)
+- число одновременных запросов ограничено (EMBEDDING_MAX_CONCURRENCY)
+- на 429 (rate limit) лимит параллельности снижается вдвое и батч повторяется
+  с экспоненциальной задержкой (или по Retry-After), после успешных батчей
+  лимит постепенно восстанавливается (AIMD, как в TCP)
+- готовые батчи сохраняет кеш embeddings (embedding_cache): если переиндексация
+  упала посередине, повторный запуск не векторизует их заново
+- прогресс и скорость (чанков/сек) передаются в callback для ответа на /index
+"""
+import asyncio
+import logging
+import random
+import time
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """429 от провайдера (OpenAI, OpenRouter, Fireworks и т.д.)"""
+    if getattr(error, "status_code", None) == 429:
+        return True
+    if type(error).__name__ == "RateLimitError":
+        return True
+    return "429" in str(error) or "rate limit" in str(error).lower()
+
+
+def is_transient_error(error: Exception) -> bool:
+    """Временные ошибки, после которых имеет смысл повторить батч"""
+    status = getattr(error, "status_code", None)
+    if status is not None and status >= 500:
+        return True
+    return isinstance(error, (TimeoutError, ConnectionError)) or type(error).__name__ in (
+        "APITimeoutError", "APIConnectionError", "InternalServerError"
+    )
+
+
+def _retry_after(error: Exception):
+    """Значение заголовка Retry-After в секундах (если провайдер его прислал)"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class EmbeddingScheduler:
+    """
+    Асинхронная векторизация батчами с адаптивным ограничением параллельности
+
+    Использование:
+        scheduler = EmbeddingScheduler(embeddings, progress=callback)
+        task = scheduler.submit(texts)   # можно вызывать много раз по мере поступления чанков
+        vectors = await task
+    """
+
+    def __init__(self, embeddings, progress=None,
+                 batch_size: int = None, max_concurrency: int = None, max_retries: int = None):
+        self.embeddings = embeddings
+        self.progress = progress
+        self.batch_size = batch_size or config.EMBEDDING_BATCH_SIZE
+        self.max_concurrency = max_concurrency or config.EMBEDDING_MAX_CONCURRENCY
+        self.max_retries = max_retries if max_retries is not None else config.EMBEDDING_MAX_RETRIES
+
+        self._limit = self.max_concurrency
+        self._active = 0
+        self._condition = asyncio.Condition()
+
+        self.submitted = 0
+        self.done = 0
+        self.rate_limited = 0
+        self.started = time.perf_counter()
+
+    async def _acquire(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._active < self._limit)
+            self._active += 1
+
+    async def _release(self, rate_limited: bool = False):
+        async with self._condition:
+            self._active -= 1
+            if rate_limited:
+                # Multiplicative decrease: сразу снижаем нагрузку на провайдера
+                self._limit = max(1, self._limit // 2)
+            elif self._limit < self.max_concurrency:
+                # Additive increase: по одному слоту за успешный батч
+                self._limit += 1
+            self._condition.notify_all()
+
+    async def _embed_batch(self, texts: list) -> list:
+        attempt = 0
+        while True:
+            await self._acquire()
+            rate_limited = False
+            try:
+                vectors = await self.embeddings.aembed_documents(texts)
+                await self._report(len(texts))
+                return vectors
+            except Exception as e:
+                rate_limited = is_rate_limit_error(e)
+                if not (rate_limited or is_transient_error(e)) or attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                if rate_limited:
+                    self.rate_limited += 1
+                delay = _retry_after(e) or min(60.0, (2 ** attempt) * 0.5) * (1 + random.random() * 0.25)
+                logger.warning(
+                    f"Embedding batch failed ({type(e).__name__}), retry {attempt}/{self.max_retries} "
+                    f"in {delay:.1f}s, concurrency limit -> {max(1, self._limit // 2) if rate_limited else self._limit}"
+                )
+            finally:
+                await self._release(rate_limited)
+            await asyncio.sleep(delay)
+
+    async def _report(self, n: int):
+        self.done += n
+        if self.progress is None:
+            return
+        try:
+            await self.progress(self.stats())
+        except Exception as e:
+            logger.debug(f"Progress callback failed: {e}")
+
+    def submit(self, texts: list) -> asyncio.Task:
+        """
+        Запуск векторизации текстов батчами в фоне
+
+        Returns:
+            asyncio.Task, результат - список векторов в порядке texts
+        """
+        self.submitted += len(texts)
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+
+        async def run():
+            results = await asyncio.gather(*(self._embed_batch(batch) for batch in batches))
+            return [vector for batch_vectors in results for vector in batch_vectors]
+
+        return asyncio.ensure_future(run())
+
+    def stats(self) -> dict:
+        elapsed = time.perf_counter() - self.started
+        return {
+            "done": self.done,
+            "submitted": self.submitted,
+            "rate_limited": self.rate_limited,
+            "concurrency_limit": self._limit,
+            "elapsed": elapsed,
+            "rate": self.done / elapsed if elapsed > 0 else 0.0,
+        }
@@ -20,6 +20,7 @@ from ragas.llms import LangchainLLMWrapper
 from ragas.embeddings import LangchainEmbeddingsWrapper
 from ragas.run_config import RunConfig
 from config import config
+import embedding_cache
 
 logger = logging.getLogger(__name__)
 
@@ -31,26 +32,35 @@ def create_ragas_embeddings():
     """
     Фабрика для создания RAGAS embeddings по провайдеру из конфига
     Поддерживает: openai, huggingface
+    
+    Использует общий с indexer кеш embeddings: вопросы, ответы и эталоны
+    не векторизуются повторно между запусками evaluation (вопросы датасета
+    сохраняются в SQLite, в отличие от вопросов клиентов)
     """
     provider = config.RAGAS_EMBEDDING_PROVIDER.lower()
     
     if provider == "openai":
         logger.info(f"Creating RAGAS OpenAI embeddings: {config.RAGAS_EMBEDDING_MODEL}")
-        return OpenAIEmbeddings(model=config.RAGAS_EMBEDDING_MODEL)
+        embeddings = OpenAIEmbeddings(model=config.RAGAS_EMBEDDING_MODEL)
+        model_name = config.RAGAS_EMBEDDING_MODEL
     elif provider == "ollama":
         logger.info(f"Creating RAGAS ollama embeddings: {config.RAGAS_EMBEDDING_MODEL}")
-        return OllamaEmbeddings(model=config.RAGAS_EMBEDDING_MODEL)
+        embeddings = OllamaEmbeddings(model=config.RAGAS_EMBEDDING_MODEL)
+        model_name = config.RAGAS_EMBEDDING_MODEL
 
     elif provider == "huggingface":
         logger.info(f"Creating RAGAS HuggingFace embeddings: {config.RAGAS_HUGGINGFACE_EMBEDDING_MODEL} on {config.RAGAS_HUGGINGFACE_DEVICE}")
-        return HuggingFaceEmbeddings(
+        embeddings = HuggingFaceEmbeddings(
             model_name=config.RAGAS_HUGGINGFACE_EMBEDDING_MODEL,
             model_kwargs={'device': config.RAGAS_HUGGINGFACE_DEVICE},
             encode_kwargs={'normalize_embeddings': True}
         )
+        model_name = config.RAGAS_HUGGINGFACE_EMBEDDING_MODEL
     
     else:
         raise ValueError(f"Unknown RAGAS embedding provider: {provider}. Use 'openai' or 'huggingface'")
+    
+    return embedding_cache.wrap_embeddings(embeddings, f"{provider}:{model_name}", persist_queries=True)
 
 def init_ragas_metrics():
     """
@@ -196,8 +206,11 @@ async def evaluate_dataset(dataset_name: Optional[str] = None) -> Dict[str, Any]
         # 2. Каждый вопрос обрабатывался независимо
         chat_id = hash(question) % 1000000
         
-        # Вызываем агента так же как в боте
-        result = await agent.agent_answer([HumanMessage(content=question)], chat_id)
+        # Вызываем агента так же как в боте, но без кеша ответов и быстрого пути FAQ:
+        # оценивается ответ агента, а не сохраненный ответ или ответ из справки
+        result = await agent.agent_answer(
+            [HumanMessage(content=question)], chat_id, use_cache=False, fast_path=False
+        )
         
         # Возвращаем answer и documents для дальнейшей оценки
         return {
@@ -0,0 +1,139 @@
+"""
+Быстрый путь для FAQ: точное и почти точное совпадение с вопросом из Q&A JSON
+
+Значительная часть вопросов клиентов дословно (или с опечаткой) совпадает с вопросом
+из справки банка. Для них готовый ответ уже есть - retrieval, embeddings и LLM не нужны.
+
+Две ступени поиска:
+- точное совпадение: хеш нормализованного вопроса (регистр, ё/е, пунктуация, пробелы)
+- почти точное (опечатки): кандидаты - из инвертированного индекса символьных триграмм
+  с Jaccard >= FAQ_FUZZY_THRESHOLD, затем пословная проверка: те же слова в том же порядке,
+  каждое - с точностью до 1-2 опечаток. Похожие по триграммам, но разные по смыслу вопросы
+  ("на какие операции действует / не действует ...", "заказать / закрыть карту") не совпадают
+
+Развитие lexical_index из 05-rag-langchain: там - только точное совпадение в одном модуле.
+"""
+import hashlib
+from collections import defaultdict
+
+from analyzers import normalize_question
+
+_ANSWER_MARKER = "Ответ:"
+
+
+def question_hash(normalized: str) -> str:
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+def trigrams(normalized: str) -> set:
+    """Символьные триграммы с границами слов ("  к", " ка", ...)"""
+    padded = f"  {normalized} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _max_typos(word: str) -> int:
+    """Допустимое число опечаток в слове: короткие слова и числа - без опечаток"""
+    if len(word) < 4 or word.isdigit():
+        return 0
+    return 1 if len(word) < 8 else 2
+
+
+def _edit_distance(a: str, b: str, limit: int) -> int:
+    """Расстояние Дамерау-Левенштейна (с перестановкой соседних букв), > limit - досрочный выход"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous2, previous = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+def words_match(query: str, question: str) -> bool:
+    """Те же слова в том же порядке, с опечатками в пределах _max_typos"""
+    query_words, question_words = query.split(), question.split()
+    if len(query_words) != len(question_words):
+        return False
+    for a, b in zip(query_words, question_words):
+        if a != b:
+            limit = _max_typos(b)
+            if limit == 0 or _edit_distance(a, b, limit) > limit:
+                return False
+    return True
+
+
+def extract_answer(document) -> str:
+    """Ответ из Q&A чанка ("Категория: ...\\n\\nВопрос: ...\\n\\nОтвет: ...")"""
+    text = document.page_content
+    _, marker, answer = text.partition(_ANSWER_MARKER)
+    return answer.strip() if marker else text
+
+
+class FAQIndex:
+    """
+    Индекс вопросов Q&A чанков (metadata["question"])
+
+    Args:
+        documents: чанки корпуса (используются только Q&A пары)
+        fuzzy_threshold: минимальный Jaccard триграмм для кандидатов почти точного совпадения
+    """
+
+    def __init__(self, documents: list, fuzzy_threshold: float = 0.5):
+        self.documents = documents
+        self.fuzzy_threshold = fuzzy_threshold
+        self._exact = {}
+        self._entries = []  # (нормализованный вопрос, триграммы, Document)
+        self._postings = defaultdict(list)  # триграмма -> номера entries
+        for doc in documents:
+            question = doc.metadata.get("question")
+            if not question:
+                continue
+            normalized = normalize_question(question)
+            if not normalized:
+                continue
+            # Для дубликатов вопроса берем первую пару (как lexical_index в 05)
+            self._exact.setdefault(question_hash(normalized), doc)
+            grams = trigrams(normalized)
+            for gram in grams:
+                self._postings[gram].append(len(self._entries))
+            self._entries.append((normalized, grams, doc))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def lookup(self, question: str):
+        """
+        Поиск вопроса в FAQ
+
+        Returns:
+            tuple: (Document, "exact" | "fuzzy", сходство) или None
+        """
+        normalized = normalize_question(question)
+        if not normalized:
+            return None
+        doc = self._exact.get(question_hash(normalized))
+        if doc is not None:
+            return doc, "exact", 1.0
+
+        grams = trigrams(normalized)
+        shared = defaultdict(int)
+        for gram in grams:
+            for i in self._postings.get(gram, ()):
+                shared[i] += 1
+        candidates = []
+        for i, common in shared.items():
+            score = common / (len(grams) + len(self._entries[i][1]) - common)
+            if score >= self.fuzzy_threshold:
+                candidates.append((score, i))
+        for score, i in sorted(candidates, reverse=True):
+            entry_question, _, doc = self._entries[i]
+            if words_match(normalized, entry_question):
+                return doc, "fuzzy", score
+        return None
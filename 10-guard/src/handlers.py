@@ -1,5 +1,7 @@
 import logging
+import time
 from aiogram import Router
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.filters import Command
 from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
 from aiogram.enums import ParseMode
@@ -9,6 +11,10 @@ import indexer
 import rag
 import evaluation
 import agent
+import semantic_cache
+import history as agent_history
+from streaming import TelegramStreamer
+from scheduler import scheduler
 
 logger = logging.getLogger(__name__)
 router = Router()
@@ -53,11 +59,45 @@ def format_sources(documents):
     return "📚 Источники: " + ", ".join(parts)
 
 
+def format_reindex_report(report):
+    """
+    Краткий отчет об изменениях после переиндексации
+    
+    Args:
+        report: dict из indexer.reindex_all с ключами added/changed/removed/unchanged
+    """
+    def _names(items, limit=5):
+        shown = ", ".join(items[:limit])
+        if len(items) > limit:
+            shown += f" и еще {len(items) - limit}"
+        return shown
+    
+    lines = [
+        f"Режим: {'полная' if report['mode'] == 'full' else 'инкрементальная'}",
+        f"Векторизовано чанков: {report['embedded_chunks']} из {report['total_chunks']}",
+        f"Без изменений: {report['unchanged']}",
+    ]
+    if report.get("embedded_chunks"):
+        lines.append(
+            f"⚡ Скорость: {report['embed_rate']:.1f} чанков/с за {report['embed_seconds']:.1f} с"
+            + (f", 429 повторов: {report['rate_limited']}" if report.get("rate_limited") else "")
+        )
+    if report.get("cached_chunks"):
+        lines.append(f"♻️ Из кеша embeddings: {report['cached_chunks']} чанков")
+    if report["added"]:
+        lines.append(f"➕ Добавлено ({len(report['added'])}): {_names(report['added'])}")
+    if report["changed"]:
+        lines.append(f"✏️ Изменено ({len(report['changed'])}): {_names(report['changed'])}")
+    if report["removed"]:
+        lines.append(f"➖ Удалено ({len(report['removed'])}): {_names(report['removed'])}")
+    return "\n".join(lines)
+
+
 @router.message(Command("start"))
 async def cmd_start(message: Message):
     logger.info(f"User {message.chat.id} started the bot")
     
-    # История управляется агентом через MemorySaver (thread_id = chat_id)
+    # История управляется агентом через checkpointer (thread_id = chat_id)
     # Здесь только отправляем приветствие
     await message.answer(
         "Привет! Я ReAct Agent ассистент Сбербанка.\n\n"
@@ -87,7 +127,7 @@ async def cmd_help(message: Message):
         "*📋 Доступные команды:*\n"
         "/start \\- Начать новый диалог\n"
         "/help \\- Показать эту справку\n"
-        "/index \\- Переиндексировать документы\n"
+        "/index \\- Переиндексировать измененные документы \\(/index full \\- все\\)\n"
         "/index\\_status \\- Статус и конфигурация\n"
         "/evaluate\\_dataset \\- Оценить качество RAG\n\n"
         "*💬 Примеры вопросов:*\n\n"
@@ -117,19 +157,48 @@ async def cmd_help(message: Message):
 @router.message(Command("index"))
 async def cmd_index(message: Message):
     logger.info(f"User {message.chat.id} requested reindexing")
-    await message.answer("Начинаю переиндексацию документов...")
+    
+    # /index - инкрементальная переиндексация, /index full - полная
+    command_parts = message.text.split(maxsplit=1)
+    full = len(command_parts) > 1 and command_parts[1].strip().lower() == "full"
+    status_message = await message.answer(
+        "Начинаю полную переиндексацию документов..." if full
+        else "Начинаю переиндексацию измененных документов..."
+    )
+    
+    # Прогресс векторизации в том же сообщении (не чаще раза в INDEX_PROGRESS_INTERVAL секунд,
+    # чтобы не упираться в лимиты Bot API на редактирование)
+    last_edit = 0.0
+    
+    async def on_progress(progress):
+        nonlocal last_edit
+        now = time.monotonic()
+        if now - last_edit < config.INDEX_PROGRESS_INTERVAL:
+            return
+        last_edit = now
+        try:
+            await status_message.edit_text(
+                f"⏳ Векторизация: {progress['done']}/{progress['submitted']} чанков "
+                f"({progress['rate']:.1f} чанков/с, параллельно: {progress['concurrency_limit']})"
+            )
+        except TelegramBadRequest:
+            # message is not modified - текст не изменился с прошлого раза
+            pass
     
     try:
-        result = await indexer.reindex_all()
+        result = await indexer.reindex_all(full=full, progress=on_progress)
         if result and result[0] is not None:
-            rag.vector_store, rag.chunks = result
+            rag.vector_store, rag.chunks, rag.bm25_index, report = result
             rag.initialize_retriever()
+            # Документы изменились - сохраненные ответы и источники больше не актуальны
+            semantic_cache.invalidate_all()
             stats = rag.get_vector_store_stats()
             await message.answer(
                 f"✅ Переиндексация завершена!\n"
                 f"Проиндексировано документов: {stats['count']}\n"
                 f"Режим: {stats['retrieval_mode']}\n"
-                f"Провайдер: {stats['embedding_provider']}"
+                f"Провайдер: {stats['embedding_provider']}\n\n"
+                f"{format_reindex_report(report)}"
             )
         else:
             await message.answer("⚠️ Не найдено документов для индексации")
@@ -150,7 +219,10 @@ async def cmd_index_status(message: Message):
     status_text = (
         f"📊 *Статус индексации*\n"
             f"Статус: {stats['status']}\n"
-        f"Документов: {stats['count']}\n\n"
+        f"Документов: {stats['count']}\n"
+        f"Векторный индекс: {stats.get('vector_backend', 'N/A')}"
+        + (f" (recall@k {stats['ann_recall_at_k']:.3f})" if 'ann_recall_at_k' in stats else "")
+        + "\n\n"
         f"🔍 *Retrieval: {stats['retrieval_mode']}*\n"
     )
     
@@ -168,9 +240,98 @@ async def cmd_index_status(message: Message):
             f"• Semantic k: {stats.get('semantic_k', 'N/A')}\n"
             f"• BM25 k: {stats.get('bm25_k', 'N/A')}\n"
             f"• Reranker top k: {stats.get('reranker_top_k', 'N/A')}\n"
-            f"• Cross-encoder: {stats.get('cross_encoder_model', 'N/A').split('/')[-1]}\n"
+            f"• Cross-encoder: {stats.get('cross_encoder_model', 'N/A').split('/')[-1]} "
+            f"({stats.get('cross_encoder_backend', 'torch')})\n"
+        )
+        reranker_state = stats.get('reranker_state')
+        if reranker_state:
+            state_text = {
+                "ready": "готов",
+                "loading": "прогревается (запросы идут без reranking)",
+                "failed": "ошибка загрузки, повтор после паузы (запросы идут без reranking)",
+                "not_loaded": "загрузится при первом запросе",
+            }.get(reranker_state, reranker_state)
+            if reranker_state == "ready" and stats.get('reranker_warmup_seconds'):
+                state_text += f" (прогрев {stats['reranker_warmup_seconds']:.1f} с)"
+            status_text += f"• Reranker: {state_text}\n"
+        reranker_cache = stats.get('reranker_cache')
+        if reranker_cache:
+            status_text += (
+                f"• Кеш reranker: hit rate {reranker_cache['hit_rate']:.0%} "
+                f"({reranker_cache['hits']} пар), сэкономлено {reranker_cache['saved_ms'] / 1000:.1f} с\n"
+            )
+    timings = stats.get('hybrid_timings')
+    if timings:
+        status_text += (
+            f"• Последний запрос: semantic {timings['semantic']:.0f} мс, "
+            f"BM25 {timings['bm25']:.0f} мс (параллельно), всего {timings['total']:.0f} мс\n"
         )
     
+    faq_stats = stats.get('faq_fast_path')
+    if faq_stats:
+        status_text += (
+            f"• FAQ без LLM: {faq_stats['share']:.0%} вопросов "
+            f"({faq_stats['exact']} точных, {faq_stats['fuzzy']} с опечатками из {faq_stats['lookups']}), "
+            f"{faq_stats['questions']} вопросов в FAQ\n"
+        )
+    compression = stats.get('context_compression')
+    if compression:
+        status_text += (
+            f"• Сжатие контекста: {compression['ratio']:.0%} от исходного, "
+            f"сэкономлено {compression['tokens_saved']} токенов за {compression['calls']} вызовов rag_search\n"
+        )
+    semantic_stats = stats.get('semantic_cache')
+    if semantic_stats:
+        answers, search = semantic_stats['answers'], semantic_stats['search']
+        status_text += (
+            f"• Кеш ответов: hit rate {answers['hit_rate']:.0%} ({answers['hits']}/{answers['lookups']}), "
+            f"{answers['entries']} записей\n"
+            f"• Кеш rag_search: hit rate {search['hit_rate']:.0%} ({search['hits']}/{search['lookups']}), "
+            f"{search['entries']} записей\n"
+        )
+    
+    # Нагрузка: запросы в обработке и в очереди
+    load = scheduler.stats()
+    status_text += (
+        f"\n🚦 *Нагрузка*\n"
+        f"• В обработке: {load['in_flight']}/{load['max_in_flight']}, в очереди: {load['queued']} "
+        f"(максимум {load['max_queue_depth']})\n"
+        f"• Обработано: {load['completed']}, отклонено: {load['rejected']}, "
+        f"среднее ожидание {load['avg_wait_seconds']:.1f} с\n"
+    )
+
+    # История диалогов: чаты в памяти и в файле
+    history = agent.get_checkpointer_stats()
+    if history:
+        status_text += (
+            f"• История: {history['hot_threads']} чатов в памяти, {history['stored_threads']} в файле "
+            f"(загружено {history['loads']}, выгружено {history['evictions']}, "
+            f"удалено версий {history['pruned_checkpoints']})\n"
+        )
+    summary_stats = agent_history.get_stats()
+    if summary_stats:
+        status_text += (
+            f"• Сводки истории: {summary_stats['summaries']} "
+            f"({summary_stats['tokens_summarized']} → {summary_stats['summary_tokens']} токенов, "
+            f"в среднем {summary_stats['avg_summary_ms']:.0f} мс), "
+            f"удалено результатов поиска: {summary_stats['payloads_stripped']}, "
+            f"обрезок по лимиту: {summary_stats['hard_trims']}\n"
+        )
+
+    # MCP сервер: сессии и время вызовов инструментов
+    mcp_stats = agent.get_mcp_stats()
+    if mcp_stats:
+        status_text += (
+            f"\n🏦 *MCP: {mcp_stats['server']}*\n"
+            f"• Сессии: {mcp_stats['connected']}/{mcp_stats['size']} подключено, "
+            f"переподключений: {mcp_stats['reconnects']}, инструментов: {mcp_stats['tools']}\n"
+        )
+        for tool_name, calls in mcp_stats['calls'].items():
+            status_text += (
+                f"• {tool_name}: {calls['calls']} вызовов, {calls['avg_ms']:.0f} мс в среднем "
+                f"(макс {calls['max_ms']:.0f}), ошибок {calls['errors']}\n"
+            )
+
     # Информация об embeddings
     status_text += f"\n🧬 *Embeddings: {stats['embedding_provider']}*\n"
     if stats['embedding_provider'] == 'openai':
@@ -181,6 +342,14 @@ async def cmd_index_status(message: Message):
             f"• Устройство: {stats.get('device', 'N/A')}\n"
         )
     
+    cache_stats = stats.get('embedding_cache')
+    if cache_stats:
+        status_text += (
+            f"• Кеш: {cache_stats['entries']}/{cache_stats['max_entries']} записей, "
+            f"hit rate {cache_stats['hit_rate']:.0%} "
+            f"({cache_stats['hits']} hits / {cache_stats['misses']} misses)\n"
+        )
+    
     await message.answer(status_text, parse_mode=ParseMode.HTML)
 
 @router.message(Command("evaluate_dataset"))
@@ -295,18 +464,23 @@ async def handle_message(message: Message):
         
         # Получаем ответ через ReAct агента
         # ВАЖНО: Передаем только текущее сообщение, а не всю историю!
-        # История хранится в агенте (MemorySaver) и управляется через chat_id
+        # История хранится в агенте (checkpointer) и управляется через chat_id
         # Агент сам решает:
         # - Нужно ли использовать rag_search
         # - Сколько раз его вызвать
         # - Как сформировать ответ на основе контекста
+        # Потоковый режим: ответ появляется по мере генерации в одном сообщении
+        streamer = TelegramStreamer(message) if config.STREAMING_ENABLED else None
         result = await agent.agent_answer(
             [user_message],
-            message.chat.id
+            message.chat.id,
+            on_token=streamer.update if streamer else None
         )
         
         # Проверяем на interrupt (требуется подтверждение пользователя)
         if result.get("interrupt"):
+            if streamer:
+                await streamer.discard()
             interrupt_obj = result["interrupt"]
             
             # Сохраняем interrupt для последующей обработки
@@ -357,7 +531,10 @@ async def handle_message(message: Message):
             if sources:
                 final_response = f"{final_response}\n\n{sources}"
         
-        await message.answer(final_response)
+        if streamer:
+            await streamer.finish(final_response)
+        else:
+            await message.answer(final_response)
         
     except ValueError as e:
         logger.error(f"ValueError in handle_message for chat {message.chat.id}: {e}")
@@ -410,10 +587,12 @@ async def handle_hitl_callback(callback: CallbackQuery):
         processing_msg = await callback.message.answer("⏳ Обрабатываю решение...")
         
         # Резюмим агента
+        streamer = TelegramStreamer(callback.message) if config.STREAMING_ENABLED else None
         result = await agent.agent_resume(
             chat_id=chat_id,
             decision=decision,
-            message="Операция отклонена пользователем" if decision == "reject" else None
+            message="Операция отклонена пользователем" if decision == "reject" else None,
+            on_token=streamer.update if streamer else None
         )
         
         # Удаляем сообщение о обработке
@@ -427,7 +606,10 @@ async def handle_hitl_callback(callback: CallbackQuery):
             if sources:
                 final_response = f"{final_response}\n\n{sources}"
         
-        await callback.message.answer(final_response)
+        if streamer:
+            await streamer.finish(final_response)
+        else:
+            await callback.message.answer(final_response)
         
         await callback.answer()
         logger.info(f"✓ HITL {decision} processed for chat {chat_id}")
@@ -0,0 +1,170 @@
+"""
+Ограничение истории диалога агента: фоновая суммаризация старых ходов
+
+Каждый вопрос добавляет в историю агента новый ход (вопрос, вызовы инструментов, ответ),
+и вся история уходит в LLM на каждом шаге ReAct - промпт, задержка и стоимость растут
+с каждым сообщением.
+
+HistoryMiddleware перед запуском агента (before_agent):
+1. Заменяет результаты rag_search из прошлых ходов короткой заглушкой: найденные документы
+   уже использованы в ответе, который остается в истории
+2. Применяет готовую сводку: старые ходы заменяются одним сообщением со сводкой.
+   Непримененные сводки хранятся для последних _MAX_READY_SUMMARIES чатов (LRU)
+3. Если история больше HISTORY_TOKEN_BUDGET токенов - запускает суммаризацию всего,
+   кроме последних HISTORY_KEEP_TURNS ходов, в фоне. Текущий вопрос ее не ждет,
+   сводка применяется к следующему
+4. Если сводка не успела, а история больше HISTORY_MAX_TOKENS - старые ходы отбрасываются
+"""
+import asyncio
+import contextvars
+import logging
+import time
+import uuid
+from collections import OrderedDict
+
+from langchain.agents.middleware import AgentMiddleware
+from langchain_core.messages import RemoveMessage, SystemMessage, ToolMessage
+from langchain_core.messages.utils import count_tokens_approximately, get_buffer_string
+from langchain_openai import ChatOpenAI
+from langgraph.config import get_config
+from langgraph.graph.message import REMOVE_ALL_MESSAGES
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+# Сколько чатов с готовой, но еще не примененной сводкой хранится в памяти (LRU):
+# сводка применяется к следующему ходу, а чат может больше не написать
+_MAX_READY_SUMMARIES = 1000
+
+SUMMARY_PREFIX = "Краткое содержание предыдущего диалога:\n"
+STALE_SEARCH_STUB = "Результаты поиска использованы в ответе выше и удалены из истории."
+
+# Статистика (для /index_status)
+stats = {"summaries": 0, "failed": 0, "tokens_summarized": 0, "summary_tokens": 0,
+         "payloads_stripped": 0, "hard_trims": 0, "total_summary_ms": 0.0}
+
+
+def _is_summary(msg) -> bool:
+    return isinstance(msg, SystemMessage) and msg.content.startswith(SUMMARY_PREFIX)
+
+
+def _turn_starts(messages: list) -> list:
+    """Индексы начала ходов (сообщений пользователя)"""
+    return [i for i, msg in enumerate(messages) if msg.type == "human"]
+
+
+class HistoryMiddleware(AgentMiddleware):
+    """
+    Args:
+        token_budget: размер истории (токены), после которого запускается суммаризация
+        max_tokens: размер истории, после которого старые ходы отбрасываются без сводки
+        keep_turns: сколько последних ходов всегда остается дословно
+        model: модель для суммаризации
+    """
+
+    def __init__(self, token_budget: int, max_tokens: int, keep_turns: int, model: str):
+        super().__init__()
+        self.token_budget = token_budget
+        self.max_tokens = max(max_tokens, token_budget)
+        self.keep_turns = max(1, keep_turns)
+        self.llm = ChatOpenAI(model=model, temperature=0)
+        self.prompt = config.load_prompt(config.HISTORY_SUMMARY_PROMPT_FILE)
+        # thread_id -> (ids суммаризированных сообщений, SystemMessage со сводкой), LRU
+        self._ready = OrderedDict()
+        # thread_id -> фоновая задача суммаризации (ссылка нужна, чтобы задачу не собрал GC)
+        self._tasks = {}
+
+    async def abefore_agent(self, state, runtime):
+        thread_id = get_config()["configurable"]["thread_id"]
+        messages = list(state["messages"])
+        rebuild = False
+
+        # 1. Готовая сводка применяется, если суммаризированные сообщения все еще в начале истории
+        ready = self._ready.pop(thread_id, None)
+        if ready:
+            covered_ids, summary = ready
+            if [msg.id for msg in messages[:len(covered_ids)]] == covered_ids:
+                messages = [summary, *messages[len(covered_ids):]]
+                rebuild = True
+            else:
+                logger.info(f"History of chat {thread_id} changed, summary discarded")
+
+        # 2. Результаты rag_search прошлых ходов (текущий ход начинается с последнего вопроса)
+        starts = _turn_starts(messages)
+        current_turn = starts[-1] if starts else len(messages)
+        replaced = []
+        for i, msg in enumerate(messages[:current_turn]):
+            if isinstance(msg, ToolMessage) and msg.name == "rag_search" and msg.content != STALE_SEARCH_STUB:
+                messages[i] = ToolMessage(
+                    content=STALE_SEARCH_STUB, tool_call_id=msg.tool_call_id, name=msg.name, id=msg.id
+                )
+                replaced.append(messages[i])
+        stats["payloads_stripped"] += len(replaced)
+
+        # 3-4. Бюджет: все, кроме последних keep_turns ходов, - кандидаты на суммаризацию
+        tokens = count_tokens_approximately(messages)
+        cutoff = starts[-self.keep_turns] if len(starts) > self.keep_turns else 0
+        has_old_turns = any(msg.type == "human" for msg in messages[:cutoff])
+        if tokens > self.max_tokens and has_old_turns:
+            # Сводка не готова, а история уже слишком большая - отбрасываем старые ходы
+            summaries = [msg for msg in messages[:cutoff] if _is_summary(msg)]
+            messages = [*summaries, *messages[cutoff:]]
+            rebuild = True
+            stats["hard_trims"] += 1
+            logger.warning(f"History of chat {thread_id} exceeded {self.max_tokens} tokens, old turns dropped")
+        elif tokens > self.token_budget and has_old_turns and thread_id not in self._tasks:
+            self._schedule(thread_id, messages[:cutoff])
+
+        if rebuild:
+            return {"messages": [RemoveMessage(id=REMOVE_ALL_MESSAGES), *messages]}
+        if replaced:
+            # Сообщения с теми же id заменяются reducer'ом add_messages
+            return {"messages": replaced}
+        return None
+
+    def _schedule(self, thread_id: str, messages: list):
+        # Пустой контекст: вызов LLM не попадает в stream и callbacks текущего запроса агента
+        task = asyncio.create_task(self._summarize(thread_id, messages), context=contextvars.Context())
+        self._tasks[thread_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(thread_id, None))
+
+    async def _summarize(self, thread_id: str, messages: list):
+        """Сводка старых ходов (предыдущая сводка входит в них и дополняется)"""
+        start_time = time.perf_counter()
+        try:
+            response = await self.llm.ainvoke([
+                SystemMessage(content=self.prompt),
+                ("user", get_buffer_string(messages, human_prefix="Клиент", ai_prefix="Ассистент")),
+            ])
+            summary = SystemMessage(content=SUMMARY_PREFIX + response.content, id=f"summary-{uuid.uuid4()}")
+        except Exception as e:
+            stats["failed"] += 1
+            logger.error(f"History summarization failed for chat {thread_id}: {e}")
+            return
+        elapsed_ms = (time.perf_counter() - start_time) * 1000
+        tokens_before = count_tokens_approximately(messages)
+        tokens_after = count_tokens_approximately([summary])
+        self._ready[thread_id] = ([msg.id for msg in messages], summary)
+        self._ready.move_to_end(thread_id)
+        while len(self._ready) > _MAX_READY_SUMMARIES:
+            evicted, _ = self._ready.popitem(last=False)
+            logger.info(f"History summary of chat {evicted} evicted before it was applied")
+        stats["summaries"] += 1
+        stats["tokens_summarized"] += tokens_before
+        stats["summary_tokens"] += tokens_after
+        stats["total_summary_ms"] += elapsed_ms
+        logger.info(
+            f"History of chat {thread_id} summarized: {len(messages)} messages, "
+            f"{tokens_before} -> {tokens_after} tokens in {elapsed_ms:.0f} ms"
+        )
+
+
+def get_stats():
+    """Статистика суммаризации истории (None если выключена)"""
+    if not config.HISTORY_SUMMARY_ENABLED:
+        return None
+    return {
+        **stats,
+        "avg_summary_ms": stats["total_summary_ms"] / stats["summaries"] if stats["summaries"] else 0.0,
+    }
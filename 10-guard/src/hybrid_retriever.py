@@ -0,0 +1,126 @@
+"""
+Гибридный retriever: semantic + BM25 параллельно, слияние weighted RRF
+
+Замена EnsembleRetriever из langchain_classic: тот вызывает retrievers по очереди,
+поэтому латентность = векторизация запроса + поиск + BM25.
+Здесь ветки идут одновременно:
+- async (ainvoke): векторизация запроса через aembed_query, BM25 - в пуле executor
+- sync (invoke): semantic ветка в пуле executor, BM25 - в текущем потоке
+
+executor - общий ограниченный пул CPU части retrieval (rag.retrieval_executor), тот же,
+что у reranking: всплеск запросов не создает отдельных потоков под каждую ветку.
+
+Результаты сливаются weighted Reciprocal Rank Fusion (как в EnsembleRetriever):
+score(d) = sum(weight_i / (c + rank_i(d))), веса - ENSEMBLE_SEMANTIC_WEIGHT и ENSEMBLE_BM25_WEIGHT.
+Время каждой ветки пишется в лог и доступно в last_timings.
+"""
+import asyncio
+import logging
+import time
+from typing import Any
+
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from pydantic import Field
+
+logger = logging.getLogger(__name__)
+
+
+def weighted_rrf(result_lists: list, weights: list, c: int = 60) -> list:
+    """
+    Weighted Reciprocal Rank Fusion
+
+    Документы с одинаковым текстом считаются одним (как в EnsembleRetriever):
+    в Q&A корпусе много одинаковых ответов, дубли в контексте LLM не нужны.
+
+    Args:
+        result_lists: списки Document от каждого retriever (по убыванию релевантности)
+        weights: вес каждого списка
+        c: константа RRF, сглаживает разницу между верхними позициями
+
+    Returns:
+        list[Document] по убыванию fused score
+    """
+    scores = {}
+    documents = {}
+    for docs, weight in zip(result_lists, weights):
+        for rank, doc in enumerate(docs, start=1):
+            key = doc.page_content
+            scores[key] = scores.get(key, 0.0) + weight / (c + rank)
+            documents.setdefault(key, doc)
+    ranked = sorted(scores, key=scores.get, reverse=True)
+    return [documents[key] for key in ranked]
+
+
+class HybridRetriever(BaseRetriever):
+    """Semantic (vector store) + BM25 (BM25Index) с параллельным выполнением веток"""
+
+    vector_store: Any
+    bm25_index: Any
+    semantic_k: int = 10
+    bm25_k: int = 10
+    semantic_weight: float = 0.5
+    bm25_weight: float = 0.5
+    c: int = 60
+    # Пул потоков для веток (rag.retrieval_executor); None - sync ветки идут по очереди,
+    # async BM25 - в пуле event loop по умолчанию. Синхронный invoke нельзя вызывать
+    # из потоков самого executor: ожидание вложенной задачи может занять все потоки пула
+    executor: Any = None
+    # Время веток последнего запроса в мс: {"semantic", "bm25", "fusion", "total"}
+    last_timings: dict = Field(default_factory=dict)
+
+    def _bm25_leg(self, query: str):
+        started = time.perf_counter()
+        docs = [
+            Document(id=doc.id, page_content=doc.page_content, metadata=dict(doc.metadata))
+            for doc, _ in self.bm25_index.search(query, self.bm25_k)
+        ]
+        return docs, (time.perf_counter() - started) * 1000
+
+    def _semantic_leg(self, query: str):
+        started = time.perf_counter()
+        docs = self.vector_store.similarity_search(query, k=self.semantic_k)
+        return docs, (time.perf_counter() - started) * 1000
+
+    async def _asemantic_leg(self, query: str):
+        started = time.perf_counter()
+        docs = await self.vector_store.asimilarity_search(query, k=self.semantic_k)
+        return docs, (time.perf_counter() - started) * 1000
+
+    def _fuse(self, query: str, semantic: tuple, bm25: tuple, started: float) -> list:
+        (semantic_docs, semantic_ms), (bm25_docs, bm25_ms) = semantic, bm25
+        fusion_started = time.perf_counter()
+        fused = weighted_rrf(
+            [semantic_docs, bm25_docs], [self.semantic_weight, self.bm25_weight], c=self.c
+        )
+        finished = time.perf_counter()
+        self.last_timings = {
+            "semantic": semantic_ms,
+            "bm25": bm25_ms,
+            "fusion": (finished - fusion_started) * 1000,
+            "total": (finished - started) * 1000,
+        }
+        logger.info(
+            f"Hybrid retrieval: semantic {semantic_ms:.1f} ms ({len(semantic_docs)} docs), "
+            f"bm25 {bm25_ms:.1f} ms ({len(bm25_docs)} docs), total {self.last_timings['total']:.1f} ms"
+        )
+        return fused
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> list:
+        started = time.perf_counter()
+        if self.executor is None:
+            return self._fuse(query, self._semantic_leg(query), self._bm25_leg(query), started)
+        semantic_future = self.executor.submit(self._semantic_leg, query)
+        bm25 = self._bm25_leg(query)
+        return self._fuse(query, semantic_future.result(), bm25, started)
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> list:
+        started = time.perf_counter()
+        semantic, bm25 = await asyncio.gather(
+            self._asemantic_leg(query),
+            asyncio.get_running_loop().run_in_executor(self.executor, self._bm25_leg, query),
+        )
+        return self._fuse(query, semantic, bm25, started)
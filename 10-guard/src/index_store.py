@@ -0,0 +1,189 @@
+"""
+Персистентный векторный индекс на диске
+
+Позволяет не пересчитывать embeddings при каждом старте бота:
+индекс сохраняется после переиндексации и загружается за миллисекунды,
+пока не изменились исходные документы, модель embeddings или параметры сплиттера.
+
+Формат директории индекса (INDEX_DIR/<index_key>/):
+- embeddings.npy - матрица float32 [n_chunks, dim] с нормализованными строками,
+  открывается через memory-map (без чтения всего файла в память)
+- chunks.jsonl   - id, текст и метаданные чанков (строка i = строка i матрицы)
+- manifest.json  - модель embeddings, параметры сплиттера, хэши исходных файлов
+- bm25.npz, bm25.json - инвертированный индекс BM25 (см. sparse_index.py)
+- ann_hnsw.bin / ann_faiss.index, ann.json - граф ANN поиска (VECTOR_BACKEND=hnsw/faiss,
+  см. vector_stores.py)
+"""
+import hashlib
+import json
+import logging
+import shutil
+import time
+from pathlib import Path
+
+import numpy as np
+from langchain_core.documents import Document
+
+logger = logging.getLogger(__name__)
+
+INDEX_FORMAT_VERSION = 2
+
+EMBEDDINGS_FILE = "embeddings.npy"
+CHUNKS_FILE = "chunks.jsonl"
+MANIFEST_FILE = "manifest.json"
+
+
+def file_sha256(path: Path) -> str:
+    """SHA-256 содержимого файла (читаем блоками, чтобы не грузить большие PDF целиком)"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def text_sha256(text: str) -> str:
+    """SHA-256 строки в UTF-8"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def compute_index_key(embedding_id: str, chunk_size: int, chunk_overlap: int) -> str:
+    """
+    Ключ индекса: от него зависит имя директории
+
+    Смена модели embeddings или параметров сплиттера дает новый ключ,
+    поэтому индексы разных конфигураций не перезаписывают друг друга.
+    """
+    raw = f"v{INDEX_FORMAT_VERSION}|{embedding_id}|{chunk_size}|{chunk_overlap}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def fingerprint_sources(files: list) -> dict:
+    """Хэши исходных файлов: {имя файла: sha256}"""
+    return {Path(f).name: file_sha256(Path(f)) for f in sorted(files, key=lambda p: Path(p).name)}
+
+
+def normalize_rows(vectors) -> np.ndarray:
+    """
+    Приводит матрицу к float32 и нормализует строки
+
+    Косинусная близость нормализованных векторов = скалярное произведение,
+    поэтому храним векторы сразу нормализованными.
+    """
+    matrix = np.asarray(vectors, dtype=np.float32)
+    if matrix.ndim != 2:
+        matrix = matrix.reshape(len(matrix), -1)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def save_index(index_path: Path, chunks: list, vectors, manifest: dict, sparse=None, ann=None):
+    """
+    Атомарное сохранение индекса
+
+    Пишем во временную директорию и подменяем старый индекс только после
+    успешной записи всех файлов - упавшая переиндексация не портит рабочий индекс.
+
+    Args:
+        index_path: директория индекса (INDEX_DIR/<index_key>)
+        chunks: список Document (у каждого заполнен id)
+        vectors: матрица embeddings в порядке chunks
+        manifest: метаданные индекса (модель, сплиттер, хэши источников)
+        sparse: BM25Index для тех же chunks (сохраняется в ту же директорию)
+        ann: ANNVectorStore для тех же chunks (сохраняется граф поиска)
+    """
+    index_path = Path(index_path)
+    matrix = normalize_rows(vectors)
+    if len(matrix) != len(chunks):
+        raise ValueError(f"Vectors/chunks mismatch: {len(matrix)} != {len(chunks)}")
+
+    tmp_path = index_path.with_name(index_path.name + ".tmp")
+    old_path = index_path.with_name(index_path.name + ".old")
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    tmp_path.mkdir(parents=True)
+
+    np.save(tmp_path / EMBEDDINGS_FILE, matrix)
+
+    with open(tmp_path / CHUNKS_FILE, "w", encoding="utf-8") as f:
+        for chunk in chunks:
+            record = {"id": chunk.id, "text": chunk.page_content, "metadata": chunk.metadata}
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    manifest = {
+        **manifest,
+        "format_version": INDEX_FORMAT_VERSION,
+        "count": len(chunks),
+        "dim": int(matrix.shape[1]) if len(matrix) else 0,
+        "created_at": time.time(),
+    }
+    if sparse is not None:
+        sparse.save(tmp_path)
+    if ann is not None:
+        ann.save(tmp_path)
+    (tmp_path / MANIFEST_FILE).write_text(
+        json.dumps(manifest, ensure_ascii=False, indent=2), encoding="utf-8"
+    )
+
+    # Подмена директорий: rename атомарен, старый индекс удаляем в последнюю очередь
+    shutil.rmtree(old_path, ignore_errors=True)
+    if index_path.exists():
+        index_path.rename(old_path)
+    tmp_path.rename(index_path)
+    shutil.rmtree(old_path, ignore_errors=True)
+
+    logger.info(f"Index saved to {index_path}: {len(chunks)} chunks, dim={manifest['dim']}")
+
+
+def load_manifest(index_path: Path):
+    """Чтение manifest.json (None если индекса нет или он поврежден)"""
+    manifest_path = Path(index_path) / MANIFEST_FILE
+    if not manifest_path.exists():
+        return None
+    try:
+        manifest = json.loads(manifest_path.read_text(encoding="utf-8"))
+    except (OSError, json.JSONDecodeError) as e:
+        logger.warning(f"Failed to read index manifest {manifest_path}: {e}")
+        return None
+    if manifest.get("format_version") != INDEX_FORMAT_VERSION:
+        logger.info(f"Index format changed ({manifest.get('format_version')} -> {INDEX_FORMAT_VERSION}), ignoring {index_path}")
+        return None
+    return manifest
+
+
+def load_index(index_path: Path):
+    """
+    Загрузка индекса с диска
+
+    Матрица embeddings открывается через np.load(mmap_mode='r'):
+    страницы файла подгружаются ОС по мере обращения, старт не зависит от размера корпуса.
+
+    Returns:
+        tuple: (chunks, vectors, manifest) или None если индекса нет
+    """
+    index_path = Path(index_path)
+    manifest = load_manifest(index_path)
+    if manifest is None:
+        return None
+
+    try:
+        vectors = np.load(index_path / EMBEDDINGS_FILE, mmap_mode="r")
+        chunks = []
+        with open(index_path / CHUNKS_FILE, encoding="utf-8") as f:
+            for line in f:
+                record = json.loads(line)
+                chunks.append(Document(
+                    id=record["id"],
+                    page_content=record["text"],
+                    metadata=record["metadata"]
+                ))
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning(f"Failed to load index from {index_path}: {e}")
+        return None
+
+    if len(chunks) != len(vectors):
+        logger.warning(f"Corrupted index {index_path}: {len(chunks)} chunks vs {len(vectors)} vectors")
+        return None
+
+    logger.info(f"Index loaded from {index_path}: {len(chunks)} chunks")
+    return chunks, vectors, manifest
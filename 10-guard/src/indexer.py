@@ -1,5 +1,12 @@
+import os
+import asyncio
 import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from pathlib import Path
+import numpy as np
 from langchain_community.document_loaders import PyPDFLoader, JSONLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_openai import OpenAIEmbeddings
@@ -7,37 +14,70 @@ from langchain_ollama import OllamaEmbeddings
 from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_community.vectorstores import InMemoryVectorStore
 from config import config
+import embedding_cache
+import index_store
+from sparse_index import BM25Index
+from embedding_scheduler import EmbeddingScheduler
+from vector_stores import ANNVectorStore, NumpyVectorStore
 
 logger = logging.getLogger(__name__)
 
-def load_pdf_documents(data_dir: str) -> list:
-    """Загрузка всех PDF документов из директории"""
-    pages = []
-    data_path = Path(data_dir)
+def get_index_workers(n_files: int) -> int:
+    """Число процессов для разбора PDF (INDEX_WORKERS, 0 = по числу ядер)"""
+    workers = config.INDEX_WORKERS or os.cpu_count() or 1
+    return max(1, min(workers, n_files))
+
+def load_and_split_pdf(pdf_file: str, chunk_size: int, chunk_overlap: int) -> list:
+    """
+    Загрузка и разбиение одного PDF на чанки
     
-    if not data_path.exists():
-        logger.warning(f"Directory {data_dir} does not exist")
-        return pages
+    Выполняется в процессе-воркере: функция на уровне модуля и получает
+    параметры сплиттера явно, чтобы ее можно было передать в ProcessPoolExecutor.
+    Страницы живут только внутри воркера - в основной процесс приходят чанки.
+    """
+    pages = PyPDFLoader(pdf_file).load()
+    if not pages:
+        return []
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap
+    )
+    return text_splitter.split_documents(pages)
+
+def iter_pdf_chunks(pdf_files: list):
+    """
+    Параллельный разбор и разбиение PDF пулом процессов (INDEX_WORKERS)
+    
+    Генератор отдает чанки файла сразу, как только он готов (и все файлы перед ним),
+    поэтому векторизация первых файлов идет параллельно с разбором следующих.
+    Порядок выдачи всегда совпадает с порядком pdf_files.
     
-    pdf_files = list(data_path.glob("*.pdf"))
-    logger.info(f"Found {len(pdf_files)} PDF files in {data_dir}")
+    Yields:
+        tuple: (pdf_file, chunks)
+    """
+    if not pdf_files:
+        return
     
-    for pdf_file in pdf_files:
-        loader = PyPDFLoader(str(pdf_file))
-        pages.extend(loader.load())
-        logger.info(f"Loaded {pdf_file.name}")
+    workers = get_index_workers(len(pdf_files))
+    paths = [str(pdf_file) for pdf_file in pdf_files]
     
-    return pages
-
-def split_documents(pages: list) -> list:
-    """Разбиение документов на чанки"""
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=500,
-        chunk_overlap=50
-    )
-    chunks = text_splitter.split_documents(pages)
-    logger.info(f"Split into {len(chunks)} chunks")
-    return chunks
+    if workers <= 1:
+        for pdf_file, path in zip(pdf_files, paths):
+            chunks = load_and_split_pdf(path, config.CHUNK_SIZE, config.CHUNK_OVERLAP)
+            logger.info(f"Loaded {Path(path).name}: {len(chunks)} chunks")
+            yield pdf_file, chunks
+        return
+    
+    logger.info(f"Parsing {len(paths)} PDF files with {workers} worker processes")
+    # spawn: воркеры не наследуют потоки и состояние бота (fork из процесса с потоками
+    # может зависнуть на блокировке, захваченной в момент fork)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        results = executor.map(
+            load_and_split_pdf, paths, repeat(config.CHUNK_SIZE), repeat(config.CHUNK_OVERLAP)
+        )
+        for pdf_file, path, chunks in zip(pdf_files, paths, results):
+            logger.info(f"Loaded {Path(path).name}: {len(chunks)} chunks")
+            yield pdf_file, chunks
 
 def load_json_documents(json_file_path: str) -> list:
     """Загрузка Q&A пар из JSON, каждая пара - отдельный чанк"""
@@ -47,10 +87,16 @@ def load_json_documents(json_file_path: str) -> list:
         return []
     
     try:
+        # url сохраняем в метаданных - это стабильный идентификатор Q&A пары
+        # для инкрементальной переиндексации, question - для отчетов
         loader = JSONLoader(
             file_path=str(json_path),
-            jq_schema='.[].full_text',
-            text_content=False
+            jq_schema='.[]',
+            content_key='full_text',
+            text_content=False,
+            metadata_func=lambda record, metadata: {
+                **metadata, "url": record.get("url"), "question": record.get("question")
+            }
         )
         documents = loader.load()
         logger.info(f"Loaded {len(documents)} Q&A pairs from JSON")
@@ -63,19 +109,22 @@ def create_embeddings():
     """
     Фабрика для создания embeddings по провайдеру из конфига
     Поддерживает: openai, huggingface
+    
+    Результат обернут кешем embeddings (EMBEDDING_CACHE_ENABLED):
+    повторно встречающиеся тексты не отправляются провайдеру
     """
     provider = config.EMBEDDING_PROVIDER.lower()
     
     if provider == "openai":
         logger.info(f"Creating OpenAI embeddings: {config.EMBEDDING_MODEL}")
-        return OpenAIEmbeddings(model=config.EMBEDDING_MODEL)
+        embeddings = OpenAIEmbeddings(model=config.EMBEDDING_MODEL)
     elif provider == "ollama":
         logger.info(f"Creating RAGAS ollama embeddings: {config.RAGAS_EMBEDDING_MODEL}")
-        return OllamaEmbeddings(model=config.RAGAS_EMBEDDING_MODEL)
+        embeddings = OllamaEmbeddings(model=config.RAGAS_EMBEDDING_MODEL)
 
     elif provider == "huggingface":
         logger.info(f"Creating HuggingFace embeddings: {config.HUGGINGFACE_EMBEDDING_MODEL} on {config.HUGGINGFACE_DEVICE}")
-        return HuggingFaceEmbeddings(
+        embeddings = HuggingFaceEmbeddings(
             model_name=config.HUGGINGFACE_EMBEDDING_MODEL,
             model_kwargs={'device': config.HUGGINGFACE_DEVICE},
             encode_kwargs={'normalize_embeddings': True}
@@ -83,55 +132,397 @@ def create_embeddings():
     
     else:
         raise ValueError(f"Unknown embedding provider: {provider}. Use 'openai' or 'huggingface'")
+    
+    return embedding_cache.wrap_embeddings(embeddings, get_embedding_id())
 
-def create_vector_store(chunks: list):
-    """Создание векторного хранилища"""
-    embeddings = create_embeddings()
-    vector_store = InMemoryVectorStore.from_documents(
-        documents=chunks,
-        embedding=embeddings
-    )
-    logger.info(f"Created vector store with {len(chunks)} chunks")
+def get_embedding_id() -> str:
+    """Идентификатор модели embeddings (провайдер + модель) для ключа индекса"""
+    provider = config.EMBEDDING_PROVIDER.lower()
+    if provider == "openai":
+        return f"openai:{config.EMBEDDING_MODEL}"
+    elif provider == "ollama":
+        return f"ollama:{config.RAGAS_EMBEDDING_MODEL}"
+    elif provider == "huggingface":
+        return f"huggingface:{config.HUGGINGFACE_EMBEDDING_MODEL}"
+    return provider
+
+def get_index_path() -> Path:
+    """Директория индекса для текущей модели embeddings и параметров сплиттера"""
+    key = index_store.compute_index_key(get_embedding_id(), config.CHUNK_SIZE, config.CHUNK_OVERLAP)
+    return Path(config.INDEX_DIR) / key
+
+def get_source_files() -> list:
+    """Исходные файлы индекса: все PDF + JSON с Q&A парами"""
+    data_path = Path(config.DATA_DIR)
+    if not data_path.exists():
+        return []
+    files = sorted(data_path.glob("*.pdf"))
+    json_file = data_path / "sberbank_help_documents.json"
+    if json_file.exists():
+        files.append(json_file)
+    return files
+
+def assign_chunk_ids(chunks: list, namespace: str = ""):
+    """
+    Стабильные id чанков: хэш единицы индексации, источника, страницы и текста
+    
+    Одинаковые документы получают одинаковые id при каждой переиндексации,
+    поэтому id можно использовать как ключ кешей и ссылок на чанк.
+    namespace (id единицы индексации) различает одинаковые тексты
+    из разных Q&A пар - в JSON много повторяющихся ответов.
+    """
+    seen = {}
+    for chunk in chunks:
+        base_id = index_store.text_sha256(
+            f"{namespace}|{chunk.metadata.get('source', '')}|{chunk.metadata.get('page', '')}|{chunk.page_content}"
+        )[:24]
+        # Повторяющийся текст на той же странице - добавляем порядковый номер
+        n = seen.get(base_id, 0)
+        seen[base_id] = n + 1
+        chunk.id = base_id if n == 0 else f"{base_id}-{n}"
+    return chunks
+
+def vector_store_from_embeddings(chunks: list, vectors, embeddings=None, index_path: Path = None):
+    """
+    Создание векторного хранилища из готовых embeddings (без обращения к модели)
+    
+    Тип хранилища определяется VECTOR_BACKEND:
+    - numpy       - NumpyVectorStore (точный поиск матричным произведением, по умолчанию)
+    - memory      - InMemoryVectorStore (точный поиск, близость считается в цикле Python)
+    - hnsw/faiss  - приближенный поиск (ANNVectorStore): граф загружается из index_path,
+                    а если его там нет - строится, для него считается recall@k
+    
+    Args:
+        chunks: список Document с заполненными id
+        vectors: матрица embeddings в порядке chunks
+        embeddings: объект embeddings для векторизации запросов
+        index_path: директория сохраненного индекса (при загрузке на старте)
+    """
+    if embeddings is None:
+        embeddings = create_embeddings()
+    
+    backend = config.VECTOR_BACKEND.lower()
+    if backend == "numpy":
+        # Векторы из индекса уже нормализованы - mmap матрица используется без копии
+        return NumpyVectorStore(embeddings, chunks, vectors, normalized=True)
+    if backend in ("hnsw", "faiss"):
+        if index_path is not None:
+            vector_store = ANNVectorStore.load(index_path, embeddings, chunks, vectors, backend)
+            if vector_store is not None:
+                return vector_store
+        vector_store = ANNVectorStore(embeddings, chunks, vectors, backend=backend, normalized=True)
+        vector_store.measure_recall()
+        if index_path is not None:
+            try:
+                vector_store.save(index_path)
+            except OSError as e:
+                logger.warning(f"Failed to persist ANN index: {e}")
+        return vector_store
+    
+    vector_store = InMemoryVectorStore(embedding=embeddings)
+    for chunk, vector in zip(chunks, vectors):
+        vector_store.store[chunk.id] = {
+            "id": chunk.id,
+            "vector": vector.tolist(),
+            "text": chunk.page_content,
+            "metadata": chunk.metadata,
+        }
     return vector_store
 
-async def reindex_all():
-    """Полная переиндексация всех документов (PDF + JSON)
+def load_or_build_sparse_index(index_path: Path, chunks: list):
+    """BM25 индекс из директории индекса или построение заново (например, после смены формата)"""
+    sparse = BM25Index.load(index_path, chunks)
+    if sparse is None:
+        sparse = BM25Index.build(chunks)
+        try:
+            sparse.save(index_path)
+        except OSError as e:
+            logger.warning(f"Failed to persist BM25 index: {e}")
+    return sparse
+
+def _build_manifest(source_files: list) -> dict:
+    """Метаданные индекса, по которым определяется его актуальность"""
+    return {
+        "embedding_id": get_embedding_id(),
+        "chunk_size": config.CHUNK_SIZE,
+        "chunk_overlap": config.CHUNK_OVERLAP,
+        "sources": index_store.fingerprint_sources(source_files),
+    }
+
+def collect_source_units(source_files: list) -> list:
+    """
+    Разбиение корпуса на единицы инкрементальной индексации
+    
+    - каждый PDF файл - одна единица, хэш = sha256 файла
+    - каждая Q&A пара из JSON - отдельная единица, хэш = sha256 текста пары
+    
+    Порядок единиц детерминирован (PDF по имени, затем Q&A в порядке файла),
+    поэтому порядок чанков в индексе не зависит от того, какие единицы изменились.
+    
+    Returns:
+        list[dict]: {"id", "hash", "label", "path" (PDF) или "document" (Q&A)}
+    """
+    units = []
+    for path in source_files:
+        path = Path(path)
+        if path.suffix.lower() == ".pdf":
+            units.append({
+                "id": f"pdf:{path.name}",
+                "hash": index_store.file_sha256(path),
+                "label": path.name,
+                "path": path,
+            })
+    
+    json_file = Path(config.DATA_DIR) / "sberbank_help_documents.json"
+    seen = {}
+    for doc in load_json_documents(str(json_file)):
+        key = doc.metadata.get("url") or index_store.text_sha256(doc.page_content)[:24]
+        # Дубликаты url в JSON - различаем порядковым номером
+        n = seen.get(key, 0)
+        seen[key] = n + 1
+        units.append({
+            "id": f"json:{key}" if n == 0 else f"json:{key}#{n}",
+            "hash": index_store.text_sha256(doc.page_content),
+            "label": (doc.metadata.get("question") or doc.page_content)[:60],
+            "document": doc,
+        })
+    return units
+
+def iter_unit_chunks(units: list):
+    """
+    Чанки единиц индексации в порядке units
+    
+    PDF разбираются параллельно (iter_pdf_chunks), Q&A пара - один готовый чанк.
+    
+    Yields:
+        tuple: (unit, chunks) с заполненными id чанков
+    """
+    pdf_chunks = iter_pdf_chunks([unit["path"] for unit in units if "path" in unit])
+    for unit in units:
+        if "path" in unit:
+            _, chunks = next(pdf_chunks)
+        else:
+            chunks = [unit["document"]]
+        yield unit, assign_chunk_ids(chunks, unit["id"])
+
+def _empty_report(mode: str) -> dict:
+    return {
+        "mode": mode,
+        "added": [],
+        "changed": [],
+        "removed": [],
+        "unchanged": 0,
+        "embedded_chunks": 0,
+        "cached_chunks": 0,
+        "total_chunks": 0,
+        "embed_seconds": 0.0,
+        "embed_rate": 0.0,
+        "rate_limited": 0,
+    }
+
+async def load_or_reindex():
+    """Загрузка сохраненного индекса или переиндексация если входные данные изменились
+    
+    Индекс считается актуальным, если совпадают модель embeddings, параметры
+    сплиттера (через ключ директории) и хэши всех исходных файлов.
+    Если что-то изменилось - выполняется инкрементальная переиндексация.
+    
+    Returns:
+        tuple: (vector_store, chunks, bm25_index, report) для инициализации retriever
+    """
+    index_path = get_index_path()
+    started = time.perf_counter()
+    
+    try:
+        manifest = index_store.load_manifest(index_path)
+        if manifest is not None:
+            expected = _build_manifest(get_source_files())
+            if manifest.get("sources") == expected["sources"]:
+                loaded = index_store.load_index(index_path)
+                if loaded is not None:
+                    chunks, vectors, _ = loaded
+                    vector_store = vector_store_from_embeddings(chunks, vectors, index_path=index_path)
+                    sparse = load_or_build_sparse_index(index_path, chunks)
+                    elapsed_ms = (time.perf_counter() - started) * 1000
+                    logger.info(f"Loaded persisted index ({len(chunks)} chunks) in {elapsed_ms:.0f} ms")
+                    report = _empty_report("loaded")
+                    report["unchanged"] = len(manifest.get("units", {}))
+                    report["total_chunks"] = len(chunks)
+                    return vector_store, chunks, sparse, report
+            logger.info("Source documents changed since last indexing, updating index...")
+        else:
+            logger.info(f"No persisted index at {index_path}, building...")
+    except Exception as e:
+        logger.warning(f"Failed to load persisted index, rebuilding: {e}", exc_info=True)
+    
+    return await reindex_all()
+
+async def reindex_all(full: bool = False, progress=None):
+    """Переиндексация всех документов (PDF + JSON)
+    
+    По умолчанию инкрементальная: по хэшам PDF файлов и Q&A пар определяются
+    новые, измененные и удаленные единицы. Embeddings считаются только для чанков
+    новых/измененных единиц, для остальных переиспользуются строки сохраненного индекса.
+    Удаленные единицы не попадают в новый индекс (и, как следствие, в корпус BM25).
+    
+    Args:
+        full: True - игнорировать сохраненный индекс и пересчитать все embeddings
+        progress: async callback(stats) с прогрессом векторизации (см. EmbeddingScheduler.stats)
     
     Returns:
-        tuple: (vector_store, chunks) для инициализации retriever
+        tuple: (vector_store, chunks, bm25_index, report) для инициализации retriever,
+            report - что изменилось (added/changed/removed/unchanged, сколько чанков векторизовано)
     """
-    logger.info("Starting full reindexing...")
+    mode = "full" if full else "incremental"
+    report = _empty_report(mode)
+    logger.info(f"Starting {mode} reindexing...")
     
     try:
-        # Загрузка PDF документов
-        pages = load_pdf_documents(config.DATA_DIR)
-        pdf_chunks = split_documents(pages) if pages else []
-        logger.info(f"PDF: {len(pdf_chunks)} chunks")
+        # Хэши источников считаем до чтения файлов: если файл поменяется
+        # во время индексации, при следующем старте индекс пересоберется
+        source_files = get_source_files()
+        manifest = _build_manifest(source_files)
+        units = collect_source_units(source_files)
+        
+        if not units:
+            logger.warning("No documents found to index")
+            return None, [], None, report
+        
+        # Предыдущий индекс для переиспользования embeddings
+        index_path = get_index_path()
+        previous = None if full else index_store.load_index(index_path)
+        had_index = previous is not None
+        if had_index:
+            old_chunks, old_vectors, old_manifest = previous
+            # Копируем матрицу из mmap в память: директория индекса будет перезаписана
+            old_vectors = np.array(old_vectors, dtype=np.float32)
+            # Старый BM25 индекс - источник уже проанализированных текстов чанков
+            old_sparse = BM25Index.load(index_path, old_chunks)
+            old_units = old_manifest.get("units", {})
+            previous = None
+        else:
+            old_chunks, old_vectors, old_units, old_sparse = [], None, {}, None
         
-        # Загрузка JSON Q&A пар
-        json_file = Path(config.DATA_DIR) / "sberbank_help_documents.json"
-        json_documents = load_json_documents(str(json_file))
-        logger.info(f"JSON: {len(json_documents)} Q&A pairs")
+        # Неизмененные единицы берем из старого индекса, остальные загружаем заново
+        embeddings = create_embeddings()
+        new_units = {}
+        changed_units = []
+        for unit in units:
+            old = old_units.get(unit["id"])
+            new_units[unit["id"]] = {"hash": unit["hash"], "label": unit["label"]}
+            if old is not None and old["hash"] == unit["hash"]:
+                report["unchanged"] += 1
+            else:
+                changed_units.append(unit)
+                report["changed" if old is not None else "added"].append(unit["label"])
         
-        # Объединяем все чанки
-        all_chunks = pdf_chunks + json_documents
+        current_ids = {unit["id"] for unit in units}
+        report["removed"] = [
+            old.get("label", unit_id) for unit_id, old in old_units.items() if unit_id not in current_ids
+        ]
+        
+        if not changed_units and not report["removed"] and had_index:
+            logger.info("Index is up to date, nothing to reindex")
+        
+        # Разбор PDF идет в пуле процессов, а чанки каждого готового файла
+        # сразу уходят в планировщик векторизации - без общего списка страниц корпуса в памяти
+        scheduler = EmbeddingScheduler(embeddings, progress=progress)
+        fresh_chunks = {}  # unit_id -> chunks
+        pending = []  # чанки, еще не отправленные в планировщик
+        tasks = []
+        chunk_stream = iter_unit_chunks(changed_units)
+        while True:
+            # next() блокируется на ожидании воркеров - ждем в потоке, не блокируя event loop
+            item = await asyncio.to_thread(next, chunk_stream, None)
+            if item is None:
+                break
+            unit, unit_chunks = item
+            fresh_chunks[unit["id"]] = unit_chunks
+            pending.extend(unit_chunks)
+            # Отправляем только полные батчи, чтобы мелкие Q&A пары не уходили по одной
+            while len(pending) >= scheduler.batch_size:
+                tasks.append(scheduler.submit([c.page_content for c in pending[:scheduler.batch_size]]))
+                pending = pending[scheduler.batch_size:]
+        if pending:
+            tasks.append(scheduler.submit([c.page_content for c in pending]))
+        
+        try:
+            batch_vectors = await asyncio.gather(*tasks)
+        except Exception:
+            # Готовые батчи сохранены в кеше embeddings - повторный /index их не пересчитает
+            for task in tasks:
+                task.cancel()
+            raise
+        
+        # Векторы идут в порядке отправки чанков = порядке единиц в fresh_chunks
+        flat_vectors = [vector for vectors in batch_vectors for vector in vectors]
+        fresh = {}  # unit_id -> (chunks, vectors)
+        offset = 0
+        for unit_id, unit_chunks in fresh_chunks.items():
+            unit_vectors = flat_vectors[offset:offset + len(unit_chunks)]
+            offset += len(unit_chunks)
+            fresh[unit_id] = (unit_chunks, index_store.normalize_rows(unit_vectors) if unit_chunks else None)
+
+        embed_stats = scheduler.stats()
+        # Чанки из кеша embeddings: батчи, готовые до сбоя прошлой попытки, и неизмененный текст
+        cached = getattr(embeddings, "document_hits", 0)
+        report["embedded_chunks"] = embed_stats["done"] - cached
+        report["cached_chunks"] = cached
+        report["embed_seconds"] = embed_stats["elapsed"]
+        report["embed_rate"] = embed_stats["rate"]
+        report["rate_limited"] = embed_stats["rate_limited"]
+        logger.info(
+            f"Embedded {embed_stats['done']} new/changed chunks in {embed_stats['elapsed']:.1f}s "
+            f"({embed_stats['rate']:.1f} chunks/s, from cache: {cached}, "
+            f"rate limited: {embed_stats['rate_limited']})"
+        )
+        
+        # Склеиваем итоговый индекс в порядке единиц
+        all_chunks = []
+        vector_parts = []
+        for unit in units:
+            if unit["id"] in fresh:
+                unit_chunks, unit_vectors = fresh[unit["id"]]
+            else:
+                old = old_units[unit["id"]]
+                start, count = old["start"], old["count"]
+                unit_chunks, unit_vectors = old_chunks[start:start + count], old_vectors[start:start + count]
+            new_units[unit["id"]]["start"] = len(all_chunks)
+            new_units[unit["id"]]["count"] = len(unit_chunks)
+            all_chunks.extend(unit_chunks)
+            if unit_chunks:
+                vector_parts.append(np.asarray(unit_vectors, dtype=np.float32))
         
         if not all_chunks:
             logger.warning("No documents found to index")
-            return None, []
+            return None, [], None, report
         
-        logger.info(f"Total chunks to index: {len(all_chunks)} (PDF: {len(pdf_chunks)}, JSON: {len(json_documents)})")
+        vectors = np.concatenate(vector_parts)
+        report["total_chunks"] = len(all_chunks)
+        logger.info(
+            f"Total chunks: {len(all_chunks)} (embedded: {report['embedded_chunks']}, "
+            f"added: {len(report['added'])}, changed: {len(report['changed'])}, "
+            f"removed: {len(report['removed'])}, unchanged: {report['unchanged']})"
+        )
         
-        vector_store = create_vector_store(all_chunks)
+        vector_store = vector_store_from_embeddings(all_chunks, vectors, embeddings)
+        # BM25 строится один раз здесь, а не при каждой инициализации retriever
+        sparse = BM25Index.build(all_chunks, previous=old_sparse)
         logger.info("Reindexing completed successfully")
         
-        # Возвращаем vector_store и chunks для BM25
-        return vector_store, all_chunks
+        # Сохраняем индекс на диск - следующий старт загрузит его без пересчета embeddings
+        try:
+            manifest["units"] = new_units
+            ann = vector_store if isinstance(vector_store, ANNVectorStore) else None
+            index_store.save_index(index_path, all_chunks, vectors, manifest, sparse=sparse, ann=ann)
+        except OSError as e:
+            logger.warning(f"Failed to persist index: {e}")
+        
+        return vector_store, all_chunks, sparse, report
         
     except FileNotFoundError as e:
         logger.error(f"File not found: {e}")
-        return None, []
+        return None, [], None, report
     except Exception as e:
         logger.error(f"Error during reindexing: {e}", exc_info=True)
-        return None, []
-
+        return None, [], None, report
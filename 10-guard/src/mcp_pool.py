@@ -0,0 +1,211 @@
+"""
+Постоянные сессии MCP сервера с переподключением
+
+MultiServerMCPClient.get_tools() загружает инструменты один раз при старте: если MCP сервер
+в этот момент недоступен, агент работает без search_products/currency_converter до перезапуска.
+Кроме того, такие инструменты открывают новую MCP сессию (HTTP handshake + initialize)
+на каждый вызов.
+
+MCPSessionPool:
+- держит MCP_POOL_SIZE постоянных сессий (streamable HTTP, keep-alive соединения httpx),
+  вызовы распределяются между подключенными сессиями по кругу
+- каждую сессию ведет фоновая задача: подключение, проверка ping раз в MCP_HEALTH_INTERVAL
+  секунд, при ошибке - переподключение с экспоненциальной задержкой
+- агент получает прокси-инструменты: они не привязаны к конкретной сессии и переживают
+  переподключения; если изменился набор инструментов (сервер появился после старта бота,
+  обновился) - вызывается on_tools_changed, и агент пересобирается
+- время каждого вызова пишется в лог и в статистику по инструментам (/index_status)
+"""
+import asyncio
+import json
+import logging
+import time
+from collections import defaultdict
+
+from langchain_core.tools import StructuredTool, ToolException
+from langchain_mcp_adapters.sessions import create_session
+from langchain_mcp_adapters.tools import load_mcp_tools
+
+logger = logging.getLogger(__name__)
+
+UNAVAILABLE_TEXT = "Сервис временно недоступен. Сообщи клиенту, что операцию можно повторить позже."
+# Таймаут проверки соединения (ping)
+_PING_TIMEOUT = 5
+
+
+class _Slot:
+    """Одна постоянная MCP сессия и инструменты, привязанные к ней"""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.session = None
+        self.tools = {}
+        self.broken = asyncio.Event()  # Вызов упал с ошибкой соединения - переподключиться
+
+
+class MCPSessionPool:
+    """
+    Args:
+        server_name: имя MCP сервера (для логов)
+        connection: параметры подключения langchain_mcp_adapters ({"transport", "url"})
+        size: число постоянных сессий
+        health_interval: период проверки соединения, секунды
+        max_reconnect_delay: максимальная пауза между попытками переподключения, секунды
+        on_tools_changed: async callback(tools) - набор инструментов сервера изменился
+    """
+
+    def __init__(self, server_name: str, connection: dict, size: int = 2, health_interval: float = 30,
+                 max_reconnect_delay: float = 60, on_tools_changed=None):
+        self.server_name = server_name
+        self.connection = connection
+        self.health_interval = health_interval
+        self.max_reconnect_delay = max_reconnect_delay
+        self.on_tools_changed = on_tools_changed
+        self.tools = []  # Прокси-инструменты для агента
+        self._slots = [_Slot(i) for i in range(max(1, size))]
+        self._tasks = []
+        self._next = 0
+        self._signature = None
+        self._ready = asyncio.Event()
+        self.connects = 0
+        self.reconnects = 0
+        # Статистика вызовов по инструментам
+        self.calls = defaultdict(lambda: {"calls": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0})
+
+    async def start(self, wait: float = 10):
+        """Запуск фоновых сессий; ждем первую загрузку инструментов не дольше wait секунд"""
+        self._tasks = [
+            asyncio.create_task(self._supervise(slot), name=f"mcp-{self.server_name}-{slot.index}")
+            for slot in self._slots
+        ]
+        try:
+            await asyncio.wait_for(self._ready.wait(), wait)
+        except asyncio.TimeoutError:
+            logger.warning(
+                f"⚠️  MCP server '{self.server_name}' is unavailable, "
+                f"tools will be registered when it comes back"
+            )
+        return self.tools
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    # --- Сессии ---
+
+    async def _supervise(self, slot: _Slot):
+        """Подключение, проверка ping и переподключение одной сессии"""
+        delay = 1.0
+        while True:
+            connected = False
+            try:
+                async with create_session(self.connection) as session:
+                    await session.initialize()
+                    tools = await load_mcp_tools(session)
+                    slot.session, slot.tools = session, {tool.name: tool for tool in tools}
+                    slot.broken.clear()
+                    connected = True
+                    delay = 1.0
+                    self.connects += 1
+                    logger.info(f"MCP session {slot.index} to '{self.server_name}' connected")
+                    await self._register(tools)
+                    while True:
+                        try:
+                            await asyncio.wait_for(slot.broken.wait(), self.health_interval)
+                            raise ConnectionError("tool call failed")
+                        except asyncio.TimeoutError:
+                            await asyncio.wait_for(session.send_ping(), _PING_TIMEOUT)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"MCP session {slot.index} to '{self.server_name}' lost: {e}")
+            finally:
+                slot.session, slot.tools = None, {}
+            if connected:
+                self.reconnects += 1
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_reconnect_delay)
+
+    async def _register(self, tools: list):
+        """Обновление прокси-инструментов, если набор инструментов сервера изменился"""
+        signature = sorted(
+            (tool.name, tool.description, json.dumps(tool.args_schema, sort_keys=True, default=str))
+            for tool in tools
+        )
+        if signature == self._signature:
+            return
+        self._signature = signature
+        self.tools = [self._proxy(tool) for tool in tools]
+        logger.info(f"✓ MCP server '{self.server_name}' tools registered ({len(tools)}):")
+        for tool in tools:
+            logger.info(f"  - {tool.name}: {tool.description}")
+        self._ready.set()
+        if self.on_tools_changed:
+            await self.on_tools_changed(self.tools)
+
+    def _proxy(self, tool) -> StructuredTool:
+        """Инструмент для агента: вызов идет через любую подключенную сессию"""
+        async def call_tool(**arguments):
+            return await self.call(tool.name, arguments)
+
+        return StructuredTool(
+            name=tool.name,
+            description=tool.description,
+            args_schema=tool.args_schema,
+            coroutine=call_tool,
+            response_format="content_and_artifact",
+            metadata=tool.metadata,
+        )
+
+    def _pick(self, tool_name: str):
+        """Следующая подключенная сессия (по кругу), в которой есть инструмент"""
+        for _ in range(len(self._slots)):
+            slot = self._slots[self._next % len(self._slots)]
+            self._next += 1
+            if slot.session is not None and tool_name in slot.tools:
+                return slot
+        return None
+
+    # --- Вызовы ---
+
+    async def call(self, tool_name: str, arguments: dict):
+        stats = self.calls[tool_name]
+        stats["calls"] += 1
+        started = time.perf_counter()
+        slot = self._pick(tool_name)
+        try:
+            if slot is None:
+                stats["errors"] += 1
+                logger.warning(f"MCP tool {tool_name} called while '{self.server_name}' is unavailable")
+                return UNAVAILABLE_TEXT, None
+            return await slot.tools[tool_name].coroutine(**arguments)
+        except ToolException:
+            # Ошибка самого инструмента (isError) - соединение в порядке
+            stats["errors"] += 1
+            raise
+        except Exception as e:
+            stats["errors"] += 1
+            slot.broken.set()
+            logger.error(f"MCP tool {tool_name} failed on session {slot.index}: {e}")
+            return UNAVAILABLE_TEXT, None
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            stats["total_ms"] += elapsed_ms
+            stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+            logger.info(f"MCP tool {tool_name}: {elapsed_ms:.0f} ms")
+
+    def stats(self) -> dict:
+        return {
+            "server": self.server_name,
+            "connected": sum(slot.session is not None for slot in self._slots),
+            "size": len(self._slots),
+            "connects": self.connects,
+            "reconnects": self.reconnects,
+            "tools": len(self.tools),
+            "calls": {
+                name: {**stats, "avg_ms": stats["total_ms"] / stats["calls"] if stats["calls"] else 0.0}
+                for name, stats in self.calls.items()
+            },
+        }
@@ -1,7 +1,14 @@
+import asyncio
 import logging
-from langchain_community.retrievers import BM25Retriever
-from langchain_classic.retrievers import EnsembleRetriever
+from concurrent.futures import ThreadPoolExecutor
 from config import config
+import embedding_cache
+from sparse_index import BM25Index, BM25IndexRetriever
+from hybrid_retriever import HybridRetriever
+from reranker import RerankerEngine
+from faq_index import FAQIndex, extract_answer
+import semantic_cache
+import context_compression
 
 logger = logging.getLogger(__name__)
 
@@ -9,7 +16,13 @@ logger = logging.getLogger(__name__)
 vector_store = None
 retriever = None
 chunks = None  # Для BM25 retriever
-cross_encoder = None  # Для reranking (lazy loading)
+bm25_index = None  # Инвертированный индекс BM25 над chunks (строится при индексации)
+cross_encoder = None  # RerankerEngine для reranking (lazy loading)
+# Ограниченный пул для CPU части retrieval: всплеск запросов не занимает все ядра
+# и не блокирует event loop бота
+retrieval_executor = ThreadPoolExecutor(max_workers=config.RETRIEVAL_WORKERS, thread_name_prefix="retrieval")
+faq_index = None  # Вопросы Q&A пар для быстрого пути без retrieval и LLM
+faq_stats = {"lookups": 0, "exact": 0, "fuzzy": 0}
 
 def create_semantic_retriever():
     """Создание semantic retriever из vector store"""
@@ -19,39 +32,86 @@ def create_semantic_retriever():
         search_kwargs={'k': config.SEMANTIC_RETRIEVER_K}
     )
 
-def create_bm25_retriever():
-    """Создание BM25 retriever из chunks"""
+def get_bm25_index():
+    """BM25 индекс для текущих chunks"""
+    global bm25_index
     if chunks is None or len(chunks) == 0:
         raise ValueError("Chunks not initialized for BM25")
-    bm25 = BM25Retriever.from_documents(chunks)
-    bm25.k = config.BM25_RETRIEVER_K
-    return bm25
+    # Индекс приходит из indexer вместе с chunks; строим сами только если он от другого корпуса
+    if bm25_index is None or bm25_index.documents is not chunks:
+        logger.info("BM25 index is missing or stale, building from chunks")
+        bm25_index = BM25Index.build(chunks)
+    return bm25_index
+
+def get_faq_index():
+    """FAQ индекс для текущих chunks (перестраивается после переиндексации - это быстро)"""
+    global faq_index
+    if faq_index is None or faq_index.documents is not chunks:
+        faq_index = FAQIndex(chunks or [], fuzzy_threshold=config.FAQ_FUZZY_THRESHOLD)
+        logger.info(f"FAQ index built: {len(faq_index)} questions")
+    return faq_index
+
+def faq_answer(question: str):
+    """
+    Готовый ответ из Q&A JSON, если вопрос клиента совпадает с вопросом FAQ
+    
+    Returns:
+        dict | None: {"answer", "documents", "match"} или None
+    """
+    faq_stats["lookups"] += 1
+    found = get_faq_index().lookup(question)
+    if found is None:
+        return None
+    doc, match, similarity = found
+    faq_stats[match] += 1
+    logger.info(f"FAQ {match} match ({similarity:.2f}): {doc.metadata.get('question')}")
+    return {
+        "answer": extract_answer(doc),
+        "documents": [{"source": doc.metadata.get("source", "Unknown"), "page_content": doc.page_content}],
+        "match": match,
+    }
+
+def create_bm25_retriever():
+    """Создание BM25 retriever поверх инвертированного индекса chunks"""
+    return BM25IndexRetriever(index=get_bm25_index(), k=config.BM25_RETRIEVER_K)
 
 def create_hybrid_retriever():
-    """Создание гибридного retriever (Semantic + BM25)"""
-    semantic = create_semantic_retriever()
-    bm25 = create_bm25_retriever()
+    """Создание гибридного retriever (Semantic + BM25, ветки выполняются параллельно)"""
+    if vector_store is None:
+        raise ValueError("Vector store not initialized")
     
     logger.info(f"Hybrid retriever: semantic_k={config.SEMANTIC_RETRIEVER_K}, bm25_k={config.BM25_RETRIEVER_K}")
     logger.info(f"Ensemble weights: semantic={config.ENSEMBLE_SEMANTIC_WEIGHT}, bm25={config.ENSEMBLE_BM25_WEIGHT}")
     
-    return EnsembleRetriever(
-        retrievers=[semantic, bm25],
-        weights=[config.ENSEMBLE_SEMANTIC_WEIGHT, config.ENSEMBLE_BM25_WEIGHT]
+    return HybridRetriever(
+        vector_store=vector_store,
+        bm25_index=get_bm25_index(),
+        semantic_k=config.SEMANTIC_RETRIEVER_K,
+        bm25_k=config.BM25_RETRIEVER_K,
+        semantic_weight=config.ENSEMBLE_SEMANTIC_WEIGHT,
+        bm25_weight=config.ENSEMBLE_BM25_WEIGHT,
+        executor=retrieval_executor,
     )
 
-def get_cross_encoder():
-    """Ленивая инициализация cross-encoder для reranking"""
+def get_reranker():
+    """RerankerEngine без загрузки модели"""
     global cross_encoder
     if cross_encoder is None:
-        try:
-            from sentence_transformers import CrossEncoder
-            logger.info(f"Loading cross-encoder model: {config.CROSS_ENCODER_MODEL}")
-            cross_encoder = CrossEncoder(config.CROSS_ENCODER_MODEL)
-            logger.info("✓ Cross-encoder loaded successfully")
-        except Exception as e:
-            logger.error(f"Failed to load cross-encoder: {e}", exc_info=True)
-            raise
+        cross_encoder = RerankerEngine(config.CROSS_ENCODER_MODEL)
+    return cross_encoder
+
+def start_reranker_warmup():
+    """Загрузка и прогрев cross-encoder в фоновом потоке (вызывается при старте бота)"""
+    return get_reranker().start_warmup()
+
+def get_cross_encoder():
+    """Ленивая инициализация cross-encoder для reranking (RerankerEngine)"""
+    get_reranker()
+    try:
+        cross_encoder.load()
+    except Exception as e:
+        logger.error(f"Failed to load cross-encoder: {e}", exc_info=True)
+        raise
     return cross_encoder
 
 def rerank_documents(query: str, documents: list, top_k: int = None):
@@ -64,7 +124,8 @@ def rerank_documents(query: str, documents: list, top_k: int = None):
         top_k: Количество документов для возврата (default: config.RERANKER_TOP_K)
     
     Returns:
-        List[tuple]: Список (document, score) отсортированный по релевантности
+        List[tuple]: Список (document, score) отсортированный по релевантности,
+            score = None если reranker еще не готов и документы возвращены в порядке retriever
     """
     if top_k is None:
         top_k = config.RERANKER_TOP_K
@@ -72,13 +133,24 @@ def rerank_documents(query: str, documents: list, top_k: int = None):
     if not documents:
         return []
     
-    encoder = get_cross_encoder()
-    
-    # Создаем пары (query, document_text) для cross-encoder
-    pairs = [(query, doc.page_content) for doc in documents]
+    encoder = get_reranker()
+    state = encoder.state()
+    if state == "failed" and encoder.retry_due():
+        # Загрузка упала, пауза прошла - пробуем снова в фоне
+        encoder.start_warmup()
+        state = encoder.state()
+    if state in ("loading", "failed"):
+        # Идет прогрев при старте: ждем не дольше CROSS_ENCODER_READY_TIMEOUT,
+        # затем отвечаем без reranking (порядок RRF), а не блокируем пользователя
+        if state == "failed" or not encoder.ready.wait(config.CROSS_ENCODER_READY_TIMEOUT):
+            logger.warning(f"Reranker not ready ({encoder.state()}), returning top {top_k} without reranking")
+            return [(doc, None) for doc in documents[:top_k]]
+    else:
+        encoder = get_cross_encoder()
     
-    # Cross-encoder оценивает релевантность каждой пары
-    scores = encoder.predict(pairs)
+    # Cross-encoder оценивает релевантность каждой пары (query, document_text);
+    # пары из кеша не пересчитываются, остальные пары одновременных запросов идут одним батчем
+    scores = encoder.score_documents(query, documents)
     
     # Сортируем по убыванию score
     ranked = sorted(zip(documents, scores), key=lambda x: x[1], reverse=True)
@@ -92,6 +164,8 @@ def create_retriever():
     """Фабрика для создания retriever по режиму"""
     mode = config.RETRIEVAL_MODE.lower()
     
+    logger.info(f"Vector backend: {config.VECTOR_BACKEND} ({type(vector_store).__name__})")
+    
     if mode == "semantic":
         logger.info("Creating semantic retriever")
         return create_semantic_retriever()
@@ -151,6 +225,32 @@ def retrieve_documents(query: str):
         # Для semantic и hybrid - прямой вызов retriever
         return retriever.invoke(query)
 
+async def aretrieve_documents(query: str):
+    """
+    Асинхронный поиск документов (для вызова из event loop)
+    
+    Векторизация запроса идет через aembed_query, в hybrid режиме
+    semantic и BM25 ветки выполняются одновременно. Reranking (CPU) - в retrieval_executor.
+    
+    Args:
+        query: Поисковый запрос
+    
+    Returns:
+        list[Document]: Список найденных документов
+    """
+    if retriever is None:
+        raise ValueError("Retriever not initialized")
+    
+    documents = await retriever.ainvoke(query)
+    if config.RETRIEVAL_MODE.lower() == "hybrid_reranker":
+        if not documents:
+            return []
+        reranked = await asyncio.get_running_loop().run_in_executor(
+            retrieval_executor, rerank_documents, query, documents, config.RERANKER_TOP_K
+        )
+        return [doc for doc, score in reranked]
+    return documents
+
 def get_vector_store_stats():
     """Возвращает статистику векторного хранилища с полной информацией о конфигурации"""
     stats = {
@@ -163,6 +263,12 @@ def get_vector_store_stats():
     if vector_store is not None:
         doc_count = len(vector_store.store) if hasattr(vector_store, 'store') else 0
         stats["count"] = doc_count
+        stats["vector_backend"] = config.VECTOR_BACKEND
+        if bm25_index is not None:
+            stats["bm25_terms"] = len(bm25_index.terms)
+        # Для ANN бэкендов - качество относительно точного поиска
+        if getattr(vector_store, "recall_at_k", None) is not None:
+            stats["ann_recall_at_k"] = vector_store.recall_at_k
     
     # Добавляем информацию о моделях в зависимости от провайдера
     if config.EMBEDDING_PROVIDER == "openai":
@@ -171,6 +277,11 @@ def get_vector_store_stats():
         stats["embedding_model"] = config.HUGGINGFACE_EMBEDDING_MODEL
         stats["device"] = config.HUGGINGFACE_DEVICE
     
+    # Кеш embeddings (попадания/промахи с момента старта)
+    cache_stats = embedding_cache.get_stats()
+    if cache_stats is not None:
+        stats["embedding_cache"] = cache_stats
+    
     # Добавляем параметры retrieval режима
     if config.RETRIEVAL_MODE == "semantic":
         stats["semantic_k"] = config.SEMANTIC_RETRIEVER_K
@@ -185,7 +296,37 @@ def get_vector_store_stats():
         stats["semantic_weight"] = config.ENSEMBLE_SEMANTIC_WEIGHT
         stats["bm25_weight"] = config.ENSEMBLE_BM25_WEIGHT
         stats["cross_encoder_model"] = config.CROSS_ENCODER_MODEL
+        stats["cross_encoder_backend"] = config.CROSS_ENCODER_BACKEND
+        if cross_encoder is not None:
+            stats["reranker_state"] = cross_encoder.state()
+            stats["reranker_warmup_seconds"] = cross_encoder.warmup_seconds
+            # Кеш оценок cross-encoder (заполняется после первых запросов)
+            if cross_encoder.cache is not None:
+                stats["reranker_cache"] = cross_encoder.cache.stats()
         stats["reranker_top_k"] = config.RERANKER_TOP_K
     
+    # Время веток гибридного поиска для последнего запроса
+    if getattr(retriever, "last_timings", None):
+        stats["hybrid_timings"] = retriever.last_timings
+    
+    # Доля вопросов, отвеченных напрямую из FAQ
+    if config.FAQ_FAST_PATH_ENABLED:
+        served = faq_stats["exact"] + faq_stats["fuzzy"]
+        stats["faq_fast_path"] = {
+            **faq_stats,
+            "questions": len(faq_index) if faq_index is not None else 0,
+            "share": served / faq_stats["lookups"] if faq_stats["lookups"] else 0.0,
+        }
+    
+    # Сжатие результатов rag_search (сэкономленные токены контекста LLM)
+    compression_stats = context_compression.get_stats()
+    if compression_stats and compression_stats["calls"]:
+        stats["context_compression"] = compression_stats
+    
+    # Семантический кеш ответов и результатов rag_search
+    cache_stats = semantic_cache.get_stats()
+    if cache_stats:
+        stats["semantic_cache"] = cache_stats
+    
     return stats
 
@@ -0,0 +1,396 @@
+"""
+Движок переранжирования cross-encoder
+
+В режиме hybrid_reranker cross-encoder - самая дорогая часть запроса.
+RerankerEngine ускоряет его:
+- бэкенд CROSS_ENCODER_BACKEND:
+  - torch      - PyTorch fp32 (как раньше)
+  - onnx       - ONNX Runtime (модель экспортируется при первом запуске)
+  - onnx_int8  - ONNX Runtime с динамической int8 квантизацией (быстрее всего на CPU)
+- пары (вопрос, документ) обрезаются до CROSS_ENCODER_MAX_LENGTH токенов
+- пары от одновременных запросов собираются в общий батч: воркер ждет
+  до CROSS_ENCODER_BATCH_WAIT_MS и делает один вызов модели на всех
+- оценки кешируются по (нормализованный вопрос, id чанка): агент часто вызывает
+  rag_search несколько раз за ход с почти одинаковым вопросом, повторные пары
+  не идут в модель (LRU на RERANKER_CACHE_SIZE записей, TTL RERANKER_CACHE_TTL)
+- прогрев при старте бота (warm_up в фоновом потоке): загрузка модели и несколько
+  пробных пар, чтобы первый клиент после деплоя не ждал скачивания и инициализации.
+  Готовность видна через ready/state(), запросы до готовности могут подождать или обойтись без reranking.
+  Если загрузка упала, первый запрос после паузы CROSS_ENCODER_RETRY_DELAY (удваивается
+  после каждой неудачи) запускает прогрев заново
+
+Экспорт ONNX требует: uv add "sentence-transformers[onnx]"
+"""
+import logging
+import queue
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from pathlib import Path
+
+import numpy as np
+
+from config import config
+from analyzers import normalize_question
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("torch", "onnx", "onnx_int8")
+
+# Максимальная пауза между повторными попытками загрузки модели, секунды
+_MAX_RETRY_DELAY = 600
+
+# Пробные пары для прогрева: короткая и длинная (до max_length), как в реальных запросах
+WARMUP_PAIRS = [
+    ("Как закрыть вклад?", "Закрыть вклад можно в СберБанк Онлайн или в офисе банка."),
+    (
+        "Какая ставка по потребительскому кредиту?",
+        "Процентная ставка по кредиту устанавливается в Индивидуальных условиях договора. " * 20,
+    ),
+]
+
+
+def _model_dir_name(model_name: str) -> str:
+    return re.sub(r"[^A-Za-z0-9._-]+", "__", model_name)
+
+
+class ScoreCache:
+    """
+    LRU кеш оценок cross-encoder с TTL
+
+    Ключ - (нормализованный вопрос, id чанка). id чанка зависит от его текста,
+    поэтому после переиндексации кеш остается корректным: измененный чанк получит новый id.
+    """
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (score, expires_at)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.saved_ms = 0.0
+
+    def get_many(self, keys: list) -> dict:
+        """Найденные и не устаревшие оценки: {key: score}"""
+        now = time.monotonic()
+        found = {}
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+                score, expires_at = entry
+                if expires_at < now:
+                    del self._entries[key]
+                    continue
+                self._entries.move_to_end(key)
+                found[key] = score
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, items: dict):
+        expires_at = time.monotonic() + self.ttl
+        with self._lock:
+            for key, score in items.items():
+                self._entries[key] = (score, expires_at)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "saved_ms": self.saved_ms,
+        }
+
+
+class RerankerEngine:
+    """
+    Cross-encoder с выбором runtime и микро-батчингом запросов
+
+    Использование:
+        engine = RerankerEngine(config.CROSS_ENCODER_MODEL)
+        scores = engine.score(query, [doc.page_content for doc in documents])
+    """
+
+    def __init__(self, model_name: str, backend: str = None, max_length: int = None,
+                 batch_size: int = None, batch_wait_ms: float = None, quantization: str = None):
+        self.model_name = model_name
+        self.backend = (backend or config.CROSS_ENCODER_BACKEND).lower()
+        if self.backend not in BACKENDS:
+            raise ValueError(f"Unknown CROSS_ENCODER_BACKEND: {self.backend}. Use one of: {', '.join(BACKENDS)}")
+        self.max_length = max_length or config.CROSS_ENCODER_MAX_LENGTH
+        self.batch_size = batch_size or config.CROSS_ENCODER_BATCH_SIZE
+        self.batch_wait = (config.CROSS_ENCODER_BATCH_WAIT_MS if batch_wait_ms is None else batch_wait_ms) / 1000
+        self.quantization = quantization or config.CROSS_ENCODER_ONNX_QUANTIZATION
+
+        self.model = None
+        self._load_lock = threading.Lock()
+        # Модель загружена и прогрета - запросы не будут ждать инициализации
+        self.ready = threading.Event()
+        self.load_error = None
+        self.load_failures = 0
+        self.retry_delay = config.CROSS_ENCODER_RETRY_DELAY
+        self._failed_at = None
+        self.warmup_seconds = None
+        self._warmup_thread = None
+        self._warmup_lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._worker = None
+
+        self.cache = ScoreCache(config.RERANKER_CACHE_SIZE, config.RERANKER_CACHE_TTL) \
+            if config.RERANKER_CACHE_SIZE > 0 else None
+
+        self.model_calls = 0
+        self.pairs_scored = 0
+        self.predict_seconds = 0.0
+
+    # --- Загрузка модели ---
+
+    def load(self):
+        """Загрузка модели (идемпотентна, потокобезопасна)"""
+        try:
+            model = self._load_model()
+        except Exception as e:
+            self._record_failure(e)
+            raise
+        self.ready.set()
+        return model
+
+    def _record_failure(self, error: Exception):
+        self.load_error = error
+        self.load_failures += 1
+        self._failed_at = time.monotonic()
+
+    def _current_retry_delay(self) -> float:
+        return min(self.retry_delay * 2 ** max(self.load_failures - 1, 0), _MAX_RETRY_DELAY)
+
+    def retry_due(self) -> bool:
+        """Загрузка упала и пауза перед повторной попыткой прошла"""
+        return self.load_error is not None and time.monotonic() - self._failed_at >= self._current_retry_delay()
+
+    def _load_model(self):
+        with self._load_lock:
+            if self.model is not None:
+                return self.model
+            started = time.perf_counter()
+            logger.info(f"Loading cross-encoder model: {self.model_name} (backend: {self.backend})")
+            if self.backend == "torch":
+                self.model = self._load_torch()
+            else:
+                self.model = self._load_onnx(quantized=self.backend == "onnx_int8")
+            logger.info(f"✓ Cross-encoder loaded in {time.perf_counter() - started:.1f}s")
+            return self.model
+
+    def _load_torch(self):
+        from sentence_transformers import CrossEncoder
+        return CrossEncoder(self.model_name, max_length=self.max_length)
+
+    def _load_onnx(self, quantized: bool):
+        """
+        ONNX модель из локальной директории, при первом запуске - экспорт
+
+        Экспортированная (и квантизованная) модель сохраняется в CROSS_ENCODER_ONNX_DIR,
+        повторные старты загружают готовый файл.
+        """
+        try:
+            from sentence_transformers import CrossEncoder
+            from sentence_transformers.backend import export_dynamic_quantized_onnx_model
+        except ImportError as e:
+            raise ImportError(
+                'CROSS_ENCODER_BACKEND=onnx requires ONNX Runtime: uv add "sentence-transformers[onnx]"'
+            ) from e
+
+        local_dir = Path(config.CROSS_ENCODER_ONNX_DIR) / _model_dir_name(self.model_name)
+        file_name = f"onnx/model_qint8_{self.quantization}.onnx" if quantized else "onnx/model.onnx"
+
+        if not (local_dir / "onnx" / "model.onnx").exists():
+            logger.info(f"Exporting {self.model_name} to ONNX: {local_dir}")
+            model = CrossEncoder(self.model_name, backend="onnx", max_length=self.max_length)
+            model.save_pretrained(str(local_dir))
+        if quantized and not (local_dir / file_name).exists():
+            logger.info(f"Quantizing ONNX model (int8, {self.quantization})")
+            model = CrossEncoder(str(local_dir), backend="onnx", max_length=self.max_length)
+            export_dynamic_quantized_onnx_model(model, self.quantization, str(local_dir))
+
+        return CrossEncoder(
+            str(local_dir), backend="onnx", max_length=self.max_length,
+            model_kwargs={"file_name": file_name}
+        )
+
+    # --- Прогрев ---
+
+    def warm_up(self):
+        """
+        Загрузка модели и пробные вызовы
+
+        Первые вызовы модели медленнее последующих (инициализация runtime, выделение
+        памяти, JIT/оптимизация графа) - делаем их до прихода пользователей.
+        """
+        started = time.perf_counter()
+        try:
+            self._load_model()
+            for _ in range(2):
+                self.predict(WARMUP_PAIRS)
+                self.predict(WARMUP_PAIRS * (self.batch_size // len(WARMUP_PAIRS)))
+        except Exception as e:
+            self._record_failure(e)
+            logger.error(
+                f"Cross-encoder warm-up failed (attempt {self.load_failures}), "
+                f"retry in {self._current_retry_delay():.0f}s: {e}", exc_info=True
+            )
+            return
+        self.load_failures = 0
+        self.warmup_seconds = time.perf_counter() - started
+        # Пробные вызовы не учитываем в статистике (иначе завышается среднее время на пару)
+        self.model_calls = self.pairs_scored = 0
+        self.predict_seconds = 0.0
+        self.ready.set()
+        logger.info(f"✓ Cross-encoder warmed up in {self.warmup_seconds:.1f}s, reranker ready")
+
+    def start_warmup(self) -> threading.Thread:
+        """
+        Прогрев в фоновом потоке (не блокирует запуск бота)
+
+        Повторный вызов после неудачной загрузки запускает прогрев заново, если прошла пауза retry_due().
+        """
+        with self._warmup_lock:
+            running = self._warmup_thread is not None and self._warmup_thread.is_alive()
+            if self._warmup_thread is None or (not running and self.retry_due()):
+                if self.load_error is not None:
+                    logger.info(f"Retrying cross-encoder load (attempt {self.load_failures + 1})")
+                    self.load_error = None
+                self._warmup_thread = threading.Thread(target=self.warm_up, name="reranker-warmup", daemon=True)
+                self._warmup_thread.start()
+            return self._warmup_thread
+
+    def state(self) -> str:
+        """ready / loading (идет прогрев) / failed (ждет повторной попытки) / not_loaded (ленивая загрузка при первом запросе)"""
+        if self.ready.is_set():
+            return "ready"
+        if self.load_error is not None:
+            return "failed"
+        if self._warmup_thread is not None:
+            return "loading"
+        return "not_loaded"
+
+    # --- Оценка пар ---
+
+    def predict(self, pairs: list) -> np.ndarray:
+        """Прямой вызов модели для списка пар (без очереди)"""
+        model = self._load_model()
+        started = time.perf_counter()
+        scores = np.asarray(
+            model.predict(pairs, batch_size=self.batch_size, show_progress_bar=False), dtype=np.float32
+        )
+        self.predict_seconds += time.perf_counter() - started
+        self.model_calls += 1
+        self.pairs_scored += len(pairs)
+        return scores
+
+    def score(self, query: str, texts: list) -> list:
+        """
+        Оценка релевантности текстов запросу
+
+        Пары ставятся в общую очередь: запросы из разных потоков (одновременные
+        вызовы rag_search) обрабатываются одним вызовом модели.
+
+        Returns:
+            list[float] в порядке texts
+        """
+        if not texts:
+            return []
+        if self.batch_wait <= 0:
+            return self.predict([(query, text) for text in texts]).tolist()
+        self._ensure_worker()
+        future = Future()
+        self._queue.put(([(query, text) for text in texts], future))
+        return future.result()
+
+    def score_documents(self, query: str, documents: list) -> list:
+        """
+        Оценка документов с кешем по (нормализованный вопрос, id чанка)
+
+        В модель уходят только пары, которых нет в кеше.
+
+        Returns:
+            list[float] в порядке documents
+        """
+        if self.cache is None:
+            return self.score(query, [doc.page_content for doc in documents])
+
+        normalized = normalize_question(query)
+        keys = [(normalized, doc.id or doc.page_content) for doc in documents]
+        found = self.cache.get_many(keys)
+        missing = [i for i, key in enumerate(keys) if key not in found]
+        if found and self.pairs_scored:
+            # Экономия = среднее время модели на пару * число пар из кеша
+            self.cache.saved_ms += len(found) * self.predict_seconds / self.pairs_scored * 1000
+        if missing:
+            scores = self.score(query, [documents[i].page_content for i in missing])
+            computed = {keys[i]: score for i, score in zip(missing, scores)}
+            self.cache.put_many(computed)
+            found.update(computed)
+        return [found[key] for key in keys]
+
+    def _ensure_worker(self):
+        if self._worker is None or not self._worker.is_alive():
+            with self._load_lock:
+                if self._worker is None or not self._worker.is_alive():
+                    self._worker = threading.Thread(target=self._batch_loop, name="reranker-batcher", daemon=True)
+                    self._worker.start()
+
+    def _batch_loop(self):
+        while True:
+            requests = [self._queue.get()]
+            n_pairs = len(requests[0][0])
+            # Добираем пары других запросов, пока не наберется батч или не истечет окно ожидания
+            deadline = time.perf_counter() + self.batch_wait
+            while n_pairs < self.batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    request = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                requests.append(request)
+                n_pairs += len(request[0])
+
+            pairs = [pair for request_pairs, _ in requests for pair in request_pairs]
+            try:
+                scores = self.predict(pairs)
+            except Exception as e:
+                for _, future in requests:
+                    future.set_exception(e)
+                continue
+            offset = 0
+            for request_pairs, future in requests:
+                future.set_result(scores[offset:offset + len(request_pairs)].tolist())
+                offset += len(request_pairs)
+            if len(requests) > 1:
+                logger.debug(f"Reranker batched {len(requests)} requests ({len(pairs)} pairs) into one call")
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.backend,
+            "max_length": self.max_length,
+            "state": self.state(),
+            "warmup_seconds": self.warmup_seconds,
+            "model_calls": self.model_calls,
+            "pairs_scored": self.pairs_scored,
+            "cache": self.cache.stats() if self.cache is not None else None,
+        }
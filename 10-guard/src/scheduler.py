@@ -0,0 +1,127 @@
+"""
+Планировщик запросов: последовательно внутри чата, параллельно между чатами, с backpressure
+
+aiogram обрабатывает каждое обновление отдельной задачей, поэтому без ограничений:
+- два быстрых сообщения одного клиента идут в агента одновременно и пишут в одну историю
+- всплеск запросов запускает десятки агентов, retrieval и reranking сразу - медленно всем
+
+ChatScheduler (middleware aiogram):
+- сообщения одного chat_id обрабатываются строго по очереди (asyncio.Lock на чат)
+- одновременно выполняется не больше MAX_CONCURRENT_REQUESTS запросов, остальные ждут
+- если ожидающих больше MAX_QUEUED_REQUESTS (или MAX_QUEUED_PER_CHAT в одном чате),
+  новый запрос сразу получает ответ "попробуйте позже" вместо бесконечного ожидания
+Команды (/index, /index_status, ...) идут мимо планировщика.
+"""
+import asyncio
+import logging
+import time
+from collections import defaultdict
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, Message
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+BUSY_TEXT = "⏳ Сейчас много запросов. Пожалуйста, повторите вопрос через минуту."
+
+
+class ChatScheduler(BaseMiddleware):
+    """
+    Args:
+        max_in_flight: максимум одновременно обрабатываемых запросов
+        max_queued: максимум запросов в ожидании (по всем чатам)
+        max_queued_per_chat: максимум ожидающих запросов одного чата
+    """
+
+    def __init__(self, max_in_flight: int, max_queued: int, max_queued_per_chat: int):
+        self.max_in_flight = max_in_flight
+        self.max_queued = max_queued
+        self.max_queued_per_chat = max_queued_per_chat
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self._chat_locks = {}
+        self._chat_pending = defaultdict(int)  # chat_id -> запросов в обработке и ожидании
+        self.in_flight = 0
+        self.queued = 0
+        self.max_queue_depth = 0
+        self.completed = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+
+    @staticmethod
+    def _chat_id(event):
+        if isinstance(event, Message):
+            # Команды не планируем: /index_status должен отвечать и под нагрузкой
+            if event.text and event.text.startswith("/"):
+                return None
+            return event.chat.id
+        if isinstance(event, CallbackQuery) and event.message is not None:
+            return event.message.chat.id
+        return None
+
+    async def _reject(self, event, chat_id: int):
+        self.rejected += 1
+        logger.warning(f"Request from chat {chat_id} rejected: {self.queued} queued, {self.in_flight} in flight")
+        if isinstance(event, CallbackQuery):
+            await event.answer(BUSY_TEXT, show_alert=True)
+        else:
+            await event.answer(BUSY_TEXT)
+
+    async def __call__(self, handler, event, data):
+        chat_id = self._chat_id(event)
+        if chat_id is None:
+            return await handler(event, data)
+
+        # Backpressure: очередь переполнена - отказываем сразу
+        if self.queued >= self.max_queued or self._chat_pending[chat_id] > self.max_queued_per_chat:
+            await self._reject(event, chat_id)
+            return None
+
+        self._chat_pending[chat_id] += 1
+        self.queued += 1
+        self.max_queue_depth = max(self.max_queue_depth, self.queued)
+        started = time.perf_counter()
+        waiting = True
+        lock = self._chat_locks.setdefault(chat_id, asyncio.Lock())
+        try:
+            async with lock:
+                async with self._slots:
+                    waiting = False
+                    self.queued -= 1
+                    wait = time.perf_counter() - started
+                    self.total_wait += wait
+                    if wait > 1:
+                        logger.info(f"Request from chat {chat_id} waited {wait:.1f} s in queue")
+                    self.in_flight += 1
+                    try:
+                        return await handler(event, data)
+                    finally:
+                        self.in_flight -= 1
+                        self.completed += 1
+        finally:
+            # Отмена во время ожидания (остановка бота) - запрос уходит из очереди
+            if waiting:
+                self.queued -= 1
+            self._chat_pending[chat_id] -= 1
+            if not self._chat_pending[chat_id]:
+                del self._chat_pending[chat_id]
+                self._chat_locks.pop(chat_id, None)
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "queued": self.queued,
+            "max_queue_depth": self.max_queue_depth,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "avg_wait_seconds": self.total_wait / self.completed if self.completed else 0.0,
+        }
+
+
+scheduler = ChatScheduler(
+    max_in_flight=config.MAX_CONCURRENT_REQUESTS,
+    max_queued=config.MAX_QUEUED_REQUESTS,
+    max_queued_per_chat=config.MAX_QUEUED_PER_CHAT,
+)
@@ -0,0 +1,184 @@
+"""
+Семантический кеш ответов для повторяющихся вопросов клиентов
+
+Клиенты банка сотни раз в день спрашивают одно и то же ("как закрыть вклад",
+"ставки по вкладам"), и каждый раз вопрос проходит retrieval, reranking и генерацию LLM.
+Кеш находит уже отвеченный вопрос по близости embeddings нормализованного текста:
+- answer_cache - готовый ответ агента и источники (только для вопросов, не зависящих от истории)
+- search_cache - документы rag_search для близкого запроса агента
+
+Кеш небольшой (SEMANTIC_CACHE_MAX_ENTRIES), поэтому поиск ближайшего - точный,
+одним матричным произведением NumPy по нормализованным векторам.
+Записи живут SEMANTIC_CACHE_TTL секунд и сбрасываются при /index (документы изменились).
+"""
+import logging
+import re
+import threading
+import time
+
+import numpy as np
+
+from config import config
+import index_store
+from analyzers import normalize_question
+
+logger = logging.getLogger(__name__)
+
+# Эвристика "вопрос понятен без истории диалога". Одна и та же в 07-advanced-rag/src/rag.py
+# (нужна ли LLM трансформация запроса) и 10-guard/src/semantic_cache.py (можно ли кешировать
+# ответ): модули курса - отдельные проекты и не импортируют друг друга, поэтому копии
+# держим одинаковыми и меняем вместе.
+
+# Слова-отсылки к предыдущим сообщениям ("а его можно закрыть?", "а для этого вклада?")
+_CONTEXT_WORDS = frozenset("""
+он она оно они его ее её их ему ей им ими него нее неё них нему ней ним
+это этот эта эти этого этой этому этим этих этом
+тот та те того той тому тем тех том такой такая такое такие таких
+там туда тогда выше ранее предыдущий предыдущая предыдущее последний последняя
+еще ещё тоже также второй первый
+""".split())
+# Первые слова продолжения диалога ("а если...", "и сколько...")
+_CONTINUATION_WORDS = frozenset({"а", "и", "но", "тогда"})
+# Вопросы короче ("а ставка?", "сколько стоит?") почти всегда опираются на историю
+_MIN_SELF_CONTAINED_WORDS = 3
+
+_WORD_RE = re.compile(r"[0-9a-zа-яё]+")
+
+
+def is_history_independent(text: str) -> bool:
+    """
+    Вопрос понятен без предыдущих сообщений
+
+    Нет, если в нем меньше _MIN_SELF_CONTAINED_WORDS слов, он начинается как продолжение
+    диалога ("а если...", "и сколько...") или содержит местоимения и отсылки ("его", "этот", "там", "еще").
+    """
+    words = _WORD_RE.findall(text.lower())
+    if len(words) < _MIN_SELF_CONTAINED_WORDS or words[0] in _CONTINUATION_WORDS:
+        return False
+    return not any(word in _CONTEXT_WORDS for word in words)
+
+
+class SemanticCache:
+    """
+    Кеш {вопрос -> значение} с поиском по косинусной близости
+
+    Args:
+        name: имя кеша для логов и статистики
+        threshold: минимальная косинусная близость для попадания
+        ttl: время жизни записи в секундах
+        max_entries: максимум записей (вытесняются давно не использованные)
+    """
+
+    def __init__(self, name: str, threshold: float, ttl: float, max_entries: int):
+        self.name = name
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._vectors = np.zeros((0, 0), dtype=np.float32)
+        self._entries = []  # {"question", "value", "expires_at", "last_used"} в порядке строк матрицы
+        self.lookups = 0
+        self.hits = 0
+        self.stores = 0
+        self.invalidations = 0
+
+    def _embed(self, embeddings, question: str) -> np.ndarray:
+        return index_store.normalize_rows([embeddings.embed_query(normalize_question(question))])[0]
+
+    async def _aembed(self, embeddings, question: str) -> np.ndarray:
+        vector = await embeddings.aembed_query(normalize_question(question))
+        return index_store.normalize_rows([vector])[0]
+
+    def _lookup_vector(self, vector: np.ndarray):
+        now = time.time()
+        with self._lock:
+            self.lookups += 1
+            if not self._entries:
+                return None
+            scores = self._vectors @ vector
+            # Устаревшие записи не участвуют в поиске (удаляются при следующей записи)
+            for i in np.argsort(-scores):
+                if scores[i] < self.threshold:
+                    return None
+                entry = self._entries[i]
+                if entry["expires_at"] >= now:
+                    entry["last_used"] = now
+                    self.hits += 1
+                    logger.info(f"Semantic cache '{self.name}' hit ({scores[i]:.3f}): {entry['question'][:60]}")
+                    return entry["value"]
+            return None
+
+    def _store_vector(self, question: str, vector: np.ndarray, value):
+        now = time.time()
+        entry = {"question": question, "value": value, "expires_at": now + self.ttl, "last_used": now}
+        with self._lock:
+            # Убираем устаревшие и, при переполнении, давно не использованные записи
+            keep = [i for i, e in enumerate(self._entries) if e["expires_at"] >= now]
+            if len(keep) >= self.max_entries:
+                keep = sorted(keep, key=lambda i: self._entries[i]["last_used"])[len(keep) - self.max_entries + 1:]
+                keep.sort()
+            entries = [self._entries[i] for i in keep] + [entry]
+            vectors = [self._vectors[keep]] if keep else []
+            self._vectors = np.concatenate(vectors + [vector[None, :]]).astype(np.float32)
+            self._entries = entries
+            self.stores += 1
+
+    def lookup(self, question: str, embeddings):
+        """Значение для близкого вопроса или None"""
+        return self._lookup_vector(self._embed(embeddings, question))
+
+    def store(self, question: str, value, embeddings):
+        self._store_vector(question, self._embed(embeddings, question), value)
+
+    async def alookup(self, question: str, embeddings):
+        """
+        Асинхронный поиск
+
+        Returns:
+            tuple: (значение или None, вектор вопроса - для astore без повторной векторизации)
+        """
+        vector = await self._aembed(embeddings, question)
+        return self._lookup_vector(vector), vector
+
+    async def astore(self, question: str, value, embeddings, vector: np.ndarray = None):
+        if vector is None:
+            vector = await self._aembed(embeddings, question)
+        self._store_vector(question, vector, value)
+
+    def invalidate(self):
+        """Сброс всех записей (документы переиндексированы)"""
+        with self._lock:
+            self._entries = []
+            self._vectors = np.zeros((0, 0), dtype=np.float32)
+            self.invalidations += 1
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_rate": self.hits / self.lookups if self.lookups else 0.0,
+            "stores": self.stores,
+        }
+
+
+answer_cache = SemanticCache(
+    "answers", config.SEMANTIC_CACHE_THRESHOLD, config.SEMANTIC_CACHE_TTL, config.SEMANTIC_CACHE_MAX_ENTRIES
+)
+search_cache = SemanticCache(
+    "rag_search", config.SEMANTIC_CACHE_THRESHOLD, config.SEMANTIC_CACHE_TTL, config.SEMANTIC_CACHE_MAX_ENTRIES
+)
+
+
+def invalidate_all():
+    """Сброс кешей после переиндексации"""
+    answer_cache.invalidate()
+    search_cache.invalidate()
+    logger.info("Semantic caches invalidated")
+
+
+def get_stats():
+    """Статистика кешей (None если кеш выключен)"""
+    if not config.SEMANTIC_CACHE_ENABLED:
+        return None
+    return {"answers": answer_cache.stats(), "search": search_cache.stats()}
@@ -0,0 +1,261 @@
+"""
+Разреженный (лексический) индекс BM25 с инвертированными списками
+
+Замена BM25Retriever.from_documents(chunks): тот токенизирует весь корпус
+при каждом initialize_retriever(), а каждый запрос считает score для всех документов
+в цикле Python (rank_bm25).
+
+Здесь:
+- корпус токенизируется один раз при переиндексации, индекс сохраняется
+  рядом с векторным индексом (INDEX_DIR/<index_key>/bm25.npz + bm25.json)
+- postings хранятся в компактных массивах (CSR): для терма t документы
+  doc_ids[indptr[t]:indptr[t+1]] и частоты tf[...], длины документов и IDF - отдельные массивы
+- запрос трогает только postings своих термов, а не весь корпус
+- тексты и запросы проходят через анализатор (analyzers.py: регистр, ё/е, стоп-слова,
+  стемминг); частоты термов каждого чанка берутся из предыдущего индекса,
+  поэтому при переиндексации анализируются только новые чанки
+
+Формула совпадает с rank_bm25.BM25Okapi (k1=1.5, b=0.75, epsilon=0.25):
+с BM25_ANALYZER=whitespace ранжирование то же, что у прежнего BM25Retriever.
+"""
+import hashlib
+import json
+import logging
+import os
+from collections import Counter
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from analyzers import get_analyzer
+
+logger = logging.getLogger(__name__)
+
+# 2: стеммер Портера без ручных исключений (термы индекса изменились)
+SPARSE_FORMAT_VERSION = 2
+
+ARRAYS_FILE = "bm25.npz"
+META_FILE = "bm25.json"
+
+
+def chunk_ids_digest(chunks: list) -> str:
+    """Отпечаток порядка чанков: индекс валиден только для того же списка чанков"""
+    digest = hashlib.sha256()
+    for chunk in chunks:
+        digest.update((chunk.id or "").encode("utf-8") + b"\0")
+    return digest.hexdigest()
+
+
+class BM25Index:
+    """
+    Инвертированный индекс BM25 над списком чанков
+
+    Строка i индекса = chunks[i] (тот же порядок, что и в матрице embeddings).
+    """
+
+    def __init__(self, documents: list, terms: list, indptr, doc_ids, tf, doc_len, analyzer,
+                 k1: float = 1.5, b: float = 0.75, epsilon: float = 0.25):
+        self.documents = documents
+        self.terms = terms
+        self.vocab = {term: i for i, term in enumerate(terms)}
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.doc_ids = np.asarray(doc_ids, dtype=np.int32)
+        self.tf = np.asarray(tf, dtype=np.int32)
+        self.doc_len = np.asarray(doc_len, dtype=np.int32)
+        self.analyzer = analyzer
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+        self.idf = self._compute_idf()
+        self.weights = self._compute_weights()
+
+    def __len__(self):
+        return len(self.documents)
+
+    def _compute_idf(self) -> np.ndarray:
+        """IDF как в BM25Okapi: отрицательные значения заменяются на epsilon * средний IDF"""
+        n_docs = len(self.doc_len)
+        df = np.diff(self.indptr).astype(np.float64)
+        idf = np.log(n_docs - df + 0.5) - np.log(df + 0.5)
+        if len(idf):
+            idf[idf < 0] = self.epsilon * idf.mean()
+        return idf.astype(np.float32)
+
+    def _compute_weights(self) -> np.ndarray:
+        """
+        Нормированная частота терма для каждого posting
+
+        tf * (k1 + 1) / (tf + k1 * (1 - b + b * dl / avgdl)) не зависит от запроса,
+        поэтому считается один раз - запрос только умножает ее на IDF и суммирует.
+        """
+        if not len(self.doc_ids):
+            return np.zeros(0, dtype=np.float32)
+        avgdl = self.doc_len.mean() or 1.0
+        dl = self.doc_len[self.doc_ids].astype(np.float64)
+        tf = self.tf.astype(np.float64)
+        weights = tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * dl / avgdl))
+        return weights.astype(np.float32)
+
+    def term_counts(self) -> dict:
+        """
+        Частоты термов каждого чанка, восстановленные из postings: {chunk_id: (длина, {терм: tf})}
+
+        Это и есть кеш результата анализатора: id чанка зависит от его текста,
+        поэтому для того же id повторный анализ дал бы те же термы.
+        """
+        term_of_posting = np.repeat(np.arange(len(self.terms)), np.diff(self.indptr))
+        order = np.argsort(self.doc_ids, kind="stable")
+        bounds = np.searchsorted(self.doc_ids[order], np.arange(len(self.documents) + 1))
+        counts = {}
+        for doc, chunk in enumerate(self.documents):
+            postings = order[bounds[doc]:bounds[doc + 1]]
+            counts[chunk.id] = (
+                int(self.doc_len[doc]),
+                {self.terms[t]: int(tf) for t, tf in zip(term_of_posting[postings], self.tf[postings])},
+            )
+        return counts
+
+    @classmethod
+    def build(cls, chunks: list, analyzer=None, previous: "BM25Index" = None) -> "BM25Index":
+        """
+        Построение индекса
+
+        Args:
+            chunks: список Document (у каждого заполнен id)
+            analyzer: анализатор текста (по умолчанию - из конфига)
+            previous: предыдущий индекс - для чанков с теми же id анализатор не запускается
+        """
+        analyzer = analyzer or get_analyzer()
+        cached = {}
+        if previous is not None and previous.analyzer.name == analyzer.name:
+            cached = previous.term_counts()
+
+        postings = {}  # терм -> [(doc, tf), ...]
+        doc_len = np.zeros(len(chunks), dtype=np.int32)
+        analyzed = 0
+        for doc, chunk in enumerate(chunks):
+            if chunk.id in cached:
+                length, counts = cached[chunk.id]
+            else:
+                tokens = analyzer(chunk.page_content)
+                length, counts = len(tokens), Counter(tokens)
+                analyzed += 1
+            doc_len[doc] = length
+            for term, count in counts.items():
+                postings.setdefault(term, []).append((doc, count))
+
+        terms = sorted(postings)
+        indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+        for i, term in enumerate(terms):
+            indptr[i + 1] = indptr[i] + len(postings[term])
+        doc_ids = np.empty(indptr[-1], dtype=np.int32)
+        tf = np.empty(indptr[-1], dtype=np.int32)
+        for i, term in enumerate(terms):
+            entries = postings[term]
+            doc_ids[indptr[i]:indptr[i + 1]] = [doc for doc, _ in entries]
+            tf[indptr[i]:indptr[i + 1]] = [count for _, count in entries]
+
+        index = cls(chunks, terms, indptr, doc_ids, tf, doc_len, analyzer)
+        logger.info(
+            f"BM25 index built ({analyzer.name}): {len(chunks)} docs, {len(terms)} terms, "
+            f"{len(doc_ids)} postings, analyzed {analyzed} chunks"
+        )
+        return index
+
+    def search(self, query: str, k: int = 4) -> list:
+        """
+        Поиск top-k документов по запросу
+
+        Returns:
+            list[tuple]: (Document, score) по убыванию score, только документы
+                с хотя бы одним термом запроса
+        """
+        query_terms = Counter(term for term in self.analyzer(query) if term in self.vocab)
+        if not query_terms or k <= 0:
+            return []
+
+        # Собираем postings только термов запроса
+        doc_parts, score_parts = [], []
+        for term, count in query_terms.items():
+            t = self.vocab[term]
+            start, end = self.indptr[t], self.indptr[t + 1]
+            doc_parts.append(self.doc_ids[start:end])
+            # Повтор терма в запросе учитывается, как в BM25Okapi
+            score_parts.append(self.weights[start:end] * (self.idf[t] * count))
+        candidates, inverse = np.unique(np.concatenate(doc_parts), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(score_parts))
+
+        k = min(k, len(candidates))
+        top = np.argpartition(-scores, k - 1)[:k] if k < len(candidates) else np.arange(len(candidates))
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(self.documents[candidates[i]], float(scores[i])) for i in top]
+
+    def save(self, index_path: Path):
+        """Сохранение массивов и словаря в директорию индекса (через временные файлы)"""
+        index_path = Path(index_path)
+        arrays_tmp = index_path / (ARRAYS_FILE + ".tmp")
+        meta_tmp = index_path / (META_FILE + ".tmp")
+        with open(arrays_tmp, "wb") as f:
+            np.savez(f, indptr=self.indptr, doc_ids=self.doc_ids, tf=self.tf, doc_len=self.doc_len)
+        meta = {
+            "format_version": SPARSE_FORMAT_VERSION,
+            "analyzer": self.analyzer.name,
+            "k1": self.k1,
+            "b": self.b,
+            "epsilon": self.epsilon,
+            "chunks_digest": chunk_ids_digest(self.documents),
+            "terms": self.terms,
+        }
+        meta_tmp.write_text(json.dumps(meta, ensure_ascii=False), encoding="utf-8")
+        os.replace(arrays_tmp, index_path / ARRAYS_FILE)
+        os.replace(meta_tmp, index_path / META_FILE)
+
+    @classmethod
+    def load(cls, index_path: Path, chunks: list, analyzer=None):
+        """
+        Загрузка индекса с диска
+
+        Returns:
+            BM25Index или None, если индекса нет, он построен другим анализатором
+            или для другого списка чанков
+        """
+        analyzer = analyzer or get_analyzer()
+        index_path = Path(index_path)
+        meta_path = index_path / META_FILE
+        if not meta_path.exists():
+            return None
+        try:
+            meta = json.loads(meta_path.read_text(encoding="utf-8"))
+            if meta.get("format_version") != SPARSE_FORMAT_VERSION or meta.get("analyzer") != analyzer.name:
+                logger.info(f"BM25 index in {index_path} built with another analyzer/format, rebuilding")
+                return None
+            if meta.get("chunks_digest") != chunk_ids_digest(chunks):
+                logger.info(f"BM25 index in {index_path} does not match chunks, rebuilding")
+                return None
+            with np.load(index_path / ARRAYS_FILE) as arrays:
+                index = cls(
+                    chunks, meta["terms"], arrays["indptr"], arrays["doc_ids"], arrays["tf"], arrays["doc_len"],
+                    analyzer, k1=meta["k1"], b=meta["b"], epsilon=meta["epsilon"]
+                )
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Failed to load BM25 index from {index_path}: {e}")
+            return None
+        logger.info(f"BM25 index loaded from {index_path}: {len(index.terms)} terms")
+        return index
+
+
+class BM25IndexRetriever(BaseRetriever):
+    """LangChain retriever поверх BM25Index (замена BM25Retriever)"""
+
+    index: Any
+    k: int = 4
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> list:
+        return [
+            Document(id=doc.id, page_content=doc.page_content, metadata=dict(doc.metadata))
+            for doc, _ in self.index.search(query, self.k)
+        ]
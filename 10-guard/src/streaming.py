@@ -0,0 +1,98 @@
+"""
+Потоковая доставка ответа агента в Telegram
+
+Вместо ожидания полного ответа (5-15 секунд) бот отправляет сообщение с первыми токенами
+и дописывает его редактированием по мере генерации. Редактирования ограничены
+(STREAM_EDIT_INTERVAL) - Bot API ограничивает частоту правок сообщений в одном чате.
+В конце сообщение заменяется финальным ответом (после PII маскирования) с источниками.
+"""
+import logging
+import time
+
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.types import Message
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+# Лимит длины сообщения Telegram
+MAX_MESSAGE_LENGTH = 4096
+# Признак того, что ответ еще генерируется
+CURSOR = " ▌"
+
+
+class TelegramStreamer:
+    """
+    Одно сообщение Telegram, которое дописывается по мере поступления текста
+
+    Args:
+        message: входящее сообщение пользователя (ответ отправляется в тот же чат)
+        edit_interval: минимальный интервал между редактированиями, секунды
+    """
+
+    def __init__(self, message: Message, edit_interval: float = None):
+        self.message = message
+        self.edit_interval = config.STREAM_EDIT_INTERVAL if edit_interval is None else edit_interval
+        self.sent = None  # Отправленное сообщение (после первых токенов)
+        self.text = ""
+        self._shown = ""
+        self._last_edit = 0.0
+        self._started = time.perf_counter()
+        self.first_token_ms = None
+
+    async def _show(self, text: str):
+        """Отправка или редактирование сообщения; ошибки Bot API не прерывают генерацию"""
+        text = text[:MAX_MESSAGE_LENGTH]
+        if text == self._shown:
+            return
+        try:
+            if self.sent is None:
+                self.sent = await self.message.answer(text)
+            else:
+                await self.sent.edit_text(text)
+            self._shown = text
+        except TelegramRetryAfter as e:
+            # Превысили лимит - пропускаем правки до окончания паузы
+            self._last_edit = time.monotonic() + e.retry_after
+            logger.warning(f"Telegram flood control, next edit in {e.retry_after} s")
+        except TelegramBadRequest as e:
+            # message is not modified и т.п. - следующая правка все исправит
+            logger.debug(f"Stream edit skipped: {e}")
+
+    async def update(self, text: str):
+        """Новый текст ответа (целиком); показывается не чаще edit_interval"""
+        if not text.strip():
+            return
+        if self.first_token_ms is None:
+            self.first_token_ms = (time.perf_counter() - self._started) * 1000
+            logger.info(f"Time to first token in chat {self.message.chat.id}: {self.first_token_ms:.0f} ms")
+        self.text = text
+        now = time.monotonic()
+        if now - self._last_edit < self.edit_interval:
+            return
+        self._last_edit = now
+        await self._show(text[:MAX_MESSAGE_LENGTH - len(CURSOR)] + CURSOR)
+
+    async def finish(self, text: str):
+        """Финальный ответ: замена промежуточного текста (или отправка, если токенов не было)"""
+        if self.sent is None:
+            await self.message.answer(text)
+            return
+        try:
+            await self.sent.edit_text(text)
+        except TelegramBadRequest as e:
+            if "not modified" in str(e):
+                return
+            # Например, ответ с источниками длиннее лимита - отправляем отдельным сообщением
+            logger.warning(f"Failed to edit streamed message, sending a new one: {e}")
+            await self.message.answer(text)
+
+    async def discard(self):
+        """Удалить промежуточное сообщение (агент остановился на подтверждении операции)"""
+        if self.sent is not None:
+            try:
+                await self.sent.delete()
+            except TelegramBadRequest:
+                pass
+            self.sent = None
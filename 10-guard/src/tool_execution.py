@@ -0,0 +1,81 @@
+"""
+Выполнение вызовов инструментов одного шага ReAct: общий таймаут и время каждого вызова
+
+Если модель вернула несколько tool_calls в одном AIMessage (например, currency_converter
+и search_products), ToolNode запускает их одновременно (asyncio.gather) - все инструменты
+агента асинхронные. Без ограничения один зависший инструмент держит весь шаг, а с ним
+и ответ клиенту.
+
+ToolStepTimeoutMiddleware:
+- у всех вызовов одного шага общий срок TOOL_STEP_TIMEOUT секунд с начала шага;
+  не успевший вызов отменяется, модель получает ToolMessage с ошибкой и отвечает
+  по результатам остальных инструментов
+- время выполнения каждого вызова записывается в response_metadata["wall_time_ms"]
+  ToolMessage (логируется в agent._log_agent_step)
+
+Шаг удаляется, когда завершены все его вызовы (по tool_call id). Вызовы, которые до
+middleware не дошли (отклонены в HITL, пропущены ToolCallLimitMiddleware), шаг не закрывают -
+такие шаги удаляются после истечения их срока при следующем вызове инструмента.
+"""
+import asyncio
+import logging
+import time
+
+from langchain.agents.middleware import AgentMiddleware
+from langchain_core.messages import AIMessage, ToolMessage
+
+logger = logging.getLogger(__name__)
+
+
+class ToolStepTimeoutMiddleware(AgentMiddleware):
+    """
+    Args:
+        step_timeout: срок на все вызовы инструментов одного шага, секунды
+    """
+
+    def __init__(self, step_timeout: float):
+        super().__init__()
+        self.step_timeout = step_timeout
+        # id AIMessage шага -> [срок (loop time), id еще не завершенных tool_calls]
+        self._steps = {}
+
+    def _step_key(self, request):
+        """AIMessage с tool_calls текущего шага (последнее сообщение модели в состоянии)"""
+        tool_call_id = request.tool_call["id"]
+        for msg in reversed(request.state["messages"]):
+            if isinstance(msg, AIMessage):
+                return msg.id, {call["id"] for call in msg.tool_calls} or {tool_call_id}
+        return tool_call_id, {tool_call_id}
+
+    def _sweep(self, now: float):
+        """Удаление шагов с истекшим сроком (часть их вызовов не выполнялась)"""
+        for key in [key for key, step in self._steps.items() if step[0] < now]:
+            del self._steps[key]
+
+    async def awrap_tool_call(self, request, handler):
+        tool_call = request.tool_call
+        key, call_ids = self._step_key(request)
+        loop = asyncio.get_running_loop()
+        self._sweep(loop.time())
+        step = self._steps.setdefault(key, [loop.time() + self.step_timeout, call_ids])
+        started = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(handler(request), max(step[0] - loop.time(), 0))
+        except asyncio.TimeoutError:
+            logger.warning(f"Tool {tool_call['name']} cancelled: step timeout {self.step_timeout:g} s")
+            result = ToolMessage(
+                content=(
+                    f"Инструмент {tool_call['name']} не ответил за {self.step_timeout:g} с. "
+                    f"Ответь по результатам остальных инструментов или предложи клиенту повторить запрос позже."
+                ),
+                tool_call_id=tool_call["id"],
+                name=tool_call["name"],
+                status="error",
+            )
+        finally:
+            step[1].discard(tool_call["id"])
+            if not step[1] and self._steps.get(key) is step:
+                del self._steps[key]
+        if isinstance(result, ToolMessage):
+            result.response_metadata["wall_time_ms"] = (time.perf_counter() - started) * 1000
+        return result
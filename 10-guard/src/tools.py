@@ -3,47 +3,86 @@
 
 Инструменты - это функции, которые агент может вызывать для получения информации.
 Декоратор @tool из LangChain автоматически создает описание для LLM.
+
+rag_search - асинхронный: агент работает через astream, и синхронный инструмент
+занимал бы поток на все время retrieval. Векторизация запроса и поиск идут через ainvoke,
+CPU часть (BM25, cross-encoder) - в пуле потоков. Если агент вызывает rag_search
+несколько раз за один шаг, вызовы выполняются одновременно.
+
+LLM получает сжатый контекст (context_compression.py), полные документы передаются
+в artifact ToolMessage - для отображения источников и RAGAS, в промпт они не попадают.
 """
-import json
 import logging
 from langchain_core.tools import tool
+from config import config
+import context_compression
 import rag
+import semantic_cache
 
 logger = logging.getLogger(__name__)
 
-@tool
-def rag_search(query: str) -> str:
+
+def _full_sources(documents):
+    """Полные документы в формате источников (для SHOW_SOURCES и evaluation)"""
+    sources = []
+    for doc in documents:
+        source_data = {
+            "source": doc.metadata.get("source", "Unknown"),
+            "page_content": doc.page_content  # Полный текст документа
+        }
+        # page только для PDF (у JSON документов его нет)
+        if "page" in doc.metadata:
+            source_data["page"] = doc.metadata["page"]
+        sources.append(source_data)
+    return sources
+
+
+@tool(response_format="content_and_artifact")
+async def rag_search(query: str):
     """
     Ищет информацию в документах Сбербанка (условия кредитов, вкладов и других банковских продуктов).
     
     Возвращает JSON со списком источников, где каждый источник содержит:
     - source: имя файла
     - page: номер страницы (только для PDF)
-    - page_content: текст документа
+    - page_content: текст документа (фрагменты, относящиеся к запросу)
     """
     try:
-        # Получаем релевантные документы через RAG (retrieval + reranking)
-        documents = rag.retrieve_documents(query)
+        # Близкий запрос уже искали - берем сохраненные документы без retrieval и reranking
+        documents, query_vector = None, None
+        if config.SEMANTIC_CACHE_ENABLED:
+            documents, query_vector = await semantic_cache.search_cache.alookup(
+                query, rag.vector_store.embeddings
+            )
+        
+        if documents is None:
+            # Получаем релевантные документы через RAG (retrieval + reranking)
+            # CPU часть (BM25, cross-encoder) - в ограниченном пуле retrieval_executor
+            documents = await rag.aretrieve_documents(query)
+            if documents and config.SEMANTIC_CACHE_ENABLED:
+                await semantic_cache.search_cache.astore(
+                    query, documents, rag.vector_store.embeddings, query_vector
+                )
         
         if not documents:
-            return json.dumps({"sources": []}, ensure_ascii=False)
+            return context_compression.dumps([]), {"sources": []}
         
-        # Формируем структурированный ответ для агента
-        sources = []
-        for doc in documents:
-            source_data = {
-                "source": doc.metadata.get("source", "Unknown"),
-                "page_content": doc.page_content  # Полный текст документа
-            }
-            # page только для PDF (у JSON документов его нет)
-            if "page" in doc.metadata:
-                source_data["page"] = doc.metadata["page"]
-            sources.append(source_data)
+        sources = _full_sources(documents)
+        full_payload = context_compression.dumps(sources)
+        if not config.RAG_CONTEXT_COMPRESSION:
+            return full_payload, {"sources": sources}
         
-        # ensure_ascii=False для корректной кириллицы
-        return json.dumps({"sources": sources}, ensure_ascii=False)
+        # В контекст LLM - только дедуплицированные фрагменты, относящиеся к запросу
+        compact_payload = context_compression.dumps(
+            context_compression.compress_documents(query, documents)
+        )
+        tokens = context_compression.record(full_payload, compact_payload)
+        logger.info(
+            f"rag_search context: {tokens['tokens_compact']} tokens "
+            f"instead of {tokens['tokens_full']} ({len(documents)} documents)"
+        )
+        return compact_payload, {"sources": sources, **tokens}
         
     except Exception as e:
         logger.error(f"Error in rag_search: {e}", exc_info=True)
-        return json.dumps({"sources": []}, ensure_ascii=False)
-
+        return context_compression.dumps([]), {"sources": []}
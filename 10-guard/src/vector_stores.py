@@ -0,0 +1,373 @@
+"""
+Векторные хранилища поверх матрицы embeddings из персистентного индекса
+
+NumpyVectorStore - точный поиск: все embeddings в одной непрерывной матрице float32
+с нормализованными строками, запрос = одно матрично-векторное произведение + argpartition,
+батч запросов = одно матричное произведение. InMemoryVectorStore для сравнения
+считает близость к каждому вектору отдельно в цикле Python.
+
+ANNVectorStore - приближенный поиск ближайших соседей (HNSW через hnswlib или FAISS).
+Время запроса растет логарифмически с размером корпуса, а не линейно.
+Граф строится и проверяется (recall@k) при переиндексации и сохраняется в директорию
+индекса рядом с manifest.json - старт бота загружает его с диска.
+
+Хранилища реализуют интерфейс LangChain VectorStore, поэтому
+vector_store.as_retriever() и rag.create_semantic_retriever() работают без изменений.
+"""
+import asyncio
+import json
+import logging
+import os
+from abc import abstractmethod
+from collections.abc import Mapping
+from pathlib import Path
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+from config import config
+import index_store
+from sparse_index import chunk_ids_digest
+
+logger = logging.getLogger(__name__)
+
+ANN_FORMAT_VERSION = 1
+
+ANN_META_FILE = "ann.json"
+ANN_INDEX_FILES = {"hnsw": "ann_hnsw.bin", "faiss": "ann_faiss.index"}
+
+
+class ChunkStoreView(Mapping):
+    """
+    Представление чанков в формате InMemoryVectorStore.store ({id: {"id", "vector", "text", "metadata"}})
+
+    Нужно для совместимости: get_vector_store_stats() и другой код смотрят на len(vector_store.store).
+    Записи строятся по запросу, отдельная копия векторов не хранится.
+    """
+
+    def __init__(self, chunks: list, vectors: np.ndarray):
+        self._chunks = chunks
+        self._vectors = vectors
+        self._positions = {chunk.id: i for i, chunk in enumerate(chunks)}
+
+    def __getitem__(self, doc_id):
+        i = self._positions[doc_id]
+        chunk = self._chunks[i]
+        return {
+            "id": chunk.id,
+            "vector": self._vectors[i].tolist(),
+            "text": chunk.page_content,
+            "metadata": chunk.metadata,
+        }
+
+    def __iter__(self):
+        return iter(self._positions)
+
+    def __len__(self):
+        return len(self._chunks)
+
+
+def _to_document(chunk: Document) -> Document:
+    """Копия чанка для выдачи (retriever не должен менять документы индекса)"""
+    return Document(id=chunk.id, page_content=chunk.page_content, metadata=dict(chunk.metadata))
+
+
+class MatrixVectorStore(VectorStore):
+    """
+    Базовый класс хранилищ над матрицей нормализованных embeddings (косинусная близость)
+
+    Наследники реализуют search_ids() - поиск позиций чанков для батча запросов,
+    весь интерфейс LangChain VectorStore построен поверх него.
+    """
+
+    def __init__(self, embedding, chunks: list, vectors, normalized: bool = False):
+        """
+        Args:
+            embedding: объект embeddings для векторизации запросов
+            chunks: список Document в порядке строк матрицы
+            vectors: матрица embeddings
+            normalized: строки уже нормализованы и в float32 (матрица из index_store) -
+                используем ее как есть, без копии
+        """
+        self.embedding = embedding
+        self.chunks = list(chunks)
+        if not len(self.chunks):
+            self.vectors = np.zeros((0, 0), dtype=np.float32)
+        elif normalized and getattr(vectors, "dtype", None) == np.float32:
+            self.vectors = vectors
+        else:
+            self.vectors = index_store.normalize_rows(vectors)
+        self.store = ChunkStoreView(self.chunks, self.vectors)
+
+    @property
+    def embeddings(self):
+        return self.embedding
+
+    @abstractmethod
+    def search_ids(self, queries: np.ndarray, k: int):
+        """
+        Поиск по батчу нормализованных запросов
+
+        Returns:
+            tuple: (ids [n_queries, k], scores [n_queries, k]) - позиции чанков и косинусная близость
+        """
+
+    def _results(self, ids: np.ndarray, scores: np.ndarray) -> list:
+        return [
+            (_to_document(self.chunks[i]), float(score))
+            for i, score in zip(ids, scores) if i >= 0
+        ]
+
+    def similarity_search_with_score_by_vector(self, embedding: list, k: int = 4, **kwargs):
+        if not self.chunks:
+            return []
+        query = index_store.normalize_rows([embedding])
+        ids, scores = self.search_ids(query, k)
+        return self._results(ids[0], scores[0])
+
+    def similarity_search_by_vector(self, embedding: list, k: int = 4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k, **kwargs)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs):
+        return self.similarity_search_with_score_by_vector(self.embedding.embed_query(query), k, **kwargs)
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, **kwargs)]
+
+    async def asimilarity_search_with_score(self, query: str, k: int = 4, **kwargs):
+        embedding = await self.embedding.aembed_query(query)
+        # Поиск по матрице (NumPy/HNSW/FAISS отпускают GIL) - в потоке, не в event loop
+        return await asyncio.to_thread(self.similarity_search_with_score_by_vector, embedding, k, **kwargs)
+
+    async def asimilarity_search(self, query: str, k: int = 4, **kwargs):
+        return [doc for doc, _ in await self.asimilarity_search_with_score(query, k, **kwargs)]
+
+    def batch_similarity_search_with_score_by_vector(self, embeddings: list, k: int = 4) -> list:
+        """Поиск для нескольких запросов одним вызовом search_ids"""
+        if not self.chunks or not len(embeddings):
+            return [[] for _ in embeddings]
+        ids, scores = self.search_ids(index_store.normalize_rows(embeddings), k)
+        return [self._results(row_ids, row_scores) for row_ids, row_scores in zip(ids, scores)]
+
+    def batch_similarity_search(self, queries: list, k: int = 4) -> list:
+        """Поиск для нескольких текстовых запросов: list[list[Document]] в порядке queries"""
+        embeddings = [self.embedding.embed_query(query) for query in queries]
+        return [
+            [doc for doc, _ in results]
+            for results in self.batch_similarity_search_with_score_by_vector(embeddings, k)
+        ]
+
+    def _select_relevance_score_fn(self):
+        # Косинусная близость уже в диапазоне [-1, 1], большее = релевантнее
+        return lambda score: score
+
+    @classmethod
+    def from_texts(cls, texts: list, embedding, metadatas: list = None, ids: list = None, **kwargs):
+        metadatas = metadatas or [{} for _ in texts]
+        chunks = [
+            Document(id=ids[i] if ids else str(i), page_content=text, metadata=metadatas[i])
+            for i, text in enumerate(texts)
+        ]
+        vectors = embedding.embed_documents(list(texts))
+        return cls(embedding, chunks, vectors, **kwargs)
+
+
+class NumpyVectorStore(MatrixVectorStore):
+    """
+    Точный поиск векторизованными операциями NumPy
+
+    Матрица из персистентного индекса уже нормализована и хранится в float32,
+    поэтому memory-map из index_store используется как есть, без копирования.
+    """
+
+    def search_ids(self, queries: np.ndarray, k: int):
+        n = len(self.chunks)
+        k = min(k, n)
+        queries = np.asarray(queries, dtype=np.float32)
+        # [n_queries, dim] @ [dim, n_chunks] - одна операция BLAS на весь батч
+        scores = queries @ self.vectors.T
+        if k < n:
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        else:
+            top = np.broadcast_to(np.arange(n), scores.shape).copy()
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        # argpartition не сортирует - упорядочиваем только k лучших
+        order = np.argsort(-top_scores, axis=1)
+        return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+    def add_texts(self, texts, metadatas: list = None, ids: list = None, **kwargs) -> list:
+        texts = list(texts)
+        if not texts:
+            return []
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [index_store.text_sha256(text)[:24] for text in texts]
+        new_vectors = index_store.normalize_rows(self.embedding.embed_documents(texts))
+        self.chunks.extend(
+            Document(id=doc_id, page_content=text, metadata=metadata)
+            for doc_id, text, metadata in zip(ids, texts, metadatas)
+        )
+        self.vectors = new_vectors if self.vectors.size == 0 else np.concatenate([self.vectors, new_vectors])
+        self.store = ChunkStoreView(self.chunks, self.vectors)
+        return ids
+
+
+class ANNVectorStore(MatrixVectorStore):
+    """
+    Приближенный поиск по нормализованным embeddings (косинусная близость)
+
+    Бэкенды (VECTOR_BACKEND):
+    - hnsw  - hnswlib, граф HNSW
+    - faiss - faiss-cpu, IndexHNSWFlat с inner product
+    """
+
+    def __init__(self, embedding, chunks: list, vectors, backend: str = "hnsw", normalized: bool = False,
+                 index=None):
+        """
+        Args:
+            index: готовый граф (загруженный через load) - иначе строится по vectors
+        """
+        super().__init__(embedding, chunks, vectors, normalized=normalized)
+        self.backend = backend
+        self.recall_at_k = None
+        self._index = index if index is not None else self._build_index(self.vectors)
+
+    @staticmethod
+    def _import_backend(backend: str):
+        if backend == "hnsw":
+            try:
+                import hnswlib
+            except ImportError as e:
+                raise ImportError("VECTOR_BACKEND=hnsw requires hnswlib: uv add hnswlib") from e
+            return hnswlib
+        elif backend == "faiss":
+            try:
+                import faiss
+            except ImportError as e:
+                raise ImportError("VECTOR_BACKEND=faiss requires faiss-cpu: uv add faiss-cpu") from e
+            return faiss
+        raise ValueError(f"Unknown ANN backend: {backend}. Use 'hnsw' or 'faiss'")
+
+    def _set_ef_search(self, index):
+        ef_search = max(config.HNSW_EF_SEARCH, config.SEMANTIC_RETRIEVER_K)
+        if self.backend == "hnsw":
+            index.set_ef(ef_search)
+        else:
+            index.hnsw.efSearch = ef_search
+
+    def _build_index(self, vectors: np.ndarray):
+        n, dim = vectors.shape
+        lib = self._import_backend(self.backend)
+        if self.backend == "hnsw":
+            index = lib.Index(space="ip", dim=dim)
+            index.init_index(max_elements=max(n, 1), ef_construction=config.HNSW_EF_CONSTRUCTION, M=config.HNSW_M)
+            if n:
+                index.add_items(vectors, np.arange(n))
+        else:
+            index = lib.IndexHNSWFlat(dim, config.HNSW_M, lib.METRIC_INNER_PRODUCT)
+            index.hnsw.efConstruction = config.HNSW_EF_CONSTRUCTION
+            if n:
+                index.add(vectors)
+        self._set_ef_search(index)
+        return index
+
+    @staticmethod
+    def _graph_params() -> dict:
+        """Параметры построения графа: при их смене сохраненный граф не используется"""
+        return {"m": config.HNSW_M, "ef_construction": config.HNSW_EF_CONSTRUCTION}
+
+    def save(self, index_path: Path):
+        """Сохранение графа и recall@k в директорию индекса (через временные файлы)"""
+        index_path = Path(index_path)
+        index_file = index_path / ANN_INDEX_FILES[self.backend]
+        index_tmp = index_path / (index_file.name + ".tmp")
+        meta_tmp = index_path / (ANN_META_FILE + ".tmp")
+        if self.backend == "hnsw":
+            self._index.save_index(str(index_tmp))
+        else:
+            self._import_backend("faiss").write_index(self._index, str(index_tmp))
+        meta = {
+            "format_version": ANN_FORMAT_VERSION,
+            "backend": self.backend,
+            **self._graph_params(),
+            "chunks_digest": chunk_ids_digest(self.chunks),
+            "recall_at_k": self.recall_at_k,
+        }
+        meta_tmp.write_text(json.dumps(meta), encoding="utf-8")
+        os.replace(index_tmp, index_file)
+        os.replace(meta_tmp, index_path / ANN_META_FILE)
+
+    @classmethod
+    def load(cls, index_path: Path, embedding, chunks: list, vectors, backend: str):
+        """
+        Загрузка графа с диска
+
+        Returns:
+            ANNVectorStore или None, если графа нет, он построен другим бэкендом,
+            с другими параметрами или для другого списка чанков
+        """
+        index_path = Path(index_path)
+        meta_path = index_path / ANN_META_FILE
+        if not meta_path.exists():
+            return None
+        try:
+            meta = json.loads(meta_path.read_text(encoding="utf-8"))
+            expected = {"format_version": ANN_FORMAT_VERSION, "backend": backend, **cls._graph_params()}
+            if any(meta.get(key) != value for key, value in expected.items()):
+                logger.info(f"ANN index in {index_path} built with another backend/parameters, rebuilding")
+                return None
+            if meta.get("chunks_digest") != chunk_ids_digest(chunks):
+                logger.info(f"ANN index in {index_path} does not match chunks, rebuilding")
+                return None
+            lib = cls._import_backend(backend)
+            index_file = str(index_path / ANN_INDEX_FILES[backend])
+            if backend == "hnsw":
+                index = lib.Index(space="ip", dim=int(vectors.shape[1]))
+                index.load_index(index_file, max_elements=max(len(chunks), 1))
+            else:
+                index = lib.read_index(index_file)
+        except (OSError, ValueError, KeyError, RuntimeError) as e:
+            logger.warning(f"Failed to load ANN index from {index_path}: {e}")
+            return None
+        store = cls(embedding, chunks, vectors, backend=backend, normalized=True, index=index)
+        store._set_ef_search(index)
+        store.recall_at_k = meta.get("recall_at_k")
+        logger.info(f"ANN index ({backend}) loaded from {index_path}: {len(chunks)} vectors")
+        return store
+
+    def search_ids(self, queries: np.ndarray, k: int):
+        k = min(k, len(self.chunks))
+        queries = np.ascontiguousarray(queries, dtype=np.float32)
+        if self.backend == "hnsw":
+            labels, distances = self._index.knn_query(queries, k=k)
+            # hnswlib space="ip" возвращает расстояние 1 - <q, v>
+            return labels.astype(np.int64), 1.0 - distances
+        scores, labels = self._index.search(queries, k)
+        return labels.astype(np.int64), scores
+
+    @classmethod
+    def from_texts(cls, texts: list, embedding, metadatas: list = None, ids: list = None, **kwargs):
+        kwargs.setdefault("backend", config.VECTOR_BACKEND)
+        return super().from_texts(texts, embedding, metadatas=metadatas, ids=ids, **kwargs)
+
+    def measure_recall(self, k: int = None, n_queries: int = 200, seed: int = 0) -> float:
+        """
+        recall@k относительно точного поиска (NumpyVectorStore)
+
+        Запросы - нормализованные суммы пар случайных векторов корпуса:
+        они лежат "между" документами, как реальные вопросы, а не совпадают с чанком.
+        """
+        k = k or config.SEMANTIC_RETRIEVER_K
+        n = len(self.chunks)
+        if n == 0:
+            return 1.0
+        k = min(k, n)
+        rng = np.random.default_rng(seed)
+        pairs = rng.integers(0, n, size=(min(n_queries, n), 2))
+        queries = index_store.normalize_rows(self.vectors[pairs[:, 0]] + self.vectors[pairs[:, 1]])
+        exact, _ = NumpyVectorStore(self.embedding, self.chunks, self.vectors, normalized=True).search_ids(queries, k)
+        approx, _ = self.search_ids(queries, k)
+        hits = sum(len(set(a.tolist()) & set(e.tolist())) for a, e in zip(approx, exact))
+        self.recall_at_k = hits / (len(queries) * k)
+        logger.info(f"ANN ({self.backend}) recall@{k} vs exact search: {self.recall_at_k:.3f}")
+        return self.recall_at_k
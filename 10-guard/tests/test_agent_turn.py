@@ -0,0 +1,73 @@
+"""
+Ответ и источники текущего хода собираются из stream агента (agent._run_agent_stream)
+
+PIIMiddleware.after_model возвращает весь список сообщений состояния, а не только ответ модели:
+в ход не должны попадать вопрос клиента и сообщения прошлых ходов.
+"""
+import asyncio
+import sys
+from pathlib import Path
+
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.tools import tool
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+import agent  # noqa: E402
+from config import config  # noqa: E402
+
+
+class FakeToolModel(GenericFakeChatModel):
+    """Модель с заранее заданными ответами (create_agent вызывает bind_tools)"""
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+
+@tool(response_format="content_and_artifact")
+async def rag_search(query: str):
+    """Поиск информации в документах банка"""
+    return "Вклад можно закрыть в приложении", {
+        "sources": [{"source": "deposits.pdf", "page": 1, "page_content": "Вклад можно закрыть в приложении"}]
+    }
+
+
+def test_two_turn_dialogue_with_pii_in_answer(monkeypatch):
+    model = FakeToolModel(messages=iter([
+        AIMessage(content="", tool_calls=[{"name": "rag_search", "args": {"query": "закрыть вклад"}, "id": "call-1"}]),
+        AIMessage(content="Закройте вклад в приложении или позвоните +7 495 123-45-67"),
+        AIMessage(content="Курс уточните по телефону 8 800 555-35-35"),
+    ]))
+    monkeypatch.setattr(agent, "ChatOpenAI", lambda **kwargs: model)
+    monkeypatch.setattr(agent, "rag_search", rag_search)
+    monkeypatch.setattr(agent, "checkpointer", None)
+    monkeypatch.setattr(agent, "history_middleware", None)
+    monkeypatch.setattr(agent, "mcp_pool", None)
+    monkeypatch.setattr(config, "CHECKPOINT_BACKEND", "memory")
+    monkeypatch.setattr(config, "HISTORY_SUMMARY_ENABLED", False)
+
+    async def dialogue():
+        monkeypatch.setattr(agent, "bank_agent", await agent.create_bank_agent())
+        agent_config = {"configurable": {"thread_id": "test-chat"}}
+        first = await agent._run_agent_stream(
+            {"messages": [HumanMessage(content="Как закрыть вклад?")]}, agent_config, chat_id=1
+        )
+        second = await agent._run_agent_stream(
+            {"messages": [HumanMessage(content="А какой курс доллара?")]}, agent_config, chat_id=1
+        )
+        return first, second
+
+    first, second = asyncio.run(dialogue())
+
+    assert first["answer"].startswith("Закройте вклад в приложении")
+    assert "123-45-67" not in first["answer"]
+    assert [doc["source"] for doc in first["documents"]] == ["deposits.pdf"]
+    assert first["tools"] == {"rag_search"}
+
+    # Второй ход: ответ модели (замаскированный), а не вопрос клиента; источники и инструменты
+    # первого хода не попадают в ответ
+    assert second["answer"].startswith("Курс уточните по телефону")
+    assert "555-35-35" not in second["answer"]
+    assert second["documents"] == []
+    assert second["tools"] == set()
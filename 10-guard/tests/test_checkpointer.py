@@ -0,0 +1,104 @@
+"""
+BoundedSqliteSaver: история чата переживает перезапуск, старые версии удаляются
+
+Граф - минимальный StateGraph с reducer add_messages, как у агента: каждый ход добавляет
+вопрос и ответ и создает несколько checkpoints.
+"""
+import sqlite3
+import sys
+from pathlib import Path
+
+from langchain_core.messages import AIMessage, HumanMessage
+from langgraph.graph import START, MessagesState, StateGraph
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from checkpointer import BoundedSqliteSaver  # noqa: E402
+
+
+def build_graph(checkpointer):
+    def answer(state: MessagesState):
+        return {"messages": [AIMessage(content=f"Ответ на: {state['messages'][-1].content}")]}
+
+    graph = StateGraph(MessagesState)
+    graph.add_node("answer", answer)
+    graph.add_edge(START, "answer")
+    return graph.compile(checkpointer=checkpointer)
+
+
+def run_turns(graph, thread_id: str, questions: list):
+    config = {"configurable": {"thread_id": thread_id}}
+    for question in questions:
+        graph.invoke({"messages": [HumanMessage(content=question)]}, config)
+
+
+def history(graph, thread_id: str) -> list:
+    state = graph.get_state({"configurable": {"thread_id": thread_id}})
+    return [msg.content for msg in state.values.get("messages", [])]
+
+
+def count_rows(path: Path, table: str, thread_id: str) -> int:
+    with sqlite3.connect(path) as conn:
+        return conn.execute(f"SELECT COUNT(*) FROM {table} WHERE thread_id = ?", (thread_id,)).fetchone()[0]
+
+
+def test_history_restored_after_reopen_and_old_versions_compacted(tmp_path):
+    path = tmp_path / "checkpoints.sqlite"
+    questions = ["Как открыть вклад?", "Какая ставка?", "Можно ли пополнять?", "Как закрыть?"]
+    expected = [text for question in questions for text in (question, f"Ответ на: {question}")]
+
+    saver = BoundedSqliteSaver(str(path), keep_versions=2, flush_interval=3600)
+    graph = build_graph(saver)
+    run_turns(graph, "chat-1", questions)
+    run_turns(graph, "chat-2", ["Где мой перевод?"])
+    assert history(graph, "chat-1") == expected
+    saver.close()
+
+    # В файле - только последние keep_versions checkpoints чата и версии каналов, на которые они ссылаются
+    assert count_rows(path, "checkpoints", "chat-1") == 2
+    with sqlite3.connect(path) as conn:
+        message_versions = conn.execute(
+            "SELECT COUNT(*) FROM checkpoint_blobs WHERE thread_id = ? AND channel = 'messages'", ("chat-1",)
+        ).fetchone()[0]
+    assert 1 <= message_versions <= 2
+
+    reopened = BoundedSqliteSaver(str(path), keep_versions=2, flush_interval=3600)
+    graph = build_graph(reopened)
+    assert history(graph, "chat-1") == expected
+    assert history(graph, "chat-2") == ["Где мой перевод?", "Ответ на: Где мой перевод?"]
+
+    # Продолжение диалога после перезапуска дописывается к восстановленной истории
+    run_turns(graph, "chat-1", ["Спасибо"])
+    assert history(graph, "chat-1") == [*expected, "Спасибо", "Ответ на: Спасибо"]
+    reopened.close()
+    assert count_rows(path, "checkpoints", "chat-1") == 2
+
+
+def test_idle_thread_evicted_and_reloaded(tmp_path):
+    saver = BoundedSqliteSaver(str(tmp_path / "checkpoints.sqlite"), idle_seconds=0, flush_interval=3600)
+    graph = build_graph(saver)
+    run_turns(graph, "chat-1", ["Как заказать карту?"])
+
+    saver.flush()
+    saver.evict_idle()
+    assert "chat-1" not in saver.storage
+    assert saver.stats()["evictions"] == 1
+
+    assert history(graph, "chat-1") == ["Как заказать карту?", "Ответ на: Как заказать карту?"]
+    assert saver.stats()["loads"] == 1
+    saver.close()
+
+
+def test_deleted_thread_not_restored(tmp_path):
+    path = tmp_path / "checkpoints.sqlite"
+    saver = BoundedSqliteSaver(str(path), flush_interval=3600)
+    graph = build_graph(saver)
+    run_turns(graph, "chat-1", ["Как заказать карту?"])
+    saver.flush()
+    saver.delete_thread("chat-1")
+    saver.close()
+
+    assert count_rows(path, "checkpoints", "chat-1") == 0
+    reopened = BoundedSqliteSaver(str(path), flush_interval=3600)
+    assert history(build_graph(reopened), "chat-1") == []
+    reopened.close()